@@ -0,0 +1,136 @@
+"""A stand-in for TWS behind ``broker_ql_plugin_tws.data.ib``, for benchmarks that must not need a live gateway.
+
+``FakeTWS(...).install(ib)`` fills the ib_async wrapper with generated tickers, open trades, positions
+and account values, and replaces the request methods the plugin calls with local answers. Orders are
+acknowledged on the next loop iteration through the same events TWS would fire, and ``ticks``
+publishes random quote updates through ``pendingTickersEvent``.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import random
+from datetime import date, timedelta
+
+from ib_async import AccountValue, BarData, Contract, Order, OrderStatus, Position, Ticker, Trade
+
+
+class FakeTWS:
+
+    def __init__(self, tickers: int = 500, trades: int = 2000, positions: int = 200, accounts: int = 2,
+                 bars: int = 60, seed: int = 7):
+        self.random = random.Random(seed)
+        self.symbols = [f"S{i:04d}" for i in range(tickers)]
+        self.accounts = [f"DU{i:05d}" for i in range(accounts)]
+        self.trade_count = trades
+        self.position_count = min(positions, tickers)
+        self.bar_count = bars
+        self.contracts = {symbol: Contract(symbol=symbol, secType='STK', exchange='SMART', currency='USD',
+                                           conId=i + 1) for i, symbol in enumerate(self.symbols)}
+        self.ib = None
+        self._order_ids = itertools.count(1)
+
+    def install(self, ib):
+        self.ib = ib
+        wrapper = ib.wrapper
+        wrapper.accounts = list(self.accounts)
+        for symbol, contract in self.contracts.items():
+            price = self.random.uniform(10, 500)
+            wrapper.tickers[id(contract)] = Ticker(contract=contract, bid=price - 0.01, ask=price + 0.01, last=price,
+                                                   open=price, high=price * 1.01, low=price * 0.99, close=price)
+        for account in self.accounts:
+            for tag, value in (('NetLiquidation', 1_000_000.0), ('TotalCashValue', 250_000.0)):
+                wrapper.acctSummary[(account, tag, 'USD')] = AccountValue(account, tag, str(value), 'USD', '')
+        for symbol in self.symbols[:self.position_count]:
+            account = self.random.choice(self.accounts)
+            contract = self.contracts[symbol]
+            position = Position(account, contract, float(self.random.randint(1, 1000)), self.random.uniform(10, 500))
+            wrapper.positions[account][contract.conId] = position
+            ib.positionEvent.emit(position)
+        for _ in range(self.trade_count):
+            symbol = self.random.choice(self.symbols)
+            order = Order(orderId=next(self._order_ids), account=self.random.choice(self.accounts),
+                          action=self.random.choice(('BUY', 'SELL')), totalQuantity=self.random.randint(1, 500),
+                          orderType='LMT', lmtPrice=round(self.random.uniform(10, 500), 2), tif='GTC')
+            trade = Trade(self.contracts[symbol], order, OrderStatus(orderId=order.orderId, status='Submitted'))
+            wrapper.trades[order.orderId] = trade
+            ib.openOrderEvent.emit(trade)
+
+        ib.isConnected = lambda: True
+        ib.client.getReqId = lambda: next(self._order_ids)
+        ib.placeOrder = self.place_order
+        ib.cancelOrder = self.cancel_order
+        ib.reqMktData = self.req_mkt_data
+        ib.cancelMktData = lambda contract, *args: None
+        ib.reqHistoricalDataAsync = self.req_historical_data
+        ib.qualifyContractsAsync = self.qualify_contracts
+        return self
+
+    def place_order(self, contract: Contract, order: Order) -> Trade:
+        if not order.orderId:
+            order.orderId = next(self._order_ids)
+        trade = self.ib.wrapper.trades.get(order.orderId)
+        if trade is None:
+            trade = Trade(contract, order, OrderStatus(orderId=order.orderId, status='PreSubmitted'))
+            self.ib.wrapper.trades[order.orderId] = trade
+            self.ib.newOrderEvent.emit(trade)
+        else:
+            trade.order = order
+            self.ib.orderModifyEvent.emit(trade)
+
+        def acknowledge():
+            trade.orderStatus.status = 'Submitted'
+            self.ib.openOrderEvent.emit(trade)
+            self.ib.orderStatusEvent.emit(trade)
+
+        asyncio.get_running_loop().call_soon(acknowledge)
+        return trade
+
+    def cancel_order(self, order: Order):
+        trade = self.ib.wrapper.trades.get(order.orderId)
+        if trade is not None:
+            trade.orderStatus.status = 'Cancelled'
+            self.ib.orderStatusEvent.emit(trade)
+        return trade
+
+    def req_mkt_data(self, contract: Contract, *args, **kwargs) -> Ticker:
+        ticker = self.ib.wrapper.tickers.get(id(contract))
+        if ticker is None:
+            ticker = self.ib.wrapper.tickers[id(contract)] = Ticker(contract=contract)
+        return ticker
+
+    async def req_historical_data(self, contract: Contract, *args, **kwargs):
+        await asyncio.sleep(0)
+        rng = random.Random(contract.symbol)
+        price, start, bars = rng.uniform(10, 500), date(2024, 1, 1), []
+        for i in range(self.bar_count):
+            close = price * (1 + rng.gauss(0, 0.02))
+            bars.append(BarData(date=start + timedelta(days=i), open=price, high=max(price, close) * 1.01,
+                                low=min(price, close) * 0.99, close=close, volume=float(rng.randint(10_000, 1_000_000))))
+            price = close
+        return bars
+
+    async def qualify_contracts(self, *contracts: Contract):
+        await asyncio.sleep(0)
+        qualified = []
+        for contract in contracts:
+            known = self.contracts.get(contract.symbol)
+            if known is not None:
+                contract.conId = known.conId
+                qualified.append(contract)
+        return qualified
+
+    async def ticks(self, per_second: float):
+        """Move a random ticker's prices ``per_second`` times a second, in batches like ib_async's."""
+        if per_second <= 0:
+            return
+        tickers = list(self.ib.wrapper.tickers.values())
+        batch = max(1, int(per_second / 100))
+        while True:
+            await asyncio.sleep(batch / per_second)
+            changed = set()
+            for ticker in self.random.sample(tickers, min(batch, len(tickers))):
+                ticker.last *= 1 + self.random.gauss(0, 0.001)
+                ticker.bid, ticker.ask = ticker.last - 0.01, ticker.last + 0.01
+                changed.add(ticker)
+            self.ib.pendingTickersEvent.emit(changed)
@@ -0,0 +1,74 @@
+"""Import time of the ``broker-ql`` startup stages, each measured in fresh interpreters.
+
+Every stage runs ``--repeat`` times in a new ``python`` process and reports the median milliseconds
+its code takes, interpreter startup excluded, and which heavy dependencies it loaded. The report is
+JSON on stdout, or in ``--output``.
+
+    python benchmarks/import_time.py --repeat 7
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('numpy', 'ib_async', 'mycli', 'sqlglot', 'mysql_mimic', 'nest_asyncio')
+
+STAGES = {
+    'package': "import broker_ql",
+    'parse_args': "from broker_ql.entrypoints.main import parse_args_config\n"
+                  "parse_args_config(['--cnf', CNF, '--plugins=tws'])",
+    'server': "import broker_ql.server",
+    'plugin': "import broker_ql.server, broker_ql_plugin_tws\nbroker_ql_plugin_tws.init",
+    'first_ta_query': "import broker_ql.server, broker_ql_plugin_tws\nbroker_ql_plugin_tws.init\n"
+                      "from broker_ql.ta import TA_Sma\nTA_Sma.apply([1.0, 2.0, 3.0], [2, 2, 2])",
+}
+
+PROBE = """
+import json, sys, time
+CNF = {cnf!r}
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(code: str, cnf: str) -> dict:
+    probe = PROBE.format(cnf=cnf, code=code, heavy=HEAVY)
+    output = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, check=True, capture_output=True, text=True,
+                            env={**os.environ, 'PYTHONPATH': ROOT}).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args):
+    report = {'python': sys.version.split()[0], 'repeat': args.repeat, 'stages': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        cnf = os.path.join(tmp, 'broker_ql.conf')
+        for name, code in STAGES.items():
+            if args.only and name not in args.only:
+                continue
+            # one untimed run so every stage reads warm .pyc files
+            measure(code, cnf)
+            runs = [measure(code, cnf) for _ in range(args.repeat)]
+            report['stages'][name] = {
+                'median_ms': round(statistics.median(run['ms'] for run in runs), 1),
+                'min_ms': round(min(run['ms'] for run in runs), 1),
+                'loaded': runs[-1]['loaded'],
+            }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help='stages to run, all by default')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    main(parser.parse_args())
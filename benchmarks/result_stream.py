@@ -0,0 +1,71 @@
+"""Rows/sec of streaming a text resultset to a client socket.
+
+``per_packet`` is mysql_mimic's row encoding with a drain after every packet, ``batched`` is
+broker_ql's Connection, which encodes rows with per-resultset encoders and drains by byte threshold.
+
+    python benchmarks/result_stream.py --rows 100000 --buffer-size 65536
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date, timedelta
+
+from mysql_mimic.results import ensure_result_set
+from mysql_mimic.connection import Connection as _Connection
+from mysql_mimic.stream import MysqlStream
+
+from broker_ql.connection import Connection
+from broker_ql.session import Session
+
+
+async def _sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, done: asyncio.Event):
+    while await reader.read(1 << 20):
+        pass
+    writer.close()
+    done.set()
+
+
+def _rows(count: int):
+    start = date(2000, 1, 1)
+    return [('AAPL', start + timedelta(days=i), 100.0 + i % 7, 101.5, 99.25, 100.5, 12345 + i) for i in range(count)]
+
+
+async def _stream(rows, columns, buffer_size: int, batched: bool) -> float:
+    done = asyncio.Event()
+    server = await asyncio.start_server(lambda r, w: _sink(r, w, done), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    connection = Connection(stream=MysqlStream(reader, writer, buffer_size=buffer_size), session=Session(),
+                            control=None, identity_provider=None)
+    result_set = await ensure_result_set((rows, columns))
+    started = time.perf_counter()
+    packets = connection.text_resultset(result_set) if batched else _Connection.text_resultset(connection, result_set)
+    async for packet in packets:
+        await connection.stream.write(packet, drain=not batched)
+    await connection.stream.drain()
+    elapsed = time.perf_counter() - started
+    writer.close()
+    await done.wait()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+
+async def main(args):
+    rows = _rows(args.rows)
+    columns = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume']
+    report = {'rows': args.rows, 'buffer_size': args.buffer_size}
+    for name, batched in (('per_packet', False), ('batched', True)):
+        elapsed = min([await _stream(rows, columns, args.buffer_size, batched) for _ in range(args.repeat)])
+        report[name] = {'seconds': round(elapsed, 4), 'rows_per_sec': round(args.rows / elapsed)}
+    report['speedup'] = round(report['batched']['rows_per_sec'] / report['per_packet']['rows_per_sec'], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--buffer-size', type=int, default=2 ** 16)
+    parser.add_argument('--repeat', type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,186 @@
+"""Latency and throughput of representative queries over the MySQL protocol, against a fake TWS.
+
+The server runs in a child process with the tws plugin talking to ``FakeTWS``. Each workload is
+driven by ``--clients`` concurrent pymysql connections for ``--duration`` seconds, and the report
+is JSON on stdout, or in ``--output``.
+
+    python benchmarks/workload.py --tickers 500 --trades 2000 --clients 8 --duration 5
+"""
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymysql  # noqa: E402
+
+
+def _serve(args, port: int):
+    import asyncio
+
+    async def main():
+        # ib_async wants a running loop when the plugin creates its IB
+        from broker_ql.server import BrokerQLServer
+        from broker_ql_plugin_tws import data
+        from fake_tws import FakeTWS
+
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'server': {'plugins': 'tws', 'engine': args.engine, 'offload': args.offload},
+            # IBKR's historical data pacing would dominate the ohlcv workloads, the fake answers at once
+            'plugin_tws': {'host': '127.0.0.1', 'port': '0', 'contract_cache_path': '', 'order_ack_timeout': '1',
+                           'hist_pacing_requests': '1000000', 'hist_pacing_period': '1', 'hist_identical_interval': '0'},
+        })
+        fake = FakeTWS(args.tickers, args.trades, args.positions, args.accounts, args.bars).install(data.ib)
+        server = BrokerQLServer(config, host='127.0.0.1', port=port)
+        asyncio.ensure_future(fake.ticks(args.ticks_per_sec))
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _connect(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return pymysql.connect(host='127.0.0.1', port=port, user='bench', password='', database='tws',
+                                   autocommit=True)
+        except pymysql.err.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def workloads(args):
+    symbols = [f"S{i:04d}" for i in range(args.tickers)]
+    order_ids = list(range(1, args.trades + 1))
+
+    def quotes_point(rng):
+        return [f"select symbol, bid, ask, last from quotes where symbol = '{rng.choice(symbols)}'"]
+
+    def ta_screen(rng):
+        return ["select symbol, ta_highest(high, 20) as high_20, ta_sma(close, 20) as sma_20, ta_rsi(close, 14) as rsi "
+                "from ohlcv group by symbol having rsi < 70"]
+
+    def positions_join(rng):
+        return ["select p.account, p.symbol, p.position * q.last as exposure "
+                "from positions p join quotes q on p.symbol = q.symbol"]
+
+    def orders_basket(rng):
+        values = ', '.join(f"('{rng.choice(symbols)}', 'BUY', 10, 'LMT', {rng.uniform(10, 500):.2f}, 'GTC')"
+                           for _ in range(args.basket))
+        ids = ', '.join(str(i) for i in rng.sample(order_ids, args.basket))
+        return [f"insert into orders (symbol, action, total_quantity, order_type, lmt_price, tif) values {values}",
+                f"update orders set lmt_price = lmt_price + 0.01 where order_id in ({ids})"]
+
+    return {'quotes_point': quotes_point, 'ta_screen': ta_screen, 'positions_join': positions_join,
+            'orders_basket': orders_basket}
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_workload(port: int, make_statements, clients: int, duration: float, seed: int):
+    latencies, rows, errors = [], [0], []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def client(index):
+        rng = random.Random(seed + index)
+        connection = _connect(port)
+        cursor = connection.cursor()
+        start.wait()
+        deadline = time.monotonic() + duration
+        own, own_rows = [], 0
+        while time.monotonic() < deadline:
+            began = time.perf_counter()
+            try:
+                for statement in make_statements(rng):
+                    cursor.execute(statement)
+                    own_rows += len(cursor.fetchall())
+            except pymysql.MySQLError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            own.append(time.perf_counter() - began)
+        connection.close()
+        with lock:
+            latencies.extend(own)
+            rows[0] += own_rows
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'rows_per_sec': round(rows[0] / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def main(args):
+    port = _free_port()
+    server = multiprocessing.Process(target=_serve, args=(args, port), daemon=True)
+    server.start()
+    try:
+        _connect(port).close()
+        report = {'config': {k: v for k, v in vars(args).items() if k != 'output'}, 'workloads': {}}
+        for name, make_statements in workloads(args).items():
+            if args.only and name not in args.only:
+                continue
+            # one untimed pass fills the plan, contract and bar caches
+            run_workload(port, make_statements, 1, 0.2, args.seed)
+            report['workloads'][name] = run_workload(port, make_statements, args.clients, args.duration, args.seed)
+    finally:
+        server.terminate()
+        server.join()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--trades', type=int, default=2000)
+    parser.add_argument('--positions', type=int, default=200)
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--bars', type=int, default=60)
+    parser.add_argument('--basket', type=int, default=10)
+    parser.add_argument('--ticks-per-sec', type=float, default=200)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--engine', default='python', choices=['python', 'vectorized'])
+    parser.add_argument('--offload', default='thread', choices=['inline', 'thread', 'process'])
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--only', nargs='*', help='workloads to run, all by default')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    main(parser.parse_args())
@@ -1,3 +1,10 @@
-from .server import BrokerQLServer
 # noinspection PyUnresolvedReferences
 from .util import reloading
+
+
+def __getattr__(name):
+    # the server pulls in mysql_mimic and sqlglot, plugins and the entry point import the package without it
+    if name == 'BrokerQLServer':
+        from .server import BrokerQLServer
+        return BrokerQLServer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
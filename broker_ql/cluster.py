@@ -0,0 +1,631 @@
+"""One gateway process talking to the brokers, and ``workers`` processes serving MySQL clients.
+
+With ``workers = N`` in the server section, ``broker-ql`` starts the plugins in a gateway process,
+which never listens for clients, and N worker processes that all listen on ``port`` with
+``SO_REUSEPORT``, so the kernel spreads connections over them and TWS still sees one clientId.
+
+The gateway publishes every table a plugin tracks, see ``VIEWS.track``, in a shared memory segment
+per table, at most once every ``publish_interval`` seconds however often it changes. Workers read
+those tables straight from memory and run the selects, so parsing, planning and execution of many
+clients use many cores. Everything else goes to the gateway over a unix socket: untracked tables like
+``ohlcv``, tables too large for ``shared_table_size`` bytes, tables of a database that isn't ready,
+inserts, updates and deletes, and the SQL functions plugins add, like ``TWS_NEXT_ORDER_ID()``.
+
+A worker sees changes up to ``publish_interval`` late, except those of its own statements, which
+the gateway publishes before it answers. Materialized views, SUBSCRIBE, the result cache and the
+plan cache are per worker, and ``/metrics`` is served by the gateway, with its own metrics only.
+"""
+from __future__ import annotations
+
+import asyncio
+import configparser
+import functools
+import io
+import itertools
+import os
+import pickle
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+from io import UnsupportedOperation
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+from mysql_mimic.errors import MysqlError, ErrorCode
+from mysql_mimic.variables import SYSTEM_VARIABLES
+from sqlglot.executor.env import ENV as _ENV
+from sqlglot.executor.table import Table
+
+from . import metrics
+from .executor import as_table
+from .pushdown import Pushdown
+from .server import BrokerQLServer
+from .session import Session
+from .views import VIEWS
+
+# version, payload length, payload crc32, an odd version while the gateway is writing
+HEADER = struct.Struct('<QQI')
+# payload length of a table workers have to ask the gateway for
+REMOTE = 2 ** 64 - 1
+LENGTH = struct.Struct('<I')
+
+PUBLISHES = metrics.counter('broker_ql_cluster_publishes_total', 'Tables published to the workers', ('db', 'table'))
+
+
+class SharedTable:
+    """A table in a shared memory segment, written by the gateway and read by any number of workers."""
+
+    def __init__(self, name: str, size: int = 0, create: bool = False):
+        self.memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.name = self.memory.name
+        # workers share the gateway's resource tracker, so only the gateway's unlink releases it
+        self.owner = create
+        self._version = 0
+        self._table: Optional[Table] = None
+
+    def publish(self, table: Optional[Table]):
+        """Write ``table``, or with None tell readers to ask the gateway."""
+        payload = b'' if table is None else pickle.dumps((list(table.columns), table.rows), pickle.HIGHEST_PROTOCOL)
+        length = len(payload) if table is not None and HEADER.size + len(payload) <= self.memory.size else REMOTE
+        buffer = self.memory.buf
+        self._version += 1
+        HEADER.pack_into(buffer, 0, self._version, 0, 0)
+        if length != REMOTE:
+            buffer[HEADER.size:HEADER.size + length] = payload
+        self._version += 1
+        HEADER.pack_into(buffer, 0, self._version, length, zlib.crc32(payload) if length != REMOTE else 0)
+
+    def version(self) -> int:
+        return HEADER.unpack_from(self.memory.buf, 0)[0]
+
+    def read(self) -> Tuple[Optional[int], Optional[Table]]:
+        """``(version, table)``, a None table when the gateway has to be asked, a None version while it writes."""
+        buffer = self.memory.buf
+        version, length, crc = HEADER.unpack_from(buffer, 0)
+        if version == 0:
+            return 0, None
+        if version & 1:
+            return None, None
+        if version == self._version:
+            return version, self._copy()
+        table = None
+        if length != REMOTE:
+            if HEADER.size + length > self.memory.size:
+                return None, None
+            payload = bytes(buffer[HEADER.size:HEADER.size + length])
+            if HEADER.unpack_from(buffer, 0)[0] != version or zlib.crc32(payload) != crc:
+                return None, None
+            columns, rows = pickle.loads(payload)
+            table = Table(columns, rows)
+        elif HEADER.unpack_from(buffer, 0)[0] != version:
+            return None, None
+        self._version, self._table = version, table
+        return version, self._copy()
+
+    def _copy(self) -> Optional[Table]:
+        # decoded once per version, but every query iterates its own Table
+        return Table(self._table.columns, self._table.rows) if self._table is not None else None
+
+    def close(self):
+        self._table = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return pickle.loads(await reader.readexactly(length))
+
+
+def _frame(message) -> bytes:
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return LENGTH.pack(len(payload)) + payload
+
+
+def _error(e: BaseException):
+    if isinstance(e, UnsupportedOperation):
+        return ('unsupported',)
+    if isinstance(e, MysqlError):
+        return ('mysql', e.msg, int(e.code))
+    return ('error', str(e) or traceback.format_exc())
+
+
+def _raise(error):
+    if error[0] == 'unsupported':
+        raise UnsupportedOperation()
+    if error[0] == 'mysql':
+        raise MysqlError(error[1], code=ErrorCode(error[2]))
+    raise MysqlError(error[1], code=ErrorCode.UNKNOWN_ERROR)
+
+
+def _to_table(rows, columns) -> Optional[Table]:
+    if rows is None or isinstance(rows, Table):
+        return rows
+    return as_table(rows) or Table(list(columns), [])
+
+
+class Gateway:
+    """The process owning the plugins, their broker connections and the worker processes."""
+
+    def __init__(self, config: configparser.ConfigParser):
+        self.config = config
+        server_cnf = config[config.default_section]
+        self.workers = server_cnf.getint('workers', 0)
+        self.publish_interval = server_cnf.getfloat('publish_interval', 0.05)
+        self.shared_table_size = server_cnf.getint('shared_table_size', 8 * 2 ** 20)
+        self.server = BrokerQLServer(config)
+        self.directory = tempfile.mkdtemp(prefix='broker_ql_')
+        self.address = os.path.join(self.directory, 'gateway.sock')
+        self.tables: Dict[Tuple[str, str], SharedTable] = {}
+        self.processes = []
+        self._dirty = set()
+        self._wake = None
+        self._publishing = None
+        self._waiting = set()
+        # sessions with an open transaction, by (rpc connection, worker session)
+        self._sessions: Dict[Tuple[int, int], Session] = {}
+        self._rpc = None
+        self._tasks = []
+
+    async def start(self):
+        """Start the plugins, the tables, the socket workers call and the workers."""
+        self._wake = asyncio.Event()
+        self._publishing = asyncio.Lock()
+        await self.server.start_plugins()
+        for i, (db, table) in enumerate(sorted(VIEWS.tracked)):
+            if db in Session.DATA_PROVIDERS:
+                self.tables[(db, table)] = SharedTable(f"bql{os.getpid()}_{i}", self.shared_table_size, create=True)
+        VIEWS.listeners.append(self._changed)
+        self._dirty.update(self.tables)
+        self._wake.set()
+        self._rpc = await asyncio.start_unix_server(self._serve, self.address)
+        self._tasks.append(asyncio.ensure_future(self._publish_loop()))
+        self.processes = [self._spawn() for _ in range(self.workers)]
+        metrics.gauge('broker_ql_cluster_workers', 'Worker processes alive',
+                      function=lambda: {(): float(sum(p.is_alive() for p in self.processes))})
+
+    async def run(self):
+        await self.start()
+        print(f"gateway serving {self.workers} workers on port {self.config[self.config.default_section]['port']}")
+        while True:
+            await asyncio.sleep(1)
+            for i, process in enumerate(self.processes):
+                if not process.is_alive():
+                    print(f"worker {process.pid} exited with {process.exitcode}, restarting")
+                    self.processes[i] = self._spawn()
+
+    def _spawn(self):
+        # workers import the server alone, not the plugins and their broker libraries
+        process = get_context('spawn').Process(target=_worker, args=(_config_text(self.config), self.address),
+                                               daemon=True)
+        process.start()
+        return process
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(5)
+        for task in self._tasks:
+            task.cancel()
+        if self._rpc is not None:
+            self._rpc.close()
+        if self._changed in VIEWS.listeners:
+            VIEWS.listeners.remove(self._changed)
+        self.server.close()
+        for table in self.tables.values():
+            table.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _changed(self, db: str, table: str):
+        if (db, table) in self.tables:
+            self._dirty.add((db, table))
+            self._wake.set()
+
+    async def _publish_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                await self.publish()
+            except Exception:
+                print(traceback.format_exc())
+            # changes in the meantime wait for the next round, however many there are
+            await asyncio.sleep(self.publish_interval)
+
+    async def publish(self):
+        """Write the tables changed since the last publish."""
+        async with self._publishing:
+            dirty, self._dirty = self._dirty, set()
+            for db, name in sorted(dirty):
+                table = self.tables[(db, name)]
+                ready = Session.READY.get(db)
+                if ready is not None and not (ready.done() and not ready.cancelled() and ready.exception() is None):
+                    table.publish(None)
+                    if ready not in self._waiting:
+                        self._waiting.add(ready)
+                        ready.add_done_callback(functools.partial(self._became_ready, db))
+                    continue
+                try:
+                    rows = Session.DATA_PROVIDERS[db](name, None)
+                    if asyncio.iscoroutine(rows):
+                        rows = await rows
+                    table.publish(_to_table(rows, self._schema().get(db, {}).get(name, ())))
+                except Exception:
+                    print(traceback.format_exc())
+                    table.publish(None)
+                PUBLISHES.inc(db=db, table=name)
+
+    def _became_ready(self, db: str, ready: asyncio.Future):
+        self._waiting.discard(ready)
+        for key in self.tables:
+            if key[0] == db:
+                self._changed(*key)
+
+    @staticmethod
+    def _schema() -> Dict[str, Dict[str, Any]]:
+        schema = {}
+        for provider in Session.SCHEMA_PROVIDERS:
+            # views are the workers' own
+            if provider != VIEWS.schema:
+                schema.update(provider())
+        return schema
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        lock = asyncio.Lock()
+
+        async def answer(request_id, op, args):
+            try:
+                reply = (request_id, True, await getattr(self, f'_rpc_{op}')(id(writer), *args))
+            except Exception as e:
+                reply = (request_id, False, _error(e))
+            async with lock:
+                try:
+                    writer.write(_frame(reply))
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+        try:
+            while True:
+                request_id, op, args = await _read_frame(reader)
+                task = asyncio.ensure_future(answer(request_id, op, args))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # a worker went away, or the gateway is shutting down
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            for key in [key for key in self._sessions if key[0] == id(writer)]:
+                del self._sessions[key]
+            writer.close()
+
+    async def _rpc_describe(self, connection: int):
+        return {
+            'schema': self._schema(),
+            'databases': sorted(Session.DATA_PROVIDERS),
+            'freshness': {db: dict(tables) for db, tables in Session.TABLE_FRESHNESS.items()},
+            'tables': {key: table.name for key, table in self.tables.items()},
+            'functions': sorted(_ENV),
+        }
+
+    async def _rpc_select(self, connection: int, timeout: float, db: str, name: str, where, pushdown):
+        session = self._session(connection, None, timeout)
+        await session._ready(db)
+        supplier = Session.DATA_PROVIDERS[db]
+        if pushdown is not None and Session._accepts_pushdown(supplier):
+            rows = supplier(name, where, pushdown=pushdown)
+        else:
+            rows = supplier(name, where)
+        if asyncio.iscoroutine(rows):
+            rows = await rows
+        table = _to_table(rows, self._schema().get(db, {}).get(name, ()))
+        return None if table is None else (list(table.columns), table.rows)
+
+    async def _rpc_function(self, connection: int, name: str, *args):
+        return _ENV[name](*args)
+
+    async def _rpc_insert(self, connection: int, key: int, timeout: float, in_trx: bool, db: str, name: str,
+                          fields, rows):
+        return await self._modify(connection, key, timeout, in_trx, db, Session.DATA_CREATORS, name, fields, rows)
+
+    async def _rpc_update(self, connection: int, key: int, timeout: float, in_trx: bool, db: str, name: str,
+                          rows, fields):
+        return await self._modify(connection, key, timeout, in_trx, db, Session.DATA_MODIFIERS, name, rows, fields)
+
+    async def _rpc_delete(self, connection: int, key: int, timeout: float, in_trx: bool, db: str, name: str, rows):
+        return await self._modify(connection, key, timeout, in_trx, db, Session.DATA_REMOVERS, name, rows)
+
+    async def _rpc_commit(self, connection: int, key: int):
+        session = self._sessions.pop((connection, key), None)
+        if session is not None:
+            await session.handle_query("commit", {})
+
+    async def _rpc_rollback(self, connection: int, key: int):
+        session = self._sessions.pop((connection, key), None)
+        if session is not None:
+            await session.handle_query("rollback", {})
+
+    def _session(self, connection: int, key: Optional[int], timeout: float) -> Session:
+        session = self._sessions.get((connection, key)) if key is not None else None
+        if session is None:
+            session = Session()
+        session.variables.set('broker_ql_ready_timeout', timeout)
+        return session
+
+    async def _modify(self, connection: int, key: int, timeout: float, in_trx: bool, db: str, handlers, name: str,
+                      *args):
+        session = self._session(connection, key, timeout)
+        session.in_trx = in_trx
+        session.warnings.clear()
+        handler = handlers.get(db)
+        if handler is None:
+            raise UnsupportedOperation()
+        await session._ready(db)
+        try:
+            result = handler(session, name, *args)
+            if asyncio.iscoroutine(result):
+                result = await result
+        finally:
+            if session.trx_commits or session.trx_rollbacks:
+                self._sessions[(connection, key)] = session
+            else:
+                self._sessions.pop((connection, key), None)
+            # the worker's next statement reads what this one changed
+            await self.publish()
+        return result, list(session.warnings), bool(session.trx_commits or session.trx_rollbacks)
+
+
+class GatewayClient:
+    """A worker's connection to the gateway, calls are multiplexed over one unix socket."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.closed: Optional[asyncio.Future] = None
+        self._writer = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._reading = None
+        # for SQL functions, which sqlglot's executor calls synchronously
+        self._socket = None
+        self._socket_lock = threading.Lock()
+
+    async def connect(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.address)
+                break
+            except (FileNotFoundError, ConnectionError):
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        self.closed = asyncio.get_running_loop().create_future()
+        self._reading = asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                request_id, ok, value = await _read_frame(reader)
+                future = self._pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(_Remote(value))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("gateway went away"))
+            self._pending.clear()
+            if not self.closed.done():
+                self.closed.set_result(None)
+
+    async def call(self, op: str, *args):
+        if self.closed.done():
+            raise MysqlError("Gateway is not available", code=ErrorCode.UNKNOWN_ERROR)
+        request_id = next(self._ids)
+        future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        self._writer.write(_frame((request_id, op, args)))
+        try:
+            return await future
+        except _Remote as e:
+            _raise(e.error)
+        except ConnectionError as e:
+            raise MysqlError(f"Gateway is not available: {e}", code=ErrorCode.UNKNOWN_ERROR)
+
+    def call_blocking(self, op: str, *args):
+        with self._socket_lock:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self.address)
+            self._socket.sendall(_frame((0, op, args)))
+            length, = LENGTH.unpack(_recv(self._socket, LENGTH.size))
+            _, ok, value = pickle.loads(_recv(self._socket, length))
+        if not ok:
+            _raise(value)
+        return value
+
+    def close(self):
+        if self._reading is not None:
+            self._reading.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._socket is not None:
+            self._socket.close()
+
+
+class _Remote(Exception):
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
+def _recv(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("gateway went away")
+        data += chunk
+    return bytes(data)
+
+
+class RemoteDatabase:
+    """A database of the gateway, as the provider, creator, modifier and remover a worker's Session calls."""
+
+    def __init__(self, client: GatewayClient, db: str, tables: Dict[str, SharedTable], retries: int = 50):
+        self.client = client
+        self.db = db
+        self.tables = tables
+        self.retries = retries
+        self._keys = itertools.count(1)
+        # worker sessions with an open transaction on the gateway
+        self._open = set()
+
+    async def select(self, table_name: str, where: Optional[List[Dict]] = None, pushdown: Optional[Pushdown] = None):
+        # a WHERE clause comes as where=[], only ohlcv narrows its rows to the symbols found
+        shared = self.tables.get(table_name) if not where else None
+        if shared is not None:
+            for _ in range(self.retries):
+                version, table = shared.read()
+                if table is not None:
+                    # the whole table, the executor applies the pushdown again anyway
+                    return table
+                if version is not None:
+                    break
+                await asyncio.sleep(0.001)
+        result = await self.client.call('select', _timeout(None), self.db, table_name, where, pushdown)
+        return None if result is None else Table(*result)
+
+    async def insert(self, session: Session, table_name: str, fields: List[str], rows: List):
+        return await self._modify(session, 'insert', table_name, fields, rows)
+
+    async def update(self, session: Session, table_name: str, rows: List, fields: Dict):
+        return await self._modify(session, 'update', table_name, rows, fields)
+
+    async def delete(self, session: Session, table_name: str, rows: List):
+        return await self._modify(session, 'delete', table_name, rows)
+
+    async def _modify(self, session: Session, op: str, table_name: str, *args):
+        key = getattr(session, '_gateway_key', None)
+        if key is None:
+            key = session._gateway_key = next(self._keys)
+        result, warnings, pending = await self.client.call(op, key, _timeout(session), session.in_trx, self.db,
+                                                           table_name, *args)
+        session.warnings.extend(warnings)
+        if pending and key not in self._open:
+            # COMMIT and ROLLBACK run synchronously, like the calls to the broker they replace
+            self._open.add(key)
+            session.trx_commits.append(functools.partial(self._finish, 'commit', key))
+            session.trx_rollbacks.append(functools.partial(self._finish, 'rollback', key))
+        return result
+
+    def _finish(self, op: str, key: int):
+        if key in self._open:
+            self._open.discard(key)
+            asyncio.ensure_future(self.client.call(op, key)).add_done_callback(
+                lambda f: f.cancelled() or f.exception())
+
+
+def _timeout(session: Optional[Session]) -> float:
+    if session is None:
+        # a provider doesn't get the session, reads wait as long as a new session would
+        return SYSTEM_VARIABLES['broker_ql_ready_timeout'][1]
+    return session.variables.get('broker_ql_ready_timeout')
+
+
+def _config_text(config: configparser.ConfigParser) -> str:
+    text = io.StringIO()
+    config.write(text)
+    return text.getvalue()
+
+
+async def _watch(tables: Dict[Tuple[str, str], SharedTable], interval: float):
+    """Report each new version of a published table to the worker's views, subscriptions and result cache."""
+    handlers = {key: VIEWS.track(*key) for key in tables}
+    versions = {key: table.version() for key, table in tables.items()}
+    while True:
+        await asyncio.sleep(interval)
+        for key, table in tables.items():
+            version = table.version()
+            if version != versions[key] and not version & 1:
+                versions[key] = version
+                handlers[key]()
+
+
+async def serve_worker(config: configparser.ConfigParser, address: str):
+    client = GatewayClient(address)
+    await client.connect()
+    description = await client.call('describe')
+    tables = {key: SharedTable(name) for key, name in description['tables'].items()}
+    for db in description['databases']:
+        database = RemoteDatabase(client, db, {name: table for (owner, name), table in tables.items() if owner == db})
+        Session.DATA_PROVIDERS[db] = database.select
+        Session.DATA_CREATORS[db] = database.insert
+        Session.DATA_MODIFIERS[db] = database.update
+        Session.DATA_REMOVERS[db] = database.delete
+    Session.SCHEMA_PROVIDERS.append(lambda: description['schema'])
+    Session.TABLE_FRESHNESS.update(description['freshness'])
+    for name in description['functions']:
+        # the plugins' functions, like TWS_NEXT_ORDER_ID, run where the plugins do
+        if name not in _ENV:
+            _ENV[name] = functools.partial(client.call_blocking, 'function', name)
+
+    server_cnf = config[config.default_section]
+    server = BrokerQLServer(config, port=server_cnf.getint('port'))
+    # the plugins run in the gateway
+    server.plugins = ''
+    watching = asyncio.ensure_future(_watch(tables, server_cnf.getfloat('publish_interval', 0.05)))
+    serving = asyncio.ensure_future(server.serve_forever(reuse_port=True))
+    try:
+        await asyncio.wait([serving, client.closed], return_when=asyncio.FIRST_COMPLETED)
+        if serving.done():
+            serving.result()
+    finally:
+        watching.cancel()
+        serving.cancel()
+        server.close()
+        client.close()
+        for table in tables.values():
+            table.close()
+
+
+def _worker(config_text: str, address: str):
+    import nest_asyncio
+
+    nest_asyncio.apply()
+    config = configparser.ConfigParser(default_section='server')
+    config.optionxform = lambda option: option
+    config.read_string(config_text)
+    # one /metrics endpoint, the gateway's
+    config[config.default_section]['metrics_port'] = '0'
+    try:
+        asyncio.run(serve_worker(config, address))
+    except KeyboardInterrupt:
+        pass
+
+
+def run(config: configparser.ConfigParser):
+    """Run the gateway and its workers until interrupted."""
+    gateway = Gateway(config)
+
+    async def main():
+        try:
+            await gateway.run()
+        finally:
+            gateway.close()
+
+    asyncio.run(main())
@@ -1,16 +1,27 @@
+import asyncio
+import io
+import itertools
 import json
+from typing import Optional
 
 import mysql_mimic.results as _results
-from mysql_mimic import packets
+from mysql_mimic import packets, types
+from mysql_mimic.results import ResultSet, ResultColumn
 from mysql_mimic.connection import Connection as _Connection
+from mysql_mimic.prepared import PreparedStatement as _PreparedStatement, REGEX_PARAM
+from mysql_mimic.types import Capabilities
+from mysql_mimic.results import ensure_result_set
+from mysql_mimic.session import value_to_expression
+from mysql_mimic.utils import aiterate, cooperative_iterate
+from sqlglot import exp
+from sqlglot.errors import ParseError
 from sqlglot.executor.env import ENV as _ENV, null_if_any
-from sqlglot.expressions import Func, AggFunc
-from sqlglot.helper import subclasses
-from sqlglot.dialects.mysql import MySQL
-import numpy as np
 from time import sleep
 
+from . import metrics, ta  # noqa: F401 ta registers the TA_* aggregates
+from .executor import ASYNC_FUNCTIONS
 from .results import _ensure_result_cols, _qualify_outputs
+from .subscribe import REGEX_SUBSCRIBE, subscribe
 
 _results._ensure_result_cols = _ensure_result_cols
 
@@ -42,66 +53,212 @@ class Connection(_Connection):
             data=data,
         )
 
+        if REGEX_SUBSCRIBE.match(com_query.sql):
+            return await self.handle_subscribe(com_query.sql, com_query.query_attrs)
+
         result_set = await self.query(com_query.sql, com_query.query_attrs)
 
         if not result_set:
             affected_rows = 0
             if hasattr(result_set, 'affected_rows'):
                 affected_rows = result_set.affected_rows
-            await self.stream.write(self.ok(affected_rows=affected_rows))
+            await self.stream.write(self.ok(affected_rows=affected_rows, warnings=len(self.session.warnings)))
             return
 
-        async for packet in self.text_resultset(result_set):
-            await self.stream.write(packet)
-
-
-class OffsetAggFunc(AggFunc):
-    @classmethod
-    def offset_value(cls, column, offset=None):
-        values = [v for v in column]
-        if offset is not None:
-            offset = max(offset)
-            if offset > 0:
-                values = values[:-offset]
-        return values
-
-
-class TA_Lowest(OffsetAggFunc):
-    _sql_names = ["TA_LOWEST"]
-    arg_types = {"this": False, "window": False, "offset": False}
-
-    @classmethod
-    def apply(cls, column, window, offset=None):
-        values = cls.offset_value(column, offset)
-        window = max(window)
-        if len(values) >= window:
-            values = values[-window:]
-        return min([v for v in values if v is not None and not np.isnan(v)])
-
-
-_ENV["TA_LOWEST"] = TA_Lowest.apply
-
-
-class TA_Highest(OffsetAggFunc):
-    _sql_names = ["TA_HIGHEST"]
-    arg_types = {"this": False, "window": False, "offset": False}
-
-    @classmethod
-    def apply(cls, column, window, offset=None):
-        values = cls.offset_value(column, offset)
-        window = max(window)
-        if len(values) >= window:
-            values = values[-window:]
-        return max([v for v in values if v is not None and not np.isnan(v)])
+        with metrics.WRITE_SECONDS.time():
+            # packets pile up in the stream's buffer, which drains whenever it passes its byte threshold
+            async for packet in self.text_resultset(result_set):
+                await self.stream.write(packet, drain=False)
+            await self.stream.drain()
+
+    async def text_resultset(self, result_set: ResultSet):
+        yield packets.make_column_count(capabilities=self.capabilities, column_count=len(result_set.columns))
+        for column in result_set.columns:
+            yield packets.make_column_definition_41(
+                server_charset=self.server_charset,
+                name=column.name,
+                column_type=column.type,
+                character_set=column.character_set,
+            )
+        if not self.deprecate_eof():
+            yield self.eof()
+
+        encode = _text_row_encoder(result_set.columns)
+        affected_rows = 0
+        async for row in cooperative_iterate(aiterate(result_set.rows)):
+            affected_rows += 1
+            yield encode(row)
+        metrics.ROWS.inc(affected_rows)
+
+        yield self.ok_or_eof(affected_rows=affected_rows)
+
+    async def handle_subscribe(self, sql: str, query_attrs) -> None:
+        """Stream a SUBSCRIBE as one resultset that stays open, flushing every batch of changes."""
+        reader = self.stream.reader
+        changes = subscribe(self.session, sql, query_attrs, closed=reader.at_eof)
+        count = 0
+        encode = None
+        try:
+            async for batch, columns in changes:
+                if encode is None:
+                    result_set = await ensure_result_set(([row[1:] for row in batch], columns))
+                    result_columns = [ResultColumn('op', types.ColumnType.STRING)] + list(result_set.columns)
+                    await self.stream.write(packets.make_column_count(
+                        capabilities=self.capabilities, column_count=len(result_columns)), drain=False)
+                    for column in result_columns:
+                        await self.stream.write(packets.make_column_definition_41(
+                            server_charset=self.server_charset,
+                            name=column.name,
+                            column_type=column.type,
+                            character_set=column.character_set,
+                        ), drain=False)
+                    if not self.deprecate_eof():
+                        await self.stream.write(self.eof(), drain=False)
+                    encode = _text_row_encoder(result_columns)
+                for row in batch:
+                    await self.stream.write(encode(row), drain=False)
+                count += len(batch)
+                metrics.ROWS.inc(len(batch))
+                await self.stream.drain()
+        finally:
+            await changes.aclose()
+        await self.stream.write(self.ok_or_eof(affected_rows=count))
+
+    async def handle_stmt_prepare(self, data: bytes) -> None:
+        """Parse the statement once, with its placeholders numbered in order of appearance."""
+        sql = self.client_charset.decode(data)
+        counter = itertools.count()
+        numbered = REGEX_PARAM.sub(lambda _: f":{next(counter)}", sql)
+        num_params = next(counter)
+        try:
+            expressions = self.session._parse(numbered)
+        except ParseError:
+            expressions = []
+        stmt = PreparedStatement(
+            stmt_id=next(self.prepared_stmt_seq),
+            sql=sql,
+            num_params=num_params,
+            # anything else goes through the default path which splices values into the SQL text
+            expression=expressions[0] if len(expressions) == 1 else None,
+        )
+        self.prepared_stmts[stmt.stmt_id] = stmt
+
+        for packet in self.com_stmt_prepare_response(stmt):
+            await self.stream.write(packet, drain=False)
+        await self.stream.drain()
+
+    async def handle_stmt_execute(self, data: bytes) -> None:
+        reader = io.BytesIO(data)
+        stmt = self.get_stmt(types.read_uint_4(reader))
+        if not isinstance(stmt, PreparedStatement) or stmt.expression is None:
+            return await super().handle_stmt_execute(data)
+        use_cursor, param_count_available = packets._read_cursor_flags(reader)
+        types.read_uint_4(reader)  # iteration count, always 1
+        values, query_attrs = _read_params(
+            self.capabilities, self.client_charset, reader, stmt, param_count_available)
+        stmt.param_buffers = None
+
+        result_set = await ensure_result_set(
+            await self.session.handle_statement(_bind(stmt.expression, values), stmt.sql, query_attrs))
 
+        if not result_set:
+            await self.stream.write(self.ok(affected_rows=getattr(result_set, 'affected_rows', 0),
+                                            warnings=len(self.session.warnings)))
+            return
 
-_ENV["TA_HIGHEST"] = TA_Highest.apply
+        await self.stream.write(types.uint_len(len(result_set.columns)), drain=False)
+        for column in result_set.columns:
+            await self.stream.write(packets.make_column_definition_41(
+                server_charset=self.server_charset,
+                name=column.name,
+                column_type=column.type,
+                character_set=column.character_set,
+            ), drain=False)
+
+        async def gen_rows():
+            async for r in cooperative_iterate(aiterate(result_set.rows)):
+                metrics.ROWS.inc()
+                yield packets.make_binary_resultrow(r, result_set.columns)
+
+        rows = gen_rows()
+        if use_cursor:
+            stmt.cursor = rows
+            await self.stream.write(self.ok_or_eof(flags=types.ServerStatus.SERVER_STATUS_CURSOR_EXISTS))
+            return
+        if not self.deprecate_eof():
+            await self.stream.write(self.eof(), drain=False)
+        async for row in rows:
+            await self.stream.write(row, drain=False)
+        await self.stream.write(self.ok_or_eof())
+
+
+class PreparedStatement(_PreparedStatement):
+    def __init__(self, *args, expression: Optional[exp.Expression] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expression = expression
+
+
+def _read_params(capabilities, client_charset, reader, stmt, param_count_available):
+    """Same as packets._interpolate_params, but returns the parameter values instead of splicing them into SQL."""
+    query_attrs = {}
+    parameter_count = stmt.num_params
+    if stmt.num_params > 0 or (Capabilities.CLIENT_QUERY_ATTRIBUTES in capabilities and param_count_available):
+        if Capabilities.CLIENT_QUERY_ATTRIBUTES in capabilities:
+            parameter_count = types.read_uint_len(reader)
+    params = []
+    if parameter_count > 0:
+        params = packets._read_params(capabilities, client_charset, reader, parameter_count, stmt.param_buffers)
+        query_attrs = {k: v for k, v in params[stmt.num_params:] if k is not None}
+    return [v for _, v in params[:stmt.num_params]], query_attrs
+
+
+def _bind(expression: exp.Expression, values: list) -> exp.Expression:
+    def _transform(node):
+        if isinstance(node, exp.Placeholder) and node.name.isdigit():
+            index = int(node.name)
+            literal = value_to_expression(values[index])
+            literal.meta['param'] = index
+            return literal
+        return node
+
+    return expression.transform(_transform)
+
+
+def _text_row_encoder(columns):
+    """Same bytes as packets.make_text_resultset_row, with the per column lookups done once per resultset."""
+    encoders = []
+    for column in columns:
+        if column.text_encoder is _results._text_encode_str:
+            codec = column.character_set.codec
+            encoders.append(lambda v, codec=codec: v if isinstance(v, bytes) else str(v).encode(codec))
+        else:
+            encoders.append(column.text_encode)
+    uint_len = types.uint_len
+
+    def encode(row) -> bytes:
+        parts = []
+        for value, encoder in zip(row, encoders):
+            if value is None:
+                parts.append(b"\xfb")
+            else:
+                text = encoder(value)
+                parts.append(uint_len(len(text)))
+                parts.append(text)
+        return b"".join(parts)
+
+    return encode
 
 
 def sql_sleep(seconds):
     sleep(seconds)
     return seconds
 
+
+async def sql_sleep_async(seconds):
+    await asyncio.sleep(seconds)
+    return seconds
+
+
 def sql_json_get(content, key, default=None):
     d = json.loads(content)
     return d.get(key, default)
@@ -113,7 +270,6 @@ _ENV.update({
     "JSON_GET": null_if_any(sql_json_get),
 })
 
-for f in subclasses(__name__, Func, (Func, AggFunc, OffsetAggFunc)):
-    MySQL.Parser.FUNCTIONS.update({
-        f.__name__.upper(): f.from_arg_list
-    })
+ASYNC_FUNCTIONS.update({
+    "SLEEP": sql_sleep_async,
+})
@@ -1,20 +1,12 @@
 import argparse
-import asyncio
 import configparser
-import logging.config
 import os
 import sys
-from importlib import import_module, resources
-from threading import Thread, Condition
+from importlib import import_module
 from typing import Any, Dict, List, Tuple, Optional
 
-import nest_asyncio
-
-from broker_ql.server import BrokerQLServer
 from broker_ql.version import __version__
 
-nest_asyncio.apply()
-
 DEFAULT_CNF = """
 [server]
 port=3306
@@ -83,12 +75,29 @@ def parse_args_config(args_list) -> Tuple[argparse.Namespace, Optional[configpar
 
 def main():
     args, config = parse_args_config(sys.argv[1:])
+    # past argument parsing, so --help and --version don't wait for the server's imports
+    import asyncio
+    import logging.config
+    from importlib import resources
+    from threading import Thread, Condition
+
+    import nest_asyncio
+    from broker_ql.server import BrokerQLServer
+
+    nest_asyncio.apply()
 
     if 'port' not in config.defaults():
         print(f"missing {config.default_section} section in config file {args.cnf}", file=sys.stderr)
         sys.exit(1)
 
     server_cnf = config[config.default_section]
+    if server_cnf.getint('workers', 0) > 0 and not args.cli:
+        from broker_ql import cluster
+        try:
+            cluster.run(config)
+        except KeyboardInterrupt:
+            pass
+        return
 
     server = BrokerQLServer(port=server_cnf.getint('port'), config=config)
     if not args.cli:
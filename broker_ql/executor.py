@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import operator
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlglot import exp
+from sqlglot.executor.python import PythonExecutor
+from sqlglot.executor.table import Table, ensure_tables
+
+from .metrics import EXECUTE_SECONDS
+from .plan_cache import PlanCache
+from .vectorized import Unsupported, VectorizedExecutor
+
+PLAN_CACHE = PlanCache()
+
+# functions evaluated on the event loop before a static select is executed, see Session._static_query_middleware
+ASYNC_FUNCTIONS: Dict[str, Callable[..., Awaitable]] = {}
+
+
+def as_table(rows) -> Table:
+    if isinstance(rows, Table):
+        # a Table iterates through its one RowReader, an execution needs its own when others share the rows
+        return Table(rows.columns, rows.rows, rows.column_range)
+    if not rows:
+        return rows
+    getter = operator.itemgetter(*rows[0])
+    columns = [name.lower() for name in rows[0]]
+    if len(columns) == 1:
+        return Table(columns, [(getter(row),) for row in rows])
+    return Table(columns, [getter(row) for row in rows])
+
+
+def execute(expression: exp.Expression, schema, tables, engine: str = 'python') -> Table:
+    """Run a statement the way sqlglot's executor does, reusing cached plans.
+
+    Rows given as dicts are packed into Tables up front, which skips sqlglot normalizing the column
+    name of every cell. With ``engine='vectorized'`` the plan is run over NumPy columns first.
+    """
+    tables = ensure_tables({db: {name: as_table(rows) for name, rows in db_tables.items()}
+                            for db, db_tables in tables.items()})
+    plan = PLAN_CACHE.plan(expression, schema)
+    if engine == 'vectorized':
+        started = time.perf_counter()
+        try:
+            result = VectorizedExecutor(tables=tables).execute(plan)
+        except (Unsupported, TypeError, ValueError, IndexError):
+            pass
+        else:
+            # a fallback is only timed as the python run it ends in
+            EXECUTE_SECONDS.observe(time.perf_counter() - started, engine='vectorized')
+            return result
+    with EXECUTE_SECONDS.time(engine='python'):
+        return PythonExecutor(tables=tables).execute(plan)
+
+
+def _init_worker():
+    import broker_ql.connection  # noqa: F401 registers the SQL functions and optimizer rules
+
+
+def _execute_in_worker(version: int, expression: exp.Expression, schema, tables, engine: str) -> Table:
+    # a worker process has its own plan cache, keep it on the caller's schema version
+    if PLAN_CACHE.version != version:
+        PLAN_CACHE.invalidate()
+        PLAN_CACHE.version = version
+    return execute(expression, schema, tables, engine)
+
+
+class Offload:
+    """Where statements are executed: ``inline`` on the event loop, or in a ``thread`` or ``process`` pool.
+
+    Executing off the loop keeps blocking functions such as SLEEP and long scans from stalling other
+    clients and the broker connection.
+    """
+
+    def __init__(self, mode: str = 'inline', workers: Optional[int] = None):
+        self.mode = mode
+        self.workers = workers
+        self._pool: Optional[Executor] = None
+
+    def configure(self, mode: str, workers: Optional[int] = None):
+        if mode not in ('inline', 'thread', 'process'):
+            raise ValueError(f"unknown offload mode '{mode}'")
+        self.shutdown()
+        self.mode = mode
+        self.workers = workers
+
+    @property
+    def pool(self) -> Optional[Executor]:
+        if self._pool is None and self.mode == 'thread':
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='broker_ql')
+        elif self._pool is None and self.mode == 'process':
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn: Callable, *args):
+        if self.mode == 'inline':
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def run_local(self, fn: Callable, *args):
+        """Like ``run``, but never in another process, for work calling functions plugins registered here."""
+        if self.mode == 'process':
+            return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        return await self.run(fn, *args)
+
+    async def execute(self, expression: exp.Expression, schema, tables, engine: str = 'python') -> Table:
+        if self.mode == 'process':
+            tables = {db: {name: as_table(rows) for name, rows in db_tables.items()}
+                      for db, db_tables in tables.items()}
+            return await self.run(_execute_in_worker, PLAN_CACHE.version, expression, schema, tables, engine)
+        return await self.run(execute, expression, schema, tables, engine)
+
+
+OFFLOAD = Offload()
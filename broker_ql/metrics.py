@@ -0,0 +1,220 @@
+"""Counters, gauges and histograms in the Prometheus text format, without the client library.
+
+Served on ``GET /metrics`` when ``metrics_port`` is set in the server section, and as rows by
+``SHOW BROKERQL STATS``. Timings taken inside offload worker processes stay in those processes, so
+with ``offload = process`` the execute and optimize histograms only see inline work.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[tuple, float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # reads {label values: value} at collection time, for values something else already counts
+        self.function = function
+        self._values: Dict[tuple, float] = {}
+        # observations also come from offload worker threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _add(self, amount: float, labels: Dict[str, object]):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        values = self.function() if self.function is not None else dict(self._values)
+        if not values and not self.labels:
+            values = {(): 0.0}
+        return [(self.name, dict(zip(self.labels, key)), float(value)) for key, value in values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._add(amount, labels)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self._add(-amount, labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per bucket counts, then +Inf, count and sum
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in series.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, 'le': _format(bound)}, cumulative))
+            samples.append((f"{self.name}_count", labels, values[-2]))
+            samples.append((f"{self.name}_sum", labels, values[-1]))
+        return samples
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile, None before any observation."""
+        with self._lock:
+            values = list(self._series.get(self._key(labels), ()))
+        if not values or not values[-2]:
+            return None
+        rank, cumulative = q * values[-2], 0.0
+        for bound, count in zip(self.buckets + (float('inf'),), values):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+REGISTRY: Dict[str, Metric] = {}
+
+
+def _register(cls, name: str, *args, **kwargs):
+    metric = REGISTRY.get(name)
+    if metric is None:
+        metric = REGISTRY[name] = cls(name, *args, **kwargs)
+    return metric
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = (), function=None) -> Counter:
+    return _register(Counter, name, documentation, labels, function=function)
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = (), function=None) -> Gauge:
+    return _register(Gauge, name, documentation, labels, function=function)
+
+
+def histogram(name: str, documentation: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, documentation, labels, buckets=buckets)
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{text}}} {_format(value)}" if text else f"{name} {_format(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def rows() -> List[Tuple[str, str, float]]:
+    """(name, labels, value) of every sample, histograms as count, sum, p50 and p99."""
+    result = []
+    for metric in REGISTRY.values():
+        if isinstance(metric, Histogram):
+            for name, labels, value in metric.samples():
+                if name.endswith('_bucket'):
+                    continue
+                result.append((name, _labels(labels), value))
+                if name.endswith('_sum'):
+                    for q in (0.5, 0.99):
+                        result.append((f"{metric.name}_p{int(q * 100)}", _labels(labels),
+                                       metric.quantile(q, **labels)))
+        else:
+            result.extend((name, _labels(labels), value) for name, labels, value in metric.samples())
+    return result
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return ','.join(f"{k}={v}" for k, v in labels.items())
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        parts = request.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    return await asyncio.start_server(_handle, host, port)
+
+
+PARSE_SECONDS = histogram('broker_ql_parse_seconds', 'Time parsing statements')
+FETCH_SECONDS = histogram('broker_ql_fetch_seconds', 'Time fetching a table from its provider', ('db', 'table'))
+OPTIMIZE_SECONDS = histogram('broker_ql_optimize_seconds', 'Time optimizing and planning a select on a plan cache miss')
+EXECUTE_SECONDS = histogram('broker_ql_execute_seconds', 'Time executing a select plan', ('engine',))
+WRITE_SECONDS = histogram('broker_ql_write_seconds', 'Time encoding and writing a resultset to the client')
+ROWS = counter('broker_ql_rows_total', 'Rows sent to clients')
+CONNECTIONS = gauge('broker_ql_connections', 'Open client connections')
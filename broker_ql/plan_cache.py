@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import copy
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List
+
+import sqlglot.executor as _executor
+from sqlglot import exp
+from sqlglot.planner import Plan
+from sqlglot.schema import ensure_schema
+
+from .metrics import OPTIMIZE_SECONDS
+
+
+class PlanCache:
+    """Bounded LRU of parsed statements and optimized plans.
+
+    Statements are keyed by their SQL text, plans by the SQL of the (already rewritten) expression.
+    Both include the schema version, which ``invalidate`` bumps whenever the schema changes.
+
+    Literals bound from prepared statement parameters carry a ``param`` index in their meta. They
+    are lifted back into placeholders before keying, so one plan serves every set of values and
+    only a copy of it is bound per execution.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.version = 0
+        self.stats: Dict[str, int] = {
+            'statement_hits': 0,
+            'statement_misses': 0,
+            'plan_hits': 0,
+            'plan_misses': 0,
+        }
+        self._statements: OrderedDict[Hashable, List[exp.Expression]] = OrderedDict()
+        self._plans: OrderedDict[Hashable, Plan] = OrderedDict()
+        # plans are also looked up from offload worker threads
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._statements.clear()
+            self._plans.clear()
+
+    def _put(self, entries: OrderedDict, key: Hashable, value):
+        entries[key] = value
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def statements(self, sql: str, parse: Callable[[str], List[exp.Expression]]) -> List[exp.Expression]:
+        key = (sql.strip().rstrip(';').strip(), self.version)
+        statements = self._statements.get(key)
+        if statements is None:
+            self.stats['statement_misses'] += 1
+            statements = parse(sql)
+            self._put(self._statements, key, statements)
+        else:
+            self.stats['statement_hits'] += 1
+            self._statements.move_to_end(key)
+        # middlewares rewrite the AST in place, never hand out the cached one
+        return [e.copy() for e in statements]
+
+    def plan(self, expression: exp.Expression, schema) -> Plan:
+        params = _parameters(expression)
+        if params:
+            expression = expression.transform(_lift)
+        key = (expression.sql(), self.version)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self.stats['plan_hits'] += 1
+                self._plans.move_to_end(key)
+            else:
+                self.stats['plan_misses'] += 1
+        if plan is None:
+            with OPTIMIZE_SECONDS.time():
+                optimized = _executor.optimize(expression, ensure_schema(schema), leave_tables_isolated=True)
+                plan = Plan(optimized)
+            with self._lock:
+                self._put(self._plans, key, plan)
+        return _bind(plan, params) if params else plan
+
+
+def _is_parameter(node: exp.Expression) -> bool:
+    # the planner needs LIMIT and OFFSET as numbers, those stay literals
+    return bool(node._meta) and 'param' in node._meta and not isinstance(node.parent, (exp.Limit, exp.Offset))
+
+
+def _parameters(expression: exp.Expression) -> Dict[str, exp.Expression]:
+    return {str(node.meta['param']): node for node, _, _ in expression.walk() if _is_parameter(node)}
+
+
+def _lift(node: exp.Expression) -> exp.Expression:
+    if _is_parameter(node):
+        return exp.Placeholder(this=str(node.meta['param']))
+    return node
+
+
+def _substitute(value, params: Dict[str, exp.Expression]):
+    if isinstance(value, exp.Expression):
+        return value.transform(
+            lambda node: params[node.name].copy() if isinstance(node, exp.Placeholder) and node.name in params else node,
+            copy=False)
+    if isinstance(value, list):
+        return [_substitute(v, params) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_substitute(v, params) for v in value)
+    if isinstance(value, dict):
+        return {k: _substitute(v, params) for k, v in value.items()}
+    return value
+
+
+def _bind(plan: Plan, params: Dict[str, exp.Expression]) -> Plan:
+    plan = copy.deepcopy(plan)
+    for step in plan.dag:
+        for name, value in vars(step).items():
+            if name not in ('dependencies', 'dependents'):
+                setattr(step, name, _substitute(value, params))
+    return plan
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import dataclasses
+import operator
+from typing import Any, Callable, Hashable, List, Optional, Set
+
+from sqlglot import expressions as exp
+
+_OPERATORS = {
+    '=': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_BINARIES = {
+    exp.EQ: '=',
+    exp.LT: '<',
+    exp.LTE: '<=',
+    exp.GT: '>',
+    exp.GTE: '>=',
+}
+
+_FLIPPED = {'=': '=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+@dataclasses.dataclass
+class Predicate:
+    column: str
+    op: str
+    value: Any
+
+    def test(self, value) -> bool:
+        if value is None:
+            return False
+        if self.op == 'in':
+            return any(_compare(operator.eq, value, v) for v in self.value)
+        return _compare(_OPERATORS[self.op], value, self.value)
+
+
+@dataclasses.dataclass
+class Pushdown:
+    """Projection, predicates and limit a provider may apply before the executor does."""
+    columns: Optional[Set[str]] = None
+    predicates: List[Predicate] = dataclasses.field(default_factory=list)
+    limit: Optional[int] = None
+
+    def wants(self, column: str) -> bool:
+        return self.columns is None or column in self.columns or any(p.column == column for p in self.predicates)
+
+    def values(self, column: str) -> Optional[set]:
+        values = None
+        for predicate in self.predicates:
+            if predicate.column != column or predicate.op not in {'=', 'in'}:
+                continue
+            allowed = set(predicate.value) if predicate.op == 'in' else {predicate.value}
+            values = allowed if values is None else values & allowed
+        return values
+
+    def match(self, get: Callable[[str], Any]) -> bool:
+        return all(p.test(get(p.column)) for p in self.predicates)
+
+    def key(self) -> Hashable:
+        columns = frozenset(self.columns) if self.columns is not None else None
+        return columns, tuple((p.column, p.op, p.value) for p in self.predicates), self.limit
+
+
+def _compare(op, left, right) -> bool:
+    if isinstance(left, str) != isinstance(right, str):
+        # leave mismatched types to the executor
+        return True
+    try:
+        return op(left, right)
+    except TypeError:
+        return True
+
+
+def _literal(node: exp.Expression):
+    if isinstance(node, exp.Paren):
+        return _literal(node.this)
+    if isinstance(node, exp.Neg):
+        value = _literal(node.this)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return -value
+        raise ValueError(node)
+    if isinstance(node, exp.Boolean):
+        return node.this
+    if isinstance(node, exp.Literal):
+        if node.is_string:
+            return node.this
+        return int(node.this) if node.is_int else float(node.this)
+    raise ValueError(node)
+
+
+def _conjuncts(condition: exp.Expression) -> List[exp.Expression]:
+    if isinstance(condition, exp.Paren):
+        return _conjuncts(condition.this)
+    if isinstance(condition, exp.And):
+        return _conjuncts(condition.this) + _conjuncts(condition.expression)
+    return [condition]
+
+
+def _sources(select: exp.Select) -> List[exp.Expression]:
+    sources = []
+    if select.args.get('from'):
+        sources.append(select.args['from'].this)
+    for join in select.args.get('joins') or []:
+        sources.append(join.this)
+    return sources
+
+
+def _own_column(node: exp.Expression, alias: str, single: bool) -> Optional[str]:
+    if not isinstance(node, exp.Column) or not isinstance(node.this, exp.Identifier):
+        return None
+    if node.table == alias or (node.table == '' and single):
+        return node.name.lower()
+    return None
+
+
+def _predicates(condition: exp.Expression, alias: str, single: bool) -> Optional[List[Predicate]]:
+    if isinstance(condition, exp.Between):
+        column = _own_column(condition.this, alias, single)
+        if column is None:
+            return None
+        return [Predicate(column, '>=', _literal(condition.args['low'])),
+                Predicate(column, '<=', _literal(condition.args['high']))]
+    if isinstance(condition, exp.In):
+        column = _own_column(condition.this, alias, single)
+        if column is None or condition.args.get('query') or not condition.expressions:
+            return None
+        return [Predicate(column, 'in', tuple(_literal(e) for e in condition.expressions))]
+    op = _BINARIES.get(type(condition))
+    if op is None:
+        return None
+    column = _own_column(condition.this, alias, single)
+    if column is not None:
+        return [Predicate(column, op, _literal(condition.expression))]
+    column = _own_column(condition.expression, alias, single)
+    if column is not None:
+        return [Predicate(column, _FLIPPED[op], _literal(condition.this))]
+    return None
+
+
+def _limit(select: exp.Select) -> Optional[int]:
+    if any(select.args.get(k) for k in ('group', 'order', 'having', 'distinct', 'joins')):
+        return None
+    if any(s.find(exp.AggFunc, exp.Window) for s in select.expressions):
+        return None
+    limit = select.args.get('limit')
+    if limit is None:
+        return None
+    offset = select.args.get('offset')
+    try:
+        value = _literal(limit.expression)
+        if offset is not None:
+            value += _literal(offset.expression)
+    except ValueError:
+        return None
+    return value if isinstance(value, int) else None
+
+
+def extract_pushdown(root: exp.Expression, table: exp.Table) -> Pushdown:
+    """Derive what the provider of ``table`` needs to produce for ``root`` to be evaluated correctly."""
+    select = table.find_ancestor(exp.Select)
+    if select is None:
+        return Pushdown()
+    sources = _sources(select)
+    single = len(sources) == 1
+    alias = table.alias_or_name
+
+    columns: Optional[Set[str]] = set()
+    for star in root.find_all(exp.Star):
+        if isinstance(star.parent, exp.Count):
+            continue
+        if not isinstance(star.parent, exp.Column) or star.parent.table in ('', alias):
+            columns = None
+            break
+    if columns is not None:
+        for column in root.find_all(exp.Column):
+            if column.table in ('', alias) and isinstance(column.this, exp.Identifier):
+                columns.add(column.name.lower())
+
+    predicates = []
+    complete = True
+    where = select.args.get('where')
+    if where is not None:
+        for condition in _conjuncts(where.this):
+            try:
+                found = _predicates(condition, alias, single)
+            except ValueError:
+                found = None
+            if found is None:
+                complete = False
+                continue
+            predicates += found
+
+    limit = _limit(select) if single and complete else None
+    return Pushdown(columns=columns, predicates=predicates, limit=limit)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class ResultCache:
+    """Bounded LRU of select results, each kept for the freshness of the stalest table it reads.
+
+    An entry is dropped when it expires, when a statement modifies one of its tables, or when a
+    plugin reports a change of one through ``VIEWS``.
+    """
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._entries: OrderedDict[Hashable, Tuple[float, Set[Tuple[str, str]], tuple]] = OrderedDict()
+        self._by_table: Dict[Tuple[str, str], Set[Hashable]] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._discard(key)
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key: Hashable, tables: Iterable[Tuple[str, str]], ttl: float, result: tuple):
+        if ttl <= 0 or self.size <= 0:
+            return
+        self._discard(key)
+        tables = set(tables)
+        self._entries[key] = (time.monotonic() + ttl, tables, result)
+        for table in tables:
+            self._by_table.setdefault(table, set()).add(key)
+        while len(self._entries) > self.size:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate(self, db: str, table: str):
+        keys = self._by_table.pop((db, table), ())
+        for key in keys:
+            self._discard(key)
+        self.stats['invalidations'] += len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_table.clear()
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for table in entry[1]:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
@@ -11,6 +11,8 @@ from mysql_mimic.stream import MysqlStream
 from mysql_mimic.variables import SYSTEM_VARIABLES
 
 from .connection import Connection
+from . import metrics
+from .executor import OFFLOAD
 from .session import Session
 from .version import __version__
 
@@ -23,12 +25,24 @@ class BrokerQLServer(MysqlServer):
             "version": (str, __version__, False),
             "version_comment": (str, "BrokerQL", False),
             "broker_ql_plugins": (str, config['server']['plugins'], False),
+            "broker_ql_engine": (str, config['server'].get('engine', 'python'), True),
         })
         self.plugins = config['server']['plugins']
+        session_factory.SHARE_SNAPSHOTS = config['server'].getboolean('share_snapshots', True)
+        session_factory.RESULTS.size = config['server'].getint('result_cache_size', session_factory.RESULTS.size)
+        self.write_buffer_size = config['server'].getint('write_buffer_size', 2 ** 16)
+        OFFLOAD.configure(config['server'].get('offload', 'thread'), config['server'].getint('offload_workers', 4))
         self.config = config
         self.plugin_modules = []
+        self.plugin_inits = []
+        self.metrics_server = None
 
     async def start_server(self, **kwargs: Any) -> None:
+        await self.start_plugins()
+        return await super().start_server(**kwargs)
+
+    async def start_plugins(self) -> None:
+        """Load the configured plugins and start their init, and the metrics endpoint, without listening for clients."""
         for plugin_name in self.plugins.split(","):
             if plugin_name.strip() == "":
                 continue
@@ -42,19 +56,40 @@ class BrokerQLServer(MysqlServer):
                     plugin_cnf = self.config[plugin_config_section]
                     plugin.plugin_config.update(plugin_cnf)
                 if hasattr(plugin, 'init'):
-                    if asyncio.iscoroutinefunction(plugin.init):
-                        await plugin.init()
-                    elif callable(plugin.init):
-                        plugin.init()
+                    # plugins start together and the listener doesn't wait, only statements on the plugin's database do
+                    ready = asyncio.ensure_future(self._init_plugin(plugin_name, plugin))
+                    ready.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    self.plugin_inits.append(ready)
+                    self.session_factory.READY[getattr(plugin, '__database_name__', plugin_name)] = ready
                 self.plugin_modules.append(plugin)
             except ModuleNotFoundError:
                 print(f"load plugin {plugin_name} fail, try pip install broker_ql_plugin_{plugin_name}")
             except:
                 print(traceback.format_exc())
-        return await super().start_server(**kwargs)
+        metrics_port = self.config['server'].getint('metrics_port', 0)
+        if metrics_port:
+            self.metrics_server = await metrics.serve(self.config['server'].get('metrics_host', '127.0.0.1'),
+                                                      metrics_port)
+
+    @staticmethod
+    async def _init_plugin(plugin_name: str, plugin):
+        try:
+            if asyncio.iscoroutinefunction(plugin.init):
+                await plugin.init()
+            elif callable(plugin.init):
+                plugin.init()
+        except Exception:
+            print(f"init plugin {plugin_name} fail")
+            print(traceback.format_exc())
+            raise
 
     def close(self) -> None:
         super().close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        for ready in self.plugin_inits:
+            ready.cancel()
+        OFFLOAD.shutdown()
         for plugin in self.plugin_modules:
             if hasattr(plugin, 'destroy'):
                 if asyncio.iscoroutinefunction(plugin.destroy):
@@ -65,7 +100,7 @@ class BrokerQLServer(MysqlServer):
     async def _client_connected_cb(
             self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ) -> None:
-        stream = MysqlStream(reader, writer)
+        stream = MysqlStream(reader, writer, buffer_size=self.write_buffer_size)
 
         connection = Connection(
             stream=stream,
@@ -87,8 +122,10 @@ class BrokerQLServer(MysqlServer):
             )
             return
         connection.connection_id = connection_id
+        metrics.CONNECTIONS.inc()
         try:
             return await connection.start()
         finally:
+            metrics.CONNECTIONS.dec()
             writer.close()
             await self.control.remove(connection_id)
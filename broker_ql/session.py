@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import inspect
 from collections import defaultdict
+from datetime import datetime
 from io import UnsupportedOperation
 from typing import Dict, List, Callable, Any, Awaitable, Optional
 
@@ -9,21 +12,44 @@ from mysql_mimic import Session as _Session, AllowedResult, ResultSet
 from mysql_mimic.errors import MysqlError, ErrorCode
 from mysql_mimic.schema import BaseInfoSchema, Column
 from mysql_mimic.session import Query, expression_to_value, value_to_expression, setitem_kind
+from mysql_mimic.variables import SYSTEM_VARIABLES
 from sqlglot import expressions as exp
 from sqlglot.executor import execute
+from sqlglot.executor.table import Table
 
+from . import metrics
+from .executor import ASYNC_FUNCTIONS, OFFLOAD, PLAN_CACHE
+from .pushdown import Pushdown, extract_pushdown
+from .result_cache import ResultCache
+from .snapshot import SnapshotPool
 from .util import reloading
+from .views import VIEWS
+
+SYSTEM_VARIABLES.setdefault("broker_ql_engine", (str, "python", True))
+SYSTEM_VARIABLES.setdefault("broker_ql_result_cache", (bool, True, True))
+SYSTEM_VARIABLES.setdefault("broker_ql_ready_timeout", (float, 20.0, True))
+
+# a select calling one of these may answer differently each time, its result isn't cached
+# (RAND(), NOW(), TWS_NEXT_ORDER_ID() and other functions sqlglot doesn't know are Anonymous)
+NON_REPEATABLE = (exp.Anonymous, exp.CurrentTimestamp, exp.CurrentDatetime, exp.CurrentDate, exp.CurrentTime)
 
 
 class Session(_Session):
     SCHEMA_PROVIDERS: List[Callable[[], Dict[str, Dict[str, List[Column]]]]] = []
     DATA_PROVIDERS: Dict[
-        str, Callable[[str, Optional[List[Dict]]], Awaitable[List[Dict[str, Any]]] | List[Dict[str, Any]]]] = {}
+        str, Callable[[str, Optional[List[Dict]], Optional[Pushdown]],
+                      Awaitable[List[Dict[str, Any]] | Table] | List[Dict[str, Any]] | Table]] = {}
     DATA_CREATORS: Dict[str, Callable[[Session, str, list, list], Awaitable | None]] = {}
     DATA_MODIFIERS: Dict[str, Callable[[Session, str, list, dict], Awaitable[int] | int]] = {}
     DATA_REMOVERS: Dict[str, Callable[[Session, str, list], Awaitable | None]] = {}
+    # seconds a cached select result stays valid, per database and table, tables not listed aren't cached
+    TABLE_FRESHNESS: Dict[str, Dict[str, float]] = {}
+    # per database, done once its plugin can serve, statements on it wait up to @@broker_ql_ready_timeout (0 forever)
+    READY: Dict[str, asyncio.Future] = {}
 
-    TABLES: Dict[str, Dict[str, List[Dict[str, Any]]]] = defaultdict(defaultdict)
+    SNAPSHOTS = SnapshotPool()
+    RESULTS = ResultCache()
+    SHARE_SNAPSHOTS = True
     SCHEMA = {}
 
     def __init__(self, *args, **kwargs):
@@ -32,16 +58,54 @@ class Session(_Session):
         self.in_trx = False
         self.trx_commits = []
         self.trx_rollbacks = []
+        # (level, code, message) of the last statement, for SHOW WARNINGS
+        self.warnings = []
+        self.middlewares.insert(0, self._warnings_middleware)
 
     @reloading
     def extract_tables(self, tables, expression):
-        if 'from' in expression.args:
-            if expression.args['from'].this.key == 'subquery':
-                self.extract_tables(tables, expression.args['from'].this.this)
-            else:
-                tables.append(expression.args['from'].this)
-        for join in expression.args.get('joins', []):
-            tables.append(join.this)
+        ctes = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+        for table in expression.find_all(exp.Table):
+            if table.db == '' and table.name in ctes:
+                continue
+            tables.append(table)
+
+    async def _ready(self, db: str):
+        ready = self.READY.get(db)
+        if ready is None or ready.done() and not ready.cancelled() and ready.exception() is None:
+            return
+        timeout = float(self.variables.get('broker_ql_ready_timeout') or 0)
+        try:
+            await asyncio.wait_for(asyncio.shield(ready), timeout or None)
+        except asyncio.TimeoutError:
+            raise MysqlError(f"Database '{db}' is not ready yet", code=ErrorCode.UNKNOWN_ERROR)
+        except Exception as e:
+            raise MysqlError(f"Database '{db}' failed to start: {e}", code=ErrorCode.UNKNOWN_ERROR)
+
+    @staticmethod
+    def _accepts_pushdown(supplier) -> bool:
+        try:
+            return 'pushdown' in inspect.signature(supplier).parameters
+        except (TypeError, ValueError):
+            return False
+
+    def _snapshot_key(self, db: str, table_name: str, where: Optional[List[Dict]], pushdown: Optional[Pushdown]):
+        if not self.SHARE_SNAPSHOTS:
+            return None
+        try:
+            where_key = tuple(tuple(sorted(row.items())) for row in where) if where is not None else None
+            key = (db, table_name, where_key, pushdown.key() if pushdown is not None else None)
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _freshness(self, expression: exp.Expression, sources) -> float:
+        if not sources or not self.variables.get('broker_ql_result_cache'):
+            return 0
+        if expression.find(*NON_REPEATABLE):
+            return 0
+        return min(self.TABLE_FRESHNESS.get(db, {}).get(name, 0) for db, name in sources)
 
     @reloading
     async def query(self, expression, sql: str, attrs) -> AllowedResult:
@@ -50,8 +114,30 @@ class Session(_Session):
         if expression.key == 'select':
             tables = []
             self.extract_tables(tables, expression)
+            occurrences = defaultdict(int)
+            sources = set()
+            for table in tables:
+                db = self.database if table.db == '' and self.database is not None else table.db
+                # quotes and tws.quotes are the same snapshot under the tws database
+                occurrences[(db, table.name)] += 1
+                sources.add((db, table.name))
+                if table.name == 'ohlcv':
+                    sources.add((db, 'subscriptions'))
+            ttl = self._freshness(expression, sources)
+            cache_key = (self.database, expression.sql()) if ttl > 0 else None
+            if cache_key is not None:
+                cached = self.RESULTS.get(cache_key)
+                if cached is not None:
+                    return cached
+            snapshot: Dict[str, Dict[str, Any]] = defaultdict(dict)
             for table in tables:
                 db = self.database if table.db == '' and self.database is not None else table.db
+                if db == VIEWS.database:
+                    rows = await VIEWS.read(self, table.name)
+                    if rows is None:
+                        raise MysqlError(f"Table '{db}.{table.name}' doesn't exist", code=ErrorCode.NO_DB_ERROR)
+                    snapshot[db][table.name] = rows
+                    continue
                 supplier = self.DATA_PROVIDERS.get(db)
                 if supplier is None:
                     raise MysqlError(f"Unknown database '{db}'", code=ErrorCode.NO_DB_ERROR)
@@ -61,14 +147,23 @@ class Session(_Session):
                     query_expression = self._parse(query)[0]
                     rows, columns = await self.query(query_expression, query, attrs)
 
-                rows = supplier(table.name, [{k: v for k, v in zip(columns, row)} for row in
-                                             rows] if 'where' in expression.args else None)
-                if inspect.isawaitable(rows):
-                    rows = await rows
+                where = [{k: v for k, v in zip(columns, row)} for row in rows] if 'where' in expression.args else None
+                if self._accepts_pushdown(supplier):
+                    # a table referenced more than once shares one snapshot, so it can't be narrowed per alias
+                    pushdown = extract_pushdown(expression, table) if occurrences[(db, table.name)] == 1 else Pushdown()
+                    fetch = functools.partial(supplier, table.name, where, pushdown=pushdown)
+                else:
+                    pushdown = None
+                    fetch = functools.partial(supplier, table.name, where)
+                await self._ready(db)
+                with metrics.FETCH_SECONDS.time(db=db, table=table.name):
+                    rows = await self.SNAPSHOTS.fetch(self._snapshot_key(db, table.name, where, pushdown), fetch)
                 if rows is None:
                     raise MysqlError(f"Table '{db}.{table.name}' doesn't exist", code=ErrorCode.NO_DB_ERROR)
-                self.TABLES[db][table.name] = rows
-            result = execute(expression, schema=self.SCHEMA, tables=self.TABLES)
+                snapshot[db][table.name] = rows
+            result = await OFFLOAD.execute(expression, self.SCHEMA, snapshot, self.variables.get('broker_ql_engine'))
+            if cache_key is not None:
+                self.RESULTS.put(cache_key, sources, ttl, (result.rows, result.columns))
             return result.rows, result.columns
         elif expression.key == 'insert':
             if expression.this.key == 'table':
@@ -98,11 +193,13 @@ class Session(_Session):
             try:
                 if creator is None:
                     raise UnsupportedOperation()
+                await self._ready(db)
                 result = creator(self, table.name, fields, values)
                 if inspect.isawaitable(result):
                     result = await result
             except UnsupportedOperation:
                 raise MysqlError(f"Unsupported {expression.key} on {db}.{table.name}", code=ErrorCode.NOT_SUPPORTED_YET)
+            self.RESULTS.invalidate(db, table.name)
 
             rs = ResultSet(rows=[], columns=[])
             setattr(rs, 'affected_rows', result)
@@ -110,12 +207,17 @@ class Session(_Session):
         elif expression.key == 'update':
             table = expression.this
             db = self.database if table.db == '' and self.database is not None else table.db
-            alias = {col: col for col in self.SCHEMA[db][table.name]}
+            alias = {col: exp.column(col) for col in self.SCHEMA[db][table.name]}
             fields = {expr.left.sql(): expr.right.sql() for expr in expression.expressions}
-            alias.update(fields)
-            projects = [f"{v} as {k}" for k, v in alias.items()]
-            query = f"select {', '.join(projects)} from {table.name} {expression.args.get('where', '')}"
-            query_expression = self._parse(query)[0]
+            alias.update({expr.left.sql(): expr.right.copy() for expr in expression.expressions})
+            # built as an expression so literals bound from statement parameters stay parameters
+            query_expression = exp.select(*(exp.alias_(v, k) for k, v in alias.items())).from_(
+                exp.table_(table.name, db=table.db or None))
+            if expression.args.get('where'):
+                query_expression.set('where', expression.args['where'].copy())
+            query = query_expression.sql(dialect=self.dialect)
+            # the rows to modify are never read from the result cache
+            self.RESULTS.invalidate(db, table.name)
             rows, columns = await self.query(query_expression, query, attrs)
             if not rows:
                 rs = ResultSet(rows=[], columns=[])
@@ -128,22 +230,25 @@ class Session(_Session):
                 rows_to_modify = [{k: v for k, v in zip(columns, row)} for row in rows]
                 result = modifier(self, table.name, rows_to_modify, fields)
                 if inspect.isawaitable(result):
-                    await result
+                    result = await result
             except UnsupportedOperation:
                 raise MysqlError(f"Unsupported {expression.key} on {db}.{table.name}", code=ErrorCode.NOT_SUPPORTED_YET)
+            self.RESULTS.invalidate(db, table.name)
             rs = ResultSet(rows=[], columns=[])
-            setattr(rs, 'affected_rows', len(rows))
+            setattr(rs, 'affected_rows', result if isinstance(result, int) else len(rows))
             return rs
         elif expression.key == 'delete':
             table = expression.this
-            query = f"select * from {table.name} {expression.args['where']}"
-            query_expression = self._parse(query)[0]
+            db = self.database if table.db == '' and self.database is not None else table.db
+            query_expression = exp.select('*').from_(exp.table_(table.name, db=table.db or None)).where(
+                expression.args['where'].this.copy())
+            query = query_expression.sql(dialect=self.dialect)
+            self.RESULTS.invalidate(db, table.name)
             rows, columns = await self.query(query_expression, query, attrs)
             if not rows:
                 rs = ResultSet(rows=[], columns=[])
                 setattr(rs, 'affected_rows', 0)
                 return rs
-            db = self.database if table.db == '' and self.database is not None else table.db
             remover = self.DATA_REMOVERS.get(db)
             try:
                 if remover is None:
@@ -154,9 +259,20 @@ class Session(_Session):
                     await result
             except UnsupportedOperation:
                 raise MysqlError(f"Unsupported {expression.key} on {db}.{table.name}", code=ErrorCode.NOT_SUPPORTED_YET)
+            self.RESULTS.invalidate(db, table.name)
             rs = ResultSet(rows=[], columns=[])
             setattr(rs, 'affected_rows', len(rows))
             return rs
+        elif isinstance(expression, exp.Command) and expression.name.upper() == 'SHOW' \
+                and str(expression.args.get('expression') or '').upper().split() == ['BROKERQL', 'STATS']:
+            return metrics.rows(), ['Name', 'Labels', 'Value']
+        elif expression.key in ('create', 'drop') and _is_materialized_view(expression):
+            if expression.key == 'create':
+                await VIEWS.create(self, expression)
+            else:
+                VIEWS.drop(expression)
+            await self.schema()
+            return [], []
         return [], []
 
     @reloading
@@ -191,10 +307,31 @@ class Session(_Session):
         return await q.next()
 
     async def schema(self) -> dict | BaseInfoSchema:
+        schema = {}
         for provider in self.SCHEMA_PROVIDERS:
-            self.SCHEMA.update(provider())
+            schema.update(provider())
+        if schema != self.SCHEMA:
+            self.SCHEMA.clear()
+            self.SCHEMA.update(schema)
+            PLAN_CACHE.invalidate()
         return self.SCHEMA
 
+    async def handle_statement(self, expression: exp.Expression, sql: str, attrs: Dict[str, str]) -> AllowedResult:
+        """Run an already parsed statement through the middlewares, as handle_query does for each statement."""
+        self.timestamp = datetime.now(tz=self.timezone())
+        q = Query(
+            expression=expression,
+            sql=sql,
+            attrs=attrs,
+            _middlewares=self.middlewares,
+            _query=self.query,
+        )
+        return await q.start()
+
+    def _parse(self, sql: str) -> List[exp.Expression]:
+        with metrics.PARSE_SECONDS.time():
+            return PLAN_CACHE.statements(sql, super()._parse)
+
     async def _set_variable(self, setitem: exp.SetItem) -> None:
         try:
             super()._set_variable(setitem)
@@ -266,6 +403,31 @@ class Session(_Session):
 
         return await q.next()
 
+    async def _static_query_middleware(self, q: Query) -> AllowedResult:
+        """Handle static queries (e.g. SELECT 1), awaiting async functions such as SLEEP on the loop."""
+        if isinstance(q.expression, exp.Select) and not any(
+                q.expression.args.get(a)
+                for a in set(exp.Select.arg_types) - {"expressions", "limit", "hint"}
+        ):
+            for node in list(q.expression.find_all(exp.Anonymous)):
+                func = ASYNC_FUNCTIONS.get(node.name.upper())
+                if func is not None and all(isinstance(arg, exp.Literal) for arg in node.expressions):
+                    value = await func(*[expression_to_value(arg) for arg in node.expressions])
+                    node.replace(value_to_expression(value))
+            # e.g. select tws_next_order_id(), whose plugin is only loaded and connected in this process
+            result = await OFFLOAD.run_local(execute, q.expression)
+            return result.rows, result.columns
+        return await q.next()
+
+    async def _warnings_middleware(self, q: Query) -> AllowedResult:
+        """Start every statement but SHOW WARNINGS without warnings, SET and SHOW never reach query"""
+        if not (isinstance(q.expression, exp.Show) and q.expression.name.upper() == 'WARNINGS'):
+            self.warnings.clear()
+        return await q.next()
+
+    def _show_warnings(self, show: exp.Show) -> AllowedResult:
+        return list(self.warnings), ["Level", "Code", "Message"]
+
     async def _set_middleware(self, q: Query) -> AllowedResult:
         """Intercept SET statements"""
         if isinstance(q.expression, exp.Set):
@@ -291,3 +453,19 @@ class Session(_Session):
 
             return [], []
         return await q.next()
+
+
+def _is_materialized_view(expression: exp.Expression) -> bool:
+    if (expression.args.get('kind') or '').upper() != 'VIEW':
+        return False
+    if isinstance(expression, exp.Drop):
+        return bool(expression.args.get('materialized'))
+    properties = expression.args.get('properties')
+    return properties is not None and any(isinstance(p, exp.MaterializedProperty) for p in properties.expressions)
+
+
+Session.SCHEMA_PROVIDERS.append(VIEWS.schema)
+VIEWS.listeners.append(Session.RESULTS.invalidate)
+metrics.counter('broker_ql_cache_events_total', 'Statement, plan and result cache hits and misses', ('cache', 'event'),
+                function=lambda: {**{tuple(k.split('_')): v for k, v in PLAN_CACHE.stats.items()},
+                                  **{('result', k): v for k, v in Session.RESULTS.stats.items()}})
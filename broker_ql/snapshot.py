@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SnapshotPool:
+    """Lets concurrent queries share one in-flight provider fetch of the same table.
+
+    Nothing is retained once a fetch completes: every query holds its own reference to the
+    rows it got, and they are released together with the query.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def fetch(self, key: Optional[Hashable], supplier: Callable[[], Awaitable[Any] | Any]) -> Any:
+        if key is None:
+            return await self._call(supplier)
+        future = self._inflight.get(key)
+        if future is None:
+            result = supplier()
+            if not inspect.isawaitable(result):
+                return result
+            future = asyncio.ensure_future(result)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._release(key, f))
+        return await asyncio.shield(future)
+
+    def _release(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # mark the exception as retrieved when no query is left waiting for it
+            future.exception()
+
+    @staticmethod
+    async def _call(supplier):
+        result = supplier()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
@@ -0,0 +1,97 @@
+"""Continuous queries, ``SUBSCRIBE select symbol, last from tws.quotes where symbol in ('AAPL', 'MSFT')``.
+
+The statement answers with one long-lived resultset. The first rows are the current result, then, each
+time a table the select reads changes, the select runs again and only the difference is sent, as rows
+with a leading ``op`` column of ``+`` or ``-``. A changed row arrives as a ``-`` of its old values and a
+``+`` of the new ones. Changes are the ones plugins report to ``VIEWS``. Bursts are coalesced to one
+evaluation per ``@@broker_ql_subscribe_interval`` seconds, and selects over untracked tables are polled.
+The resultset ends after ``@@broker_ql_subscribe_timeout`` seconds (0 never), on ``KILL QUERY``, or when
+the client goes away.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from collections import Counter
+from typing import AsyncIterator, List, Set, Tuple
+
+from mysql_mimic.errors import MysqlError, ErrorCode
+from mysql_mimic.variables import SYSTEM_VARIABLES
+from sqlglot import expressions as exp
+
+from .views import VIEWS
+
+SYSTEM_VARIABLES.setdefault("broker_ql_subscribe_interval", (float, 0.1, True))
+SYSTEM_VARIABLES.setdefault("broker_ql_subscribe_timeout", (float, 0.0, True))
+
+REGEX_SUBSCRIBE = re.compile(r"^\s*subscribe\s+", re.IGNORECASE)
+
+# how often a select reading a table nobody reports changes for is run again
+UNTRACKED_POLL = 1.0
+# how often a subscription over quiet tracked tables looks whether its client went away
+CLOSED_CHECK = 1.0
+
+
+def diff(previous: Counter, rows: List[tuple]) -> Tuple[Counter, List[tuple]]:
+    """``(current, changes)``, with rows compared as a multiset so duplicate rows are kept."""
+    current = Counter(rows)
+    changes = [('-', *row) for row, n in (previous - current).items() for _ in range(n)]
+    changes += [('+', *row) for row, n in (current - previous).items() for _ in range(n)]
+    return current, changes
+
+
+def sources(session, expression: exp.Expression) -> Set[Tuple[str, str]]:
+    tables = []
+    session.extract_tables(tables, expression)
+    return {(table.db or session.database or '', table.name) for table in tables}
+
+
+def parse(session, sql: str) -> exp.Select:
+    expressions = session._parse(REGEX_SUBSCRIBE.sub('', sql, count=1))
+    if len(expressions) != 1 or not isinstance(expressions[0], exp.Select):
+        raise MysqlError("SUBSCRIBE takes a single select", code=ErrorCode.PARSE_ERROR)
+    return expressions[0]
+
+
+async def _evaluate(session, expression: exp.Select, sql: str, attrs) -> Tuple[List[tuple], List[str]]:
+    result = await session.handle_statement(expression.copy(), sql, attrs)
+    rows, columns = result if isinstance(result, tuple) else (result.rows, result.columns)
+    return [tuple(row) for row in rows], columns
+
+
+async def subscribe(session, sql: str, attrs, closed=lambda: False) -> AsyncIterator[Tuple[List[tuple], list]]:
+    """Yields ``(changes, columns)``, all the rows first, then one batch of changes per evaluation."""
+    expression = parse(session, sql)
+    interval = float(session.variables.get('broker_ql_subscribe_interval') or 0)
+    timeout = float(session.variables.get('broker_ql_subscribe_timeout') or 0)
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    watched = sources(session, expression)
+    poll = None if watched <= VIEWS.tracked else UNTRACKED_POLL
+
+    with VIEWS.watch(watched) as changed:
+        rows, columns = await _evaluate(session, expression, sql, attrs)
+        previous, changes = diff(Counter(), rows)
+        yield changes, columns
+        while not closed():
+            wait = CLOSED_CHECK if poll is None else poll
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                wait = min(wait, remaining)
+            try:
+                await asyncio.wait_for(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                if poll is None:
+                    # nothing changed, only look at the client again
+                    continue
+            started = time.monotonic()
+            changed.clear()
+            rows, _ = await _evaluate(session, expression, sql, attrs)
+            previous, changes = diff(previous, rows)
+            if changes:
+                yield changes, columns
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
@@ -0,0 +1,211 @@
+"""Technical analysis aggregates, e.g. ``select symbol, ta_rsi(close, 14) from ohlcv group by symbol``.
+
+Each function reads the rows of a group in order, oldest first, and returns the indicator value at the
+last row, or ``offset`` rows before it. The computations work on one column holding every group
+back to back, delimited by ``starts``/``ends``, so the vectorized engine evaluates all groups in
+one pass over the column, while the Python engine calls them once per group.
+"""
+from __future__ import annotations
+
+from typing import List, Tuple
+
+from sqlglot.dialects.mysql import MySQL
+from sqlglot.executor.env import ENV
+from sqlglot.expressions import AggFunc
+
+from .util import lazy_import
+
+# loaded by the first TA_* call, a server that never computes one doesn't pay for it
+np = lazy_import('numpy')
+
+
+def _reduce(ufunc: np.ufunc, values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """ufunc over values[lo:hi] of every window, NaN for empty windows. Windows must be ordered and disjoint."""
+    out = np.full(len(lo), np.nan)
+    keep = hi > lo
+    if keep.any():
+        index = np.column_stack([lo[keep], hi[keep]]).ravel()
+        if index[-1] == len(values):
+            index = index[:-1]
+        out[keep] = ufunc.reduceat(values, index)[::2]
+    return out
+
+
+def _compact(columns: List[np.ndarray], starts: np.ndarray, ends: np.ndarray):
+    """Drop rows with a NaN in any column, for the recursive indicators."""
+    present = np.logical_and.reduce([~np.isnan(c) for c in columns])
+    if present.all():
+        return columns, starts, ends
+    position = np.r_[0, np.cumsum(present)]
+    return [c[present] for c in columns], position[starts], position[ends]
+
+
+def _rows(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """``(window, row)`` of every row in the windows [lo, hi), window by window."""
+    lengths = hi - lo
+    window = np.repeat(np.arange(len(lo)), lengths)
+    return window, np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + lo[window]
+
+
+def _smooth(values: np.ndarray, lo: np.ndarray, hi: np.ndarray, alpha: float, window: int) -> np.ndarray:
+    """Exponential smoothing of values[lo:hi], seeded with the mean of the first ``window`` values.
+
+    The recursion e = alpha * x + (1 - alpha) * e unrolls to a weighted sum, so the last value of every
+    window is a single bincount over the rows after each seed.
+    """
+    seeded = hi - lo >= window
+    out = np.full(len(lo), np.nan)
+    if not seeded.any():
+        return out
+    lo, hi = lo[seeded], hi[seeded]
+    seed = _reduce(np.add, values, lo, lo + window) / window
+    lengths = hi - lo - window
+    group, rows = _rows(lo + window, hi)
+    decay = 1 - alpha
+    tail = np.bincount(group, alpha * decay ** (hi[group] - 1 - rows) * values[rows], minlength=len(lo))
+    out[seeded] = decay ** lengths * seed + tail
+    return out
+
+
+class TAFunc(AggFunc):
+    """Base of the TA aggregates, ``columns`` leading arguments are columns, then window and offset."""
+    columns = 1
+    default_window = 14
+    arg_types = {"this": True, "window": False, "offset": False}
+
+    @classmethod
+    def compute(cls, columns: List[np.ndarray], starts: np.ndarray, ends: np.ndarray, window: int) -> np.ndarray:
+        """The indicator at the last row of every group, by default the first column's value there."""
+        out = np.full(len(starts), np.nan)
+        valid = ends > starts
+        out[valid] = columns[0][ends[valid] - 1]
+        return out
+
+    @classmethod
+    def evaluate(cls, columns: List[np.ndarray], starts: np.ndarray, ends: np.ndarray, window=None,
+                 offset=0) -> np.ndarray:
+        window = cls.default_window if window is None else max(int(window), 1)
+        ends = np.maximum(starts, ends - max(int(offset or 0), 0))
+        return cls.compute(columns, starts, ends, window)
+
+    @classmethod
+    def parameters(cls, args) -> Tuple[list, int, int]:
+        columns, rest = args[:cls.columns], [list(a) if a is not None else [] for a in args[cls.columns:]]
+        window, offset = (rest + [[], []])[:2]
+        return columns, max(window) if window else None, max(offset) if offset else 0
+
+    @classmethod
+    def apply(cls, *args):
+        columns, window, offset = cls.parameters(args)
+        columns = [np.array(list(c), dtype=float) for c in columns]
+        length = len(columns[0])
+        result = cls.evaluate(columns, np.array([0]), np.array([length]), window, offset)[0]
+        return None if np.isnan(result) else float(result)
+
+
+class TA_Highest(TAFunc):
+    _sql_names = ["TA_HIGHEST"]
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        return _reduce(np.fmax, columns[0], np.maximum(starts, ends - window), ends)
+
+
+class TA_Lowest(TAFunc):
+    _sql_names = ["TA_LOWEST"]
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        return _reduce(np.fmin, columns[0], np.maximum(starts, ends - window), ends)
+
+
+class TA_Sma(TAFunc):
+    _sql_names = ["TA_SMA"]
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        values = columns[0]
+        present = ~np.isnan(values)
+        lo = np.maximum(starts, ends - window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return _reduce(np.add, np.where(present, values, 0.0), lo, ends) / _reduce(np.add, present * 1.0, lo, ends)
+
+
+class TA_Stddev(TAFunc):
+    _sql_names = ["TA_STDDEV"]
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        values = columns[0]
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        lo = np.maximum(starts, ends - window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            count = _reduce(np.add, present * 1.0, lo, ends)
+            mean = _reduce(np.add, filled, lo, ends) / count
+            # deviations from each window's mean, E[x^2] - mean^2 cancels for prices that barely move
+            group, rows = _rows(lo, ends)
+            deviation = np.where(present[rows], values[rows] - mean[group], 0.0)
+            return np.sqrt(np.bincount(group, deviation * deviation, minlength=len(lo)) / count)
+
+
+class TA_Ema(TAFunc):
+    _sql_names = ["TA_EMA"]
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        (values,), starts, ends = _compact(columns, starts, ends)
+        return _smooth(values, starts, ends, 2 / (window + 1), window)
+
+
+class TA_Rsi(TAFunc):
+    """Wilder's RSI over the last ``window`` changes."""
+    _sql_names = ["TA_RSI"]
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        (values,), starts, ends = _compact(columns, starts, ends)
+        # change i is values[i + 1] - values[i], so a group's changes are [start, end - 1)
+        changes = np.diff(values)
+        hi = np.maximum(starts, ends - 1)
+        gain = _smooth(np.maximum(changes, 0.0), starts, hi, 1 / window, window)
+        loss = _smooth(np.maximum(-changes, 0.0), starts, hi, 1 / window, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(loss == 0, np.where(gain == 0, 50.0, 100.0), 100 - 100 / (1 + gain / loss))
+
+
+class TA_Atr(TAFunc):
+    """Wilder's average true range, ``ta_atr(high, low, close, window)``."""
+    _sql_names = ["TA_ATR"]
+    columns = 3
+    arg_types = {"this": True, "low": True, "close": True, "window": False, "offset": False}
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        (high, low, close), starts, ends = _compact(columns, starts, ends)
+        previous = np.r_[np.nan, close[:-1]]
+        previous[starts[starts < len(previous)]] = np.nan
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+        return _smooth(true_range, starts, ends, 1 / window, window)
+
+
+class TA_Return(TAFunc):
+    """Simple return over ``window`` rows, ``close / close[window rows earlier] - 1``."""
+    _sql_names = ["TA_RETURN"]
+    default_window = 1
+
+    @classmethod
+    def compute(cls, columns, starts, ends, window):
+        values = columns[0]
+        out = np.full(len(starts), np.nan)
+        valid = ends - 1 - window >= starts
+        last, first = ends[valid] - 1, ends[valid] - 1 - window
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[valid] = values[last] / values[first] - 1
+        return out
+
+
+# not sqlglot's subclasses(), its module walk would touch np and load numpy
+for f in TAFunc.__subclasses__():
+    ENV[f._sql_names[0]] = f.apply
+    MySQL.Parser.FUNCTIONS[f._sql_names[0]] = f.from_arg_list
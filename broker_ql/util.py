@@ -1,5 +1,32 @@
+import importlib
+import threading
+
 try:
     from reloading import reloading
 except ImportError:
     def reloading(fn_or_seq=None, every=1, forever=None):
         return fn_or_seq
+
+
+class _LazyModule:
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        # offload worker threads may be the first to touch it
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        # later lookups of the same name skip __getattr__
+        setattr(self, attr, value)
+        return value
+
+
+def lazy_import(name: str):
+    """A stand-in for module ``name`` that imports it on first attribute access."""
+    return _LazyModule(name)
@@ -0,0 +1,485 @@
+from __future__ import annotations
+
+import math
+import operator
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+from sqlglot import exp, planner
+from sqlglot.executor.table import Table
+from sqlglot.planner import Plan
+
+from .ta import TAFunc
+from .util import lazy_import
+
+np = lazy_import('numpy')
+
+
+class Unsupported(Exception):
+    pass
+
+
+_BINARY = {
+    exp.Add: operator.add,
+    exp.Sub: operator.sub,
+    exp.Mul: operator.mul,
+    exp.EQ: operator.eq,
+    exp.NEQ: operator.ne,
+    exp.GT: operator.gt,
+    exp.GTE: operator.ge,
+    exp.LT: operator.lt,
+    exp.LTE: operator.le,
+}
+
+
+def _array(values: Sequence) -> np.ndarray:
+    types = set(map(type, values))
+    if len(types) == 1 and issubclass(next(iter(types)), (bool, int, float, np.number)):
+        try:
+            return np.array(values)
+        except OverflowError:
+            pass
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _broadcast(value, length: int) -> np.ndarray:
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (bool, int, float)):
+        return np.full(length, value)
+    array = np.empty(length, dtype=object)
+    array[:] = [value] * length
+    return array
+
+
+def _numeric(array: np.ndarray) -> bool:
+    return array.dtype.kind in 'biuf'
+
+
+class Batch:
+    """Equal-length NumPy columns of one relation."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], length: int):
+        self.columns = columns
+        self.length = length
+
+    @classmethod
+    def from_table(cls, table: Table) -> Batch:
+        if table.column_range is not None:
+            raise Unsupported('column range')
+        data = list(zip(*table.rows)) if table.rows else [()] * len(table.columns)
+        return cls({name: _array(values) for name, values in zip(table.columns, data)}, len(table.rows))
+
+    def take(self, index: np.ndarray) -> Batch:
+        return Batch({name: values[index] for name, values in self.columns.items()}, len(index))
+
+    def take_nullable(self, index: np.ndarray) -> Batch:
+        missing = index < 0
+        if not missing.any():
+            return self.take(index)
+        columns = {}
+        for name, values in self.columns.items():
+            taken = values[np.where(missing, 0, index)] if self.length else np.empty(len(index), dtype=object)
+            taken = taken.astype(object)
+            taken[missing] = None
+            columns[name] = taken
+        return Batch(columns, len(index))
+
+    def to_table(self) -> Table:
+        names = list(self.columns)
+        data = [self.columns[name].tolist() for name in names]
+        return Table(names, list(zip(*data)) if names else [() for _ in range(self.length)])
+
+
+class _Groups:
+
+    def __init__(self, ids: np.ndarray, count: int):
+        self.order = np.argsort(ids, kind='stable')
+        ordered = ids[self.order]
+        self.starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]]) if len(ids) else np.array([], int)
+        self.count = count
+
+
+class _Evaluator:
+
+    def __init__(self, scope: Dict[Optional[str], Batch], length: int, groups: Optional[_Groups] = None,
+                 rows: Optional[_Evaluator] = None):
+        self.scope = scope
+        self.length = length
+        self.groups = groups
+        self.rows = rows
+
+    def array(self, node: exp.Expression) -> np.ndarray:
+        return _broadcast(self.eval(node), self.length)
+
+    def mask(self, node: Optional[exp.Expression]) -> Optional[np.ndarray]:
+        if node is None:
+            return None
+        value = self.array(node)
+        if value.dtype != bool:
+            raise Unsupported(f'non boolean condition {node.sql()}')
+        return value
+
+    def eval(self, node: exp.Expression):
+        if isinstance(node, (exp.Alias, exp.Paren)):
+            return self.eval(node.this)
+        if isinstance(node, exp.Column):
+            batch = self.scope.get(node.table or None)
+            if batch is None or node.name not in batch.columns:
+                raise Unsupported(f'unknown column {node.sql()}')
+            return batch.columns[node.name]
+        if isinstance(node, exp.Literal):
+            if node.is_string:
+                return node.this
+            return int(node.this) if node.is_int else float(node.this)
+        if isinstance(node, exp.Boolean):
+            return node.this
+        if isinstance(node, exp.Star):
+            return 1
+        if isinstance(node, exp.AggFunc):
+            return self.aggregate(node)
+        if isinstance(node, exp.Neg):
+            return self._numeric(self.eval(node.this), operator.neg)
+        if isinstance(node, exp.Not):
+            return np.logical_not(self._boolean(self.eval(node.this)))
+        if isinstance(node, exp.And):
+            return np.logical_and(self._boolean(self.eval(node.this)), self._boolean(self.eval(node.expression)))
+        if isinstance(node, exp.Or):
+            return np.logical_or(self._boolean(self.eval(node.this)), self._boolean(self.eval(node.expression)))
+        if isinstance(node, exp.Div):
+            left, right = self.eval(node.this), self.eval(node.expression)
+            if np.any(np.asarray(right) == 0):
+                raise Unsupported('division by zero')
+            return self._numeric(left, operator.truediv, right)
+        if isinstance(node, exp.Between):
+            value = self.eval(node.this)
+            low, high = self.eval(node.args['low']), self.eval(node.args['high'])
+            return np.logical_and(self._compare(operator.ge, value, low), self._compare(operator.le, value, high))
+        if isinstance(node, exp.In):
+            if node.args.get('query') or node.args.get('unnest') or node.args.get('field'):
+                raise Unsupported('IN subquery')
+            values = self.array(node.this)
+            candidates = {self._scalar(e) for e in node.expressions}
+            return np.fromiter((v in candidates for v in values), dtype=bool, count=len(values))
+        if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+            values = self.array(node.this)
+            if values.dtype != object:
+                return np.zeros(len(values), dtype=bool)
+            return np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        op = _BINARY.get(type(node))
+        if op is not None:
+            left, right = self.eval(node.this), self.eval(node.expression)
+            if op in (operator.add, operator.sub, operator.mul):
+                return self._numeric(left, op, right)
+            return self._compare(op, left, right)
+        raise Unsupported(node.key)
+
+    def _scalar(self, node: exp.Expression):
+        value = self.eval(node)
+        if isinstance(value, np.ndarray):
+            raise Unsupported('non constant IN list')
+        return value
+
+    @staticmethod
+    def _boolean(value):
+        if isinstance(value, np.ndarray):
+            if value.dtype != bool:
+                raise Unsupported('non boolean operand')
+            return value
+        if not isinstance(value, bool):
+            raise Unsupported('non boolean operand')
+        return value
+
+    @staticmethod
+    def _numeric(left, op, right=None):
+        for value in (left, right):
+            if isinstance(value, np.ndarray) and not _numeric(value):
+                raise Unsupported('non numeric operand')
+            if not isinstance(value, (np.ndarray, int, float, type(None))) or isinstance(value, bool):
+                raise Unsupported('non numeric operand')
+        with np.errstate(all='ignore'):
+            return op(left) if right is None else op(left, right)
+
+    @staticmethod
+    def _compare(op, left, right):
+        for value in (left, right):
+            if value is None or (isinstance(value, np.ndarray) and value.dtype == object
+                                 and any(v is None for v in value)):
+                raise Unsupported('NULL comparison')
+        with np.errstate(invalid='ignore'):
+            result = op(left, right)
+        if isinstance(result, np.ndarray):
+            return result.astype(bool)
+        if not isinstance(result, (bool, np.bool_)):
+            raise Unsupported('comparison')
+        return bool(result)
+
+    def aggregate(self, node: exp.AggFunc) -> np.ndarray:
+        if self.groups is None or self.rows is None:
+            raise Unsupported('aggregate outside of GROUP BY')
+        groups = self.groups
+        if isinstance(node.this, exp.Distinct) or not groups.count:
+            raise Unsupported('aggregate')
+        if isinstance(node, TAFunc):
+            return self._ta(node, groups)
+        values = self.rows.array(node.this)[groups.order]
+        if isinstance(node, exp.Count):
+            present = np.ones(len(values), dtype=np.int64) if values.dtype != object else \
+                np.fromiter((v is not None for v in values), dtype=np.int64, count=len(values))
+            return np.add.reduceat(present, groups.starts)
+        if values.dtype == object or values.dtype.kind not in 'biuf':
+            raise Unsupported('aggregate of non numeric values')
+        if values.dtype == bool:
+            values = values.astype(np.int64)
+        if isinstance(node, exp.Sum):
+            return np.add.reduceat(values, groups.starts)
+        if isinstance(node, exp.Avg):
+            ends = np.r_[groups.starts[1:], len(values)]
+            # statistics.fmean sums with math.fsum, match it exactly
+            return np.array([math.fsum(values[start:end].tolist()) for start, end in zip(groups.starts, ends)]) \
+                / (ends - groups.starts)
+        if isinstance(node, (exp.Max, exp.Min)):
+            if values.dtype.kind == 'f' and np.isnan(values).any():
+                raise Unsupported('NaN in MIN/MAX')
+            ufunc = np.maximum if isinstance(node, exp.Max) else np.minimum
+            return ufunc.reduceat(values, groups.starts)
+        raise Unsupported(node.key)
+
+
+    def _ta(self, node: TAFunc, groups: _Groups) -> np.ndarray:
+        args = list(node.args.values())
+        columns = []
+        for arg in args[:node.columns]:
+            values = self.rows.array(arg)
+            if not _numeric(values):
+                raise Unsupported('TA of non numeric values')
+            columns.append(values[groups.order].astype(float))
+        window, offset = [self._constant(arg) for arg in (args[node.columns:] + [None, None])[:2]]
+        ends = np.r_[groups.starts[1:], len(groups.order)]
+        result = node.evaluate(columns, groups.starts, ends, window, offset or 0)
+        missing = np.isnan(result)
+        if missing.any():
+            result = result.astype(object)
+            result[missing] = None
+        return result
+
+    def _constant(self, node: Optional[exp.Expression]):
+        if node is None:
+            return None
+        value = self.rows.eval(node)
+        if isinstance(value, np.ndarray):
+            return value.max() if len(value) else None
+        return value
+
+
+class VectorizedExecutor:
+    """Runs sqlglot plans over NumPy columns, raising Unsupported for anything it can't evaluate."""
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+
+    def execute(self, plan: Plan) -> Table:
+        finished = set()
+        queue = set(plan.leaves)
+        contexts: Dict[planner.Step, Dict[Optional[str], Batch]] = {}
+
+        while queue:
+            node = queue.pop()
+            context = {
+                name: batch
+                for dep in node.dependencies
+                for name, batch in contexts[dep].items()
+            }
+            if isinstance(node, planner.Scan):
+                contexts[node] = self.scan(node, context)
+            elif isinstance(node, planner.Aggregate):
+                contexts[node] = self.aggregate(node, context)
+            elif isinstance(node, planner.Join):
+                contexts[node] = self.join(node, context)
+            elif isinstance(node, planner.Sort):
+                contexts[node] = self.sort(node, context)
+            else:
+                raise Unsupported(type(node).__name__)
+
+            finished.add(node)
+            for dep in node.dependents:
+                if all(d in contexts for d in dep.dependencies):
+                    queue.add(dep)
+            for dep in node.dependencies:
+                if all(d in finished for d in dep.dependents):
+                    contexts.pop(dep)
+
+        root = plan.root
+        return contexts[root][root.name].to_table()
+
+    @staticmethod
+    def _length(context: Dict[Optional[str], Batch]) -> int:
+        lengths = {batch.length for batch in context.values()}
+        if len(lengths) != 1:
+            raise Unsupported('misaligned context')
+        return lengths.pop()
+
+    def scan(self, step: planner.Scan, context: Dict[Optional[str], Batch]):
+        source = step.source
+        if source and isinstance(source, exp.Expression):
+            source = source.name or source.alias
+
+        if source is None:
+            context = {}
+            length = 1
+        elif source in context:
+            if not step.projections and not step.condition:
+                return {step.name: context[source]}
+            length = context[source].length
+        elif isinstance(step.source, exp.Table) and isinstance(step.source.this, exp.ReadCSV):
+            raise Unsupported('READ_CSV')
+        else:
+            table = self.tables.find(step.source)
+            batch = Batch.from_table(table)
+            context = {step.source.alias_or_name: batch}
+            length = batch.length
+
+        return {step.name: self._project_and_filter(step, context, length)}
+
+    @staticmethod
+    def _project_and_filter(step: planner.Step, context: Dict[Optional[str], Batch], length: int) -> Batch:
+        evaluator = _Evaluator(context, length)
+        mask = evaluator.mask(step.condition)
+        if mask is not None:
+            index = np.flatnonzero(mask)
+        else:
+            index = np.arange(length)
+        if not math.isinf(step.limit):
+            index = index[:int(step.limit)]
+
+        if step.projections:
+            columns = {p.alias_or_name: evaluator.array(p)[index] for p in step.projections}
+            return Batch(columns, len(index))
+        batches = {id(batch): batch for batch in context.values()}
+        if len(batches) != 1:
+            raise Unsupported('unprojected multi-table scan')
+        return next(iter(batches.values())).take(index)
+
+    def join(self, step: planner.Join, context: Dict[Optional[str], Batch]):
+        source = step.name
+        scope = {source: context[source]}
+
+        for name, join in step.joins.items():
+            other = context[name]
+            length = self._length(scope)
+            if join.get('source_key'):
+                left = join.get('side') == 'LEFT'
+                right = join.get('side') == 'RIGHT'
+                source_evaluator = _Evaluator(scope, length)
+                join_evaluator = _Evaluator({name: other}, other.length)
+                source_keys = zip(*[source_evaluator.array(k).tolist() for k in join['source_key']])
+                join_keys = zip(*[join_evaluator.array(k).tolist() for k in join['join_key']])
+                results = defaultdict(lambda: ([], []))
+                for i, key in enumerate(source_keys):
+                    results[key][0].append(i)
+                for i, key in enumerate(join_keys):
+                    results[key][1].append(i)
+                source_index, join_index = [], []
+                for a_group, b_group in results.values():
+                    if left:
+                        b_group = b_group or [-1]
+                    elif right:
+                        a_group = a_group or [-1]
+                    for a in a_group:
+                        for b in b_group:
+                            source_index.append(a)
+                            join_index.append(b)
+                source_index = np.array(source_index, dtype=np.int64)
+                join_index = np.array(join_index, dtype=np.int64)
+            else:
+                source_index = np.repeat(np.arange(length), other.length)
+                join_index = np.tile(np.arange(other.length), length)
+
+            scope = {n: batch.take_nullable(source_index) for n, batch in scope.items()}
+            scope[name] = other.take_nullable(join_index)
+            mask = _Evaluator(scope, len(source_index)).mask(join.get('condition'))
+            if mask is not None:
+                index = np.flatnonzero(mask)
+                scope = {n: batch.take(index) for n, batch in scope.items()}
+
+        if not step.condition and not step.projections:
+            return scope
+
+        length = self._length(scope)
+        if step.projections:
+            return {step.name: self._project_and_filter(step, scope, length)}
+        mask = _Evaluator(scope, length).mask(step.condition)
+        index = np.flatnonzero(mask)
+        if not math.isinf(step.limit):
+            index = index[:int(step.limit)]
+        return {n: batch.take(index) for n, batch in scope.items()}
+
+    def aggregate(self, step: planner.Aggregate, context: Dict[Optional[str], Batch]):
+        length = self._length(context)
+        rows = _Evaluator(dict(context), length)
+        if step.operands:
+            operands = Batch({o.alias_or_name: rows.array(o) for o in step.operands}, length)
+            rows.scope[None] = operands
+
+        keys = [rows.array(g) for g in step.group.values()]
+        if keys:
+            combined = np.zeros(length, dtype=np.int64)
+            for key in keys:
+                if key.dtype.kind == 'f' and np.isnan(key).any():
+                    raise Unsupported('NaN group key')
+                uniques, inverse = np.unique(key, return_inverse=True)
+                combined = combined * len(uniques) + inverse.reshape(-1)
+            _, first, ids = np.unique(combined, return_index=True, return_inverse=True)
+            ids = ids.reshape(-1)
+            groups = _Groups(ids, len(first))
+        else:
+            if not length:
+                raise Unsupported('aggregate of empty input')
+            first = np.array([0])
+            groups = _Groups(np.zeros(length, dtype=np.int64), 1)
+
+        aggregated = _Evaluator({}, groups.count, groups=groups, rows=rows)
+        columns = {name: key[first] for name, key in zip(step.group, keys)}
+        for aggregation in step.aggregations:
+            columns[aggregation.alias_or_name] = aggregated.array(aggregation)
+        batch = Batch(columns, groups.count)
+        if not math.isinf(step.limit):
+            batch = batch.take(np.arange(min(batch.length, int(step.limit))))
+
+        context = {step.name: batch, **{name: batch for name in context}}
+        if step.projections or step.condition:
+            return self.scan(step, context)
+        return context
+
+    def sort(self, step: planner.Sort, context: Dict[Optional[str], Batch]):
+        batches = {id(batch): batch for batch in context.values()}
+        if len(batches) != 1:
+            raise Unsupported('sort over multiple tables')
+        base = next(iter(batches.values()))
+        evaluator = _Evaluator(context, base.length)
+        projections = {p.alias_or_name: evaluator.array(p) for p in step.projections}
+        combined = Batch({**base.columns, **projections}, base.length)
+        sort_evaluator = _Evaluator({None: combined, **{name: combined for name in context}}, base.length)
+
+        ranks: List[np.ndarray] = []
+        for ordered in step.key:
+            values = sort_evaluator.array(ordered.this if isinstance(ordered, exp.Ordered) else ordered)
+            if values.dtype == object:
+                if any(v is None for v in values):
+                    raise Unsupported('NULL sort key')
+                values = np.unique(values, return_inverse=True)[1].reshape(-1)
+            elif values.dtype.kind == 'f' and np.isnan(values).any():
+                raise Unsupported('NaN sort key')
+            elif values.dtype == bool:
+                values = values.astype(np.int64)
+            if isinstance(ordered, exp.Ordered) and ordered.args.get('desc'):
+                values = -values
+            ranks.append(values)
+        index = np.lexsort(ranks[::-1]) if ranks else np.arange(base.length)
+        if not math.isinf(step.limit):
+            index = index[:int(step.limit)]
+
+        output = Batch({name: values[index] for name, values in projections.items()}, len(index))
+        return {step.name: output}
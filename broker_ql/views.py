@@ -0,0 +1,187 @@
+"""Materialized views, e.g. ``create materialized view exposure as select ... from positions join quotes ...``.
+
+A view keeps the result of its select in memory, under the ``views`` database. Plugins report changes
+with ``VIEWS.changed(db, table)``, or hook ``VIEWS.track(db, table)`` to an event, which marks the views
+reading that table stale. The next read of a stale view runs its select once, no matter how many changes
+came in between, and reads of a fresh view return the stored rows. Views over a table that nobody tracks
+are run on every read. SUBSCRIBE statements wait on the same changes, see ``subscribe.py``.
+
+Some tables change all the time, ``tws.quotes`` on every batch of ticks, so a view over them would be
+stale at nearly every read. A stale view computed less than ``@@broker_ql_view_refresh_interval``
+seconds ago is served as it is, which bounds how often its select runs and how old its rows get.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import dataclasses
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from mysql_mimic.errors import MysqlError, ErrorCode
+from mysql_mimic.variables import SYSTEM_VARIABLES
+from sqlglot import expressions as exp
+from sqlglot.executor.table import Table
+
+SYSTEM_VARIABLES.setdefault("broker_ql_view_refresh_interval", (float, 0.1, True))
+
+DATABASE = 'views'
+
+_TYPES = ((bool, 'BOOLEAN'), (int, 'INT'), (float, 'DOUBLE'), (datetime, 'TIMESTAMP'), (date, 'DATE'))
+
+
+def _column_type(values) -> str:
+    for value in values:
+        if value is None:
+            continue
+        for kind, name in _TYPES:
+            if isinstance(value, kind):
+                return name
+        return 'VARCHAR'
+    return 'VARCHAR'
+
+
+@dataclasses.dataclass
+class View:
+    name: str
+    expression: exp.Select
+    sources: Set[Tuple[str, str]]
+    columns: Dict[str, str] = dataclasses.field(default_factory=dict)
+    table: Optional[Table] = None
+    # bumped by every change of a source, the table is fresh while ``computed`` equals it
+    version: int = 0
+    computed: int = -1
+    # time.monotonic() of the last computation
+    computed_at: float = 0.0
+    refreshes: int = 0
+    _refreshing: Optional[asyncio.Future] = None
+
+
+class MaterializedViews:
+
+    def __init__(self, database: str = DATABASE):
+        self.database = database
+        self.views: Dict[str, View] = {}
+        self.tracked: Set[Tuple[str, str]] = set()
+        self._dependents: Dict[Tuple[str, str], Set[str]] = {}
+        self._watchers: Dict[Tuple[str, str], Set[asyncio.Event]] = {}
+        # called with (db, table) on every change, e.g. to drop cached results
+        self.listeners: List[Callable[[str, str], None]] = []
+
+    def schema(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        if not self.views:
+            return {}
+        return {self.database: {name: dict(view.columns) for name, view in self.views.items()}}
+
+    def track(self, db: str, table: str) -> Callable[..., None]:
+        """Declare that ``db.table`` reports its changes, returns a handler to hook to the change event."""
+        self.tracked.add((db, table))
+
+        def changed(*args):
+            self.changed(db, table)
+
+        return changed
+
+    def changed(self, db: str, table: str):
+        for name in self._dependents.get((db, table), ()):
+            self.views[name].version += 1
+        for event in self._watchers.get((db, table), ()):
+            event.set()
+        for listener in self.listeners:
+            listener(db, table)
+
+    @contextlib.contextmanager
+    def watch(self, sources: Iterable[Tuple[str, str]]) -> Iterator[asyncio.Event]:
+        """An event set on every change of one of ``sources``, for as long as the block runs."""
+        sources = set(sources)
+        event = asyncio.Event()
+        for source in sources:
+            self._watchers.setdefault(source, set()).add(event)
+        try:
+            yield event
+        finally:
+            for source in sources:
+                self._watchers[source].discard(event)
+                if not self._watchers[source]:
+                    del self._watchers[source]
+
+    async def create(self, session, expression: exp.Create):
+        target = expression.this
+        if target.db and target.db != self.database:
+            raise MysqlError(f"Materialized views are created in database '{self.database}'",
+                             code=ErrorCode.NOT_SUPPORTED_YET)
+        if target.name in self.views:
+            if expression.args.get('exists'):
+                return
+            raise MysqlError(f"Table '{target.name}' already exists", code=ErrorCode.UNKNOWN_ERROR)
+        select = expression.expression
+        if not isinstance(select, exp.Select):
+            raise MysqlError("Materialized views need a select", code=ErrorCode.NOT_SUPPORTED_YET)
+        select = select.copy()
+        ctes = {cte.alias_or_name for cte in select.find_all(exp.CTE)}
+        sources = set()
+        for table in select.find_all(exp.Table):
+            if table.db == '' and table.name in ctes:
+                continue
+            if table.db == '':
+                if session.database is None:
+                    raise MysqlError("No database selected", code=ErrorCode.NO_DB_ERROR)
+                table.set('db', exp.to_identifier(session.database))
+            sources.add((table.db, table.name))
+        view = View(target.name, select, sources)
+        await self._refresh(session, view)
+        self.views[view.name] = view
+        for source in sources:
+            self._dependents.setdefault(source, set()).add(view.name)
+
+    def drop(self, expression: exp.Drop):
+        target = expression.this
+        view = self.views.pop(target.name, None) if target.db in ('', self.database) else None
+        if view is None:
+            if expression.args.get('exists'):
+                return
+            raise MysqlError(f"Unknown table '{target.name}'", code=ErrorCode.NO_DB_ERROR)
+        for source in view.sources:
+            self._dependents[source].discard(view.name)
+            if not self._dependents[source]:
+                del self._dependents[source]
+
+    async def read(self, session, name: str) -> Optional[Table]:
+        view = self.views.get(name)
+        if view is None:
+            return None
+        if not view.sources <= self.tracked:
+            await self._refresh(session, view)
+        elif view.computed != view.version:
+            interval = float(session.variables.get('broker_ql_view_refresh_interval') or 0)
+            if time.monotonic() - view.computed_at >= interval:
+                await self._refresh(session, view)
+        # readers may execute at the same time, each iterates its own Table
+        return Table(view.table.columns, view.table.rows)
+
+    async def _refresh(self, session, view: View):
+        if view._refreshing is None:
+            view._refreshing = asyncio.ensure_future(self._compute(session, view))
+        refreshing = view._refreshing
+        try:
+            await asyncio.shield(refreshing)
+        finally:
+            if view._refreshing is refreshing and refreshing.done():
+                view._refreshing = None
+
+    @staticmethod
+    async def _compute(session, view: View):
+        version = view.version
+        rows, columns = await session.query(view.expression.copy(), view.expression.sql(dialect=session.dialect), {})
+        rows: List[tuple] = [tuple(row) for row in rows]
+        if not view.columns:
+            # typed once, at create, so the schema doesn't change under cached plans
+            view.columns = {c: _column_type(row[i] for row in rows) for i, c in enumerate(columns)}
+        view.table = Table(list(columns), rows)
+        view.computed = version
+        view.computed_at = time.monotonic()
+        view.refreshes += 1
+
+
+VIEWS = MaterializedViews()
@@ -1,13 +1,15 @@
-from broker_ql.session import Session
-from .data import init, destroy, config as plugin_config, schema_provider, select, insert, update, delete
-from .data import __database_name__
-
-Session.SCHEMA_PROVIDERS.append(schema_provider)
-Session.DATA_PROVIDERS[__database_name__] = select
-Session.DATA_MODIFIERS[__database_name__] = update
-Session.DATA_REMOVERS[__database_name__] = delete
-Session.DATA_CREATORS[__database_name__] = insert
+from importlib import import_module
 
 plugin_arguments = [
     (['--plugin-tws-clientId'], dict(help='TWS ClientId')),
 ]
+
+# importing them loads ib_async and registers the tws tables, reading plugin_arguments does neither
+_PLUGIN = {'init', 'destroy', 'plugin_config', 'schema_provider', 'select', 'insert', 'update', 'delete',
+           '__database_name__', 'freshness'}
+
+
+def __getattr__(name):
+    if name in _PLUGIN:
+        return getattr(import_module('.plugin', __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from ib_async import AccountValue
+
+from broker_ql.pushdown import Pushdown
+
+
+class AccountStore:
+    """Account summary rows kept current by ``accountSummaryEvent``.
+
+    The first query subscribes to the summary of every managed account with one request, later
+    queries only copy the rows out of memory.
+    """
+
+    def __init__(self, columns: Dict[str, str], currencies=('USD', '')):
+        self.columns = columns
+        self.currencies = set(currencies)
+        self.tags = {''.join(p.capitalize() for p in col.split('_')): col for col in columns if col != 'account'}
+        self.rows: Dict[str, Dict[str, object]] = {}
+        self._loaded: Optional[asyncio.Future] = None
+
+    def update(self, value: AccountValue):
+        col = self.tags.get(value.tag)
+        if col is None or value.currency not in self.currencies:
+            return
+        row = self.rows.get(value.account)
+        if row is None:
+            row = self.rows[value.account] = dict.fromkeys(self.columns)
+            row['account'] = value.account
+        row[col] = float(value.value) if self.columns[col] == 'DOUBLE' else value.value
+
+    def reset(self):
+        self.rows.clear()
+        self._loaded = None
+
+    async def load(self, ib):
+        if self._loaded is None:
+            if ib.wrapper.acctSummary:
+                for value in ib.wrapper.acctSummary.values():
+                    self.update(value)
+                self._loaded = asyncio.get_running_loop().create_future()
+                self._loaded.set_result(None)
+            else:
+                self._loaded = asyncio.ensure_future(ib.reqAccountSummaryAsync())
+        loaded = self._loaded
+        try:
+            await asyncio.shield(loaded)
+        except Exception:
+            if self._loaded is loaded:
+                self._loaded = None
+            raise
+
+    def snapshot(self, accounts: Iterable[str], pushdown: Optional[Pushdown] = None) -> List[Dict[str, object]]:
+        wanted = pushdown.values('account') if pushdown is not None else None
+        return [dict(self.rows.get(account) or {**dict.fromkeys(self.columns), 'account': account})
+                for account in accounts if wanted is None or account in wanted]
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import datetime
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from ib_async import BarData, Contract
+
+
+@dataclasses.dataclass
+class _Entry:
+    bars: List[BarData]
+    window: int
+    fetched_at: float
+
+
+def _contract_key(contract: Contract) -> Hashable:
+    if contract.conId:
+        return contract.conId
+    return contract.symbol, contract.secType, contract.exchange, contract.currency
+
+
+def _since(last: datetime.date) -> datetime.timedelta:
+    if isinstance(last, datetime.datetime):
+        return datetime.datetime.now(last.tzinfo) - last
+    return datetime.date.today() - last
+
+
+def _duration(elapsed: datetime.timedelta, bar_size: str) -> str:
+    # re-request the last cached bar as well, it may still have been forming
+    if elapsed < datetime.timedelta(days=1) and not bar_size.split()[-1].startswith(('day', 'week', 'month')):
+        return f"{max(60, math.ceil(elapsed.total_seconds()) + 60)} S"
+    # IB rejects durations in seconds for daily and longer bars
+    return f"{elapsed.days + 1} D"
+
+
+class BarCache:
+    """Historical bars per (contract, bar size, what to show), refreshed incrementally.
+
+    A fresh entry is served from memory. Once its ttl has passed, only the bars from the last cached
+    one onwards are requested and merged in, so the full duration is fetched once per contract.
+    """
+
+    def __init__(self, ttl: float = 60, size: int = 1024):
+        self.ttl = ttl
+        self.size = size
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get(self, ib, contract: Contract, duration: str, bar_size: str, what_to_show: str,
+                  use_rth: bool = True) -> List[BarData]:
+        key = (_contract_key(contract), bar_size, what_to_show, use_rth)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            if time.monotonic() - entry.fetched_at < self.ttl:
+                return entry.bars
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._refresh(ib, key, entry, contract, duration, bar_size,
+                                                          what_to_show, use_rth))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _refresh(self, ib, key: Hashable, entry: Optional[_Entry], contract: Contract, duration: str,
+                       bar_size: str, what_to_show: str, use_rth: bool) -> List[BarData]:
+        if entry is not None and entry.bars:
+            duration = _duration(_since(entry.bars[-1].date), bar_size)
+        bars = list(await ib.reqHistoricalDataAsync(
+            contract, '', duration, bar_size, what_to_show, use_rth, formatDate=1, timeout=0))
+        if entry is not None and entry.bars:
+            if bars:
+                bars = [b for b in entry.bars if b.date < bars[0].date] + bars
+                bars = bars[-entry.window:]
+            else:
+                bars = entry.bars
+            window = entry.window
+        else:
+            window = len(bars)
+        self._entries[key] = _Entry(bars=bars, window=window, fetched_at=time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return bars
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from ib_async import Contract
+
+_KEY_FIELDS = ('secType', 'symbol', 'exchange', 'primaryExchange', 'currency', 'lastTradeDateOrContractMonth',
+               'strike', 'right', 'multiplier', 'localSymbol', 'tradingClass', 'conId')
+_STORED_FIELDS = [f.name for f in dataclasses.fields(Contract) if f.name not in ('comboLegs', 'deltaNeutralContract')]
+
+
+def contract_key(contract: Contract) -> str:
+    return json.dumps([getattr(contract, f) for f in _KEY_FIELDS])
+
+
+class ContractResolver:
+    """Qualifies contracts in batches and remembers the answers.
+
+    Qualified contracts are kept in an LRU for ``ttl`` seconds and written to a SQLite file at
+    ``path``, which is read back on first use so a restart doesn't qualify the same symbols again.
+    """
+
+    def __init__(self, ttl: float = 7 * 24 * 3600, size: int = 4096, path: Optional[str] = None):
+        self.ttl = ttl
+        self.size = size
+        self.path = path
+        self._entries: OrderedDict[str, Tuple[float, Contract]] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._loaded = False
+        # qualifyContracts requests sent to TWS
+        self.sent = 0
+
+    def configure(self, ttl: float, size: int, path: Optional[str]):
+        self.ttl = ttl
+        self.size = size
+        if path != self.path:
+            self.close()
+            self.path = path
+            self._loaded = False
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _open(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        self._db = sqlite3.connect(os.path.expanduser(self.path))
+        self._db.execute("create table if not exists contracts (key text primary key, contract text, updated real)")
+        expired = time.time() - self.ttl
+        self._db.execute("delete from contracts where updated < ?", (expired,))
+        self._db.commit()
+        for key, contract, updated in self._db.execute(
+                "select key, contract, updated from contracts order by updated desc limit ?", (self.size,)):
+            self._entries[key] = (updated, Contract(**json.loads(contract)))
+            self._entries.move_to_end(key, last=False)
+
+    def _get(self, key: str) -> Optional[Contract]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return dataclasses.replace(entry[1])
+
+    def _put(self, items: Dict[str, Contract]):
+        now = time.time()
+        for key, contract in items.items():
+            self._entries[key] = (now, dataclasses.replace(contract))
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        if self._db is not None and items:
+            self._db.executemany(
+                "insert or replace into contracts values (?, ?, ?)",
+                [(key, json.dumps({f: getattr(c, f) for f in _STORED_FIELDS}), now) for key, c in items.items()])
+            self._db.commit()
+
+    async def resolve(self, ib, contracts: List[Contract]) -> List[Optional[Contract]]:
+        """Qualified copies of ``contracts`` in the same order, None where TWS found no unique match."""
+        self._open()
+        keys = [contract_key(c) for c in contracts]
+        results: List[Optional[Contract]] = [self._get(key) for key in keys]
+        misses: Dict[str, Contract] = {}
+        for key, contract, result in zip(keys, contracts, results):
+            if result is None and key not in misses:
+                misses[key] = dataclasses.replace(contract)
+        if misses:
+            self.sent += 1
+            found = {id(c) for c in await ib.qualifyContractsAsync(*misses.values())}
+            qualified = {key: c for key, c in misses.items() if id(c) in found}
+            self._put(qualified)
+            results = [result if result is not None else
+                       (dataclasses.replace(qualified[key]) if key in qualified else None)
+                       for key, result in zip(keys, results)]
+        return results
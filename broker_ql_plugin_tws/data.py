@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import collections
 import configparser
 import dataclasses
 import functools
@@ -14,10 +15,21 @@ import ib_async.ib as _ib
 from ib_async import IB
 from mysql_mimic.errors import MysqlError, ErrorCode
 from sqlglot.executor.env import ENV as _ENV
+from sqlglot.executor.table import Table
 
-from broker_ql import reloading
+from broker_ql import metrics, reloading
+from broker_ql.pushdown import Pushdown
 from broker_ql.session import Session
-from .wrapper import Wrapper, UNSET_DOUBLE
+from broker_ql.views import VIEWS
+from .accounts import AccountStore
+from .bars import BarCache
+from .contracts import ContractResolver
+from .indexes import PositionIndex, TickerIndex, TradeIndex
+from .mappers import RowMapper, camel_case
+from .pacing import HistoricalScheduler
+from .quotes import QuoteStore
+from .recording import Recorder, Replayer
+from .wrapper import Wrapper
 
 _ib.Wrapper = Wrapper
 
@@ -49,6 +61,49 @@ def _on_order_open(trade: _ib.Trade):
 ib.errorEvent += _on_error
 ib.openOrderEvent += _on_order_open
 
+
+@dataclasses.dataclass
+class OrderOutcome:
+    order_id: int
+    acknowledged: bool = False
+    error: Optional[str] = None
+
+
+async def place_orders(placements: List[tuple], timeout: float) -> List[OrderOutcome]:
+    """Place every (contract, order, wait) first, then await the acknowledgements of those with ``wait`` together."""
+    loop = asyncio.get_running_loop()
+    outcomes, futures = [], {}
+    for contract, order, wait in placements:
+        trade = ib.placeOrder(contract, order)
+        tws_requests['placeOrder'] += 1
+        outcome = OrderOutcome(trade.order.orderId)
+        outcomes.append(outcome)
+        if wait:
+            futures[outcome.order_id] = _FUTURES[outcome.order_id] = loop.create_future()
+    if futures:
+        await asyncio.wait(futures.values(), timeout=timeout)
+    for outcome in outcomes:
+        future = futures.get(outcome.order_id)
+        if future is None:
+            continue
+        _FUTURES.pop(outcome.order_id, None)
+        if not future.done():
+            future.cancel()
+        elif future.exception() is not None:
+            outcome.error = str(future.exception()) or repr(future.exception())
+        else:
+            outcome.acknowledged = True
+    return outcomes
+
+
+def _report(session: Session, outcomes: List[OrderOutcome]) -> int:
+    failed = [o for o in outcomes if o.error is not None]
+    if failed and len(failed) == len(outcomes):
+        raise MysqlError('; '.join(f"order {o.order_id}: {o.error}" for o in failed), code=ErrorCode.UNKNOWN_ERROR)
+    for o in failed:
+        session.warnings.append(('Error', ErrorCode.UNKNOWN_ERROR, f"order {o.order_id}: {o.error}"))
+    return len(outcomes) - len(failed)
+
 __plugin_name__ = "plugin_tws"
 __database_name__ = "tws"
 
@@ -57,6 +112,34 @@ _config_parse.add_section(__plugin_name__)
 
 config: configparser.SectionProxy = _config_parse[__plugin_name__]
 
+bar_cache = BarCache()
+historical = HistoricalScheduler(ib)
+contracts = ContractResolver()
+order_ack_timeout = 0.5
+# other requests sent to TWS by name, historical data and qualify requests are counted where they are made
+tws_requests = collections.Counter()
+metrics.counter('broker_ql_tws_requests_total', 'Requests sent to TWS', ('request',), function=lambda: {
+    **{(name,): n for name, n in tws_requests.items()},
+    ('reqHistoricalData',): historical.sent,
+    ('qualifyContracts',): contracts.sent,
+})
+metrics.gauge('broker_ql_tws_inflight_requests', 'TWS requests awaiting their answer', ('request',), function=lambda: {
+    ('reqHistoricalData',): historical.inflight,
+    ('placeOrder',): len(_FUTURES),
+})
+metrics.gauge('broker_ql_tws_connected', 'Whether the TWS API connection is up',
+              function=lambda: {(): float(ib.isConnected())})
+metrics.gauge('broker_ql_tws_replay_lag_seconds', 'How far behind its recorded schedule a replay is',
+              function=lambda: {(): replayer.lag if replayer is not None else 0.0})
+# record = <path> logs the TWS event stream, replay = <path> plays one back at replay_speed (0 as fast as possible)
+recorder: Optional[Recorder] = None
+replayer: Optional[Replayer] = None
+_replaying: Optional[asyncio.Future] = None
+# keeps the TWS connection up, reconnect_delay doubling up to reconnect_max_delay seconds between attempts
+_connection: Optional[asyncio.Future] = None
+# seconds a query result over each table may be served from the result cache, e.g. positions_freshness = 10
+freshness = {'positions': 5.0, 'accounts': 30.0, 'ohlcv': 300.0, 'subscriptions': 60.0}
+
 
 def next_order_id():
     return ib.client.getReqId()
@@ -66,28 +149,108 @@ _ENV['TWS_NEXT_ORDER_ID'] = next_order_id
 
 
 async def init():
-    print("connecting to tws...")
+    bar_cache.ttl = config.getfloat('bar_cache_ttl', bar_cache.ttl)
+    bar_cache.size = config.getint('bar_cache_size', bar_cache.size)
+    historical.configure(
+        max_inflight=config.getint('hist_max_inflight', 50),
+        requests=config.getint('hist_pacing_requests', 60),
+        period=config.getfloat('hist_pacing_period', 600),
+        identical_interval=config.getfloat('hist_identical_interval', 15),
+    )
+    global order_ack_timeout
+    order_ack_timeout = config.getfloat('order_ack_timeout', order_ack_timeout)
+    for table_name in schema_provider()[__database_name__]:
+        freshness[table_name] = config.getfloat(f'{table_name}_freshness', freshness.get(table_name, 0.0))
+    contracts.configure(
+        ttl=config.getfloat('contract_cache_ttl', contracts.ttl),
+        size=config.getint('contract_cache_size', contracts.size),
+        # in memory only unless asked, e.g. contract_cache_path = ~/.broker_ql_contracts.db
+        path=config.get('contract_cache_path') or None,
+    )
+    global recorder, replayer, _replaying, _connection
+    if config.get('replay'):
+        print(f"replaying {config.get('replay')}...")
+        replayer = Replayer(config.get('replay'), config.getfloat('replay_speed', 1.0),
+                            marks={'connected': _synced}).install(ib)
+        _replaying = asyncio.ensure_future(replayer.run())
+        return
     if ib.isConnected():
         return
-    await ib.connectAsync(
-        config.get('host'),
-        config.getint('port'),
-        clientId=config.getint('clientId', 0),
-        timeout=config.getint('timeout', 20),
-    )
-    print("tws connected")
+    if config.get('record'):
+        recorder = Recorder(config.get('record')).install(ib)
+    connected = asyncio.get_running_loop().create_future()
+    _connection = asyncio.ensure_future(_keep_connected(connected))
+    await connected
+
+
+async def _keep_connected(connected: asyncio.Future):
+    """Connect, and connect again with backoff whenever TWS goes away, for as long as the plugin runs."""
+    delay = config.getfloat('reconnect_delay', 1)
+    lost, resubscribe, up = asyncio.Event(), [], False
+
+    def on_disconnected():
+        nonlocal up
+        if up:
+            # ib_async has reset its wrapper by now, the index still has every ticker, shared keys included
+            resubscribe[:] = [ticker.contract for ticker in ticker_index.tickers()]
+            up = False
+        lost.set()
+
+    ib.disconnectedEvent += on_disconnected
+    try:
+        while True:
+            print("connecting to tws...")
+            try:
+                await ib.connectAsync(
+                    config.get('host'),
+                    config.getint('port'),
+                    clientId=config.getint('clientId', 0),
+                    timeout=config.getint('timeout', 20),
+                )
+            except Exception as e:
+                print(f"connect to tws fail: {e!r}, retry in {delay:g}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, config.getfloat('reconnect_max_delay', 60))
+                continue
+            delay, up = config.getfloat('reconnect_delay', 1), True
+            lost.clear()
+            for contract in resubscribe:
+                ib.reqMktData(contract)
+                tws_requests['reqMktData'] += 1
+            resubscribe.clear()
+            ticker_index.sync(ib.tickers())
+            quote_store.sync(ib.tickers())
+            _synced()
+            if recorder is not None:
+                recorder.mark('connected')
+            print("tws connected")
+            ready = Session.READY.get(__database_name__)
+            if not connected.done():
+                connected.set_result(None)
+            elif ready is not None and not ready.done():
+                ready.set_result(None)
+            await lost.wait()
+            print("tws disconnected")
+            # statements on tws wait for the reconnect instead of reading what's left of the session
+            Session.READY[__database_name__] = asyncio.get_running_loop().create_future()
+    finally:
+        ib.disconnectedEvent -= on_disconnected
+
+
+def _synced():
+    trade_index.sync(ib.openTrades())
+    position_index.sync(ib.positions())
 
 
 def destroy():
     print("disconnect from tws")
+    for task in (_replaying, _connection):
+        if task is not None:
+            task.cancel()
     ib.disconnect()
-
-
-def camel_case(s: str):
-    parts = s.split('_')
-    if len(parts) == 1:
-        return parts[0]
-    return parts[0] + ''.join([p.capitalize() for p in parts[1:]])
+    if recorder is not None:
+        recorder.close()
+    contracts.close()
 
 
 @reloading
@@ -153,88 +316,109 @@ def schema_provider():
     }
 
 
+quote_store = QuoteStore([c for c in schema_provider()[__database_name__]['quotes'] if c != 'symbol'])
+ib.pendingTickersEvent += quote_store.update
+account_store = AccountStore(schema_provider()[__database_name__]['accounts'])
+ib.accountSummaryEvent += account_store.update
+ib.disconnectedEvent += account_store.reset
+row_mappers = {
+    'orders': RowMapper(schema_provider()[__database_name__]['orders'], 'order', {
+        'symbol': 'contract',
+        'status': 'orderStatus',
+        'whyHeld': 'orderStatus',
+    }),
+    'positions': RowMapper(schema_provider()[__database_name__]['positions'], 'self', {
+        'symbol': 'contract',
+    }),
+    'subscriptions': RowMapper(schema_provider()[__database_name__]['subscriptions'], 'contract'),
+    'ohlcv': RowMapper(schema_provider()[__database_name__]['ohlcv'], 'self', consts=['symbol']),
+}
+ticker_index = TickerIndex()
+trade_index = TradeIndex()
+for _event in (ib.newOrderEvent, ib.orderModifyEvent, ib.openOrderEvent, ib.orderStatusEvent, ib.cancelOrderEvent):
+    _event += trade_index.update
+ib.disconnectedEvent += trade_index.reset
+position_index = PositionIndex()
+ib.positionEvent += position_index.update
+ib.disconnectedEvent += position_index.reset
+# materialized views over these tables are only recomputed after one of these events
+table_changed = {
+    'orders': VIEWS.track(__database_name__, 'orders'),
+    'positions': VIEWS.track(__database_name__, 'positions'),
+    'quotes': VIEWS.track(__database_name__, 'quotes'),
+    'subscriptions': VIEWS.track(__database_name__, 'subscriptions'),
+    'accounts': VIEWS.track(__database_name__, 'accounts'),
+}
+for _event in (ib.openOrderEvent, ib.orderStatusEvent):
+    _event += table_changed['orders']
+ib.positionEvent += table_changed['positions']
+ib.pendingTickersEvent += table_changed['quotes']
+ib.accountSummaryEvent += table_changed['accounts']
+for _changed in table_changed.values():
+    ib.disconnectedEvent += _changed
+
+
+def sync_tickers():
+    if len(ticker_index) != len(ib.wrapper.tickers):
+        ticker_index.sync(ib.tickers())
+    if len(quote_store) != len(ib.wrapper.tickers):
+        quote_store.sync(ib.tickers())
+
+
 @reloading
-async def select(table_name: str, where: Optional[List[Dict]] = None):
+async def select(table_name: str, where: Optional[List[Dict]] = None, pushdown: Optional[Pushdown] = None):
     schema = schema_provider()[__database_name__]
     if table_name not in schema:
         return None
     columns = schema[table_name]
     if table_name == 'orders':
-        return mapping([t for t in ib.openTrades() if t.isActive()], columns, 'order', {
-            'symbol': 'contract',
-            'status': 'orderStatus',
-            'whyHeld': 'orderStatus',
-        })
+        order_ids = pushdown.values('order_id') if pushdown is not None else None
+        trades = trade_index.trades() if order_ids is None else trade_index.get(order_ids)
+        return row_mappers['orders'].table([t for t in trades if t.isActive()], pushdown)
     elif table_name == 'positions':
-        return mapping([p for p in ib.positions() if p.avgCost != 0], columns, 'self', {
-            'symbol': 'contract',
-        })
+        positions = position_index.positions(pushdown.values('account') if pushdown is not None else None,
+                                             pushdown.values('symbol') if pushdown is not None else None)
+        return row_mappers['positions'].table([p for p in positions if p.avgCost != 0], pushdown)
     elif table_name == 'subscriptions':
-        return mapping([t for t in ib.tickers()], columns, 'contract', {
-        })
+        return row_mappers['subscriptions'].table(ib.tickers(), pushdown)
     elif table_name == 'quotes':
-        return mapping([t for t in ib.tickers()], columns, 'self', {
-            'symbol': 'contract',
-        })
+        sync_tickers()
+        return quote_store.snapshot(list(columns), pushdown)
     elif table_name == 'accounts':
-        rows = []
-        for account in ib.managedAccounts():
-            account_info = {f"{tag.tag[0].lower()}{tag.tag[1:]}": tag.value for tag in
-                            await ib.accountSummaryAsync(account) if
-                            tag.currency in ['USD', '']}
-            account_info['account'] = account
-            row = {}
-            for col, d_type in columns.items():
-                value = account_info[camel_case(col)]
-                if d_type == 'DOUBLE':
-                    value = float(value)
-                row[col] = value
-            rows.append(row)
-        return rows
+        await account_store.load(ib)
+        return account_store.snapshot(ib.managedAccounts(), pushdown)
     elif table_name == 'ohlcv':
         results = []
         if where is not None:
             symbols = [r['symbol'] for r in where]
         else:
             symbols = None
+        pushed_symbols = pushdown.values('symbol') if pushdown is not None else None
+
+        async def fetch(contract):
+            return contract, await bar_cache.get(historical, contract, '50 D', '1 day', 'TRADES', True)
+
+        tasks = []
         for t in ib.tickers():
             if symbols is not None and t.contract.symbol not in symbols:
                 continue
-            bars = await ib.reqHistoricalDataAsync(
-                t.contract, '', '50 D', '1 day', 'TRADES', True, formatDate=1,
-                timeout=0)
-            result = mapping(bars, columns, 'self', {}, consts={
-                'symbol': bars.contract.symbol
-            })
-            results += result
-        return results
+            if pushed_symbols is not None and t.contract.symbol not in pushed_symbols:
+                continue
+            tasks.append(asyncio.ensure_future(fetch(t.contract)))
+        try:
+            for done in asyncio.as_completed(tasks):
+                contract, bars = await done
+                results += row_mappers['ohlcv'].rows(bars, pushdown, {'symbol': contract.symbol})
+                if pushdown is not None and pushdown.limit is not None and len(results) >= pushdown.limit:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return Table(row_mappers['ohlcv'].names(pushdown), results)
     else:
         return []
 
 
-@reloading
-def mapping(objects: list, cols: list[str], obj_attr, specials: dict, consts: dict = None):
-    if consts is None:
-        consts = {}
-    rows = []
-    for ele in objects:
-        row = {}
-        for col in cols:
-            attr = camel_case(col)
-            obj = getattr(ele, obj_attr) if obj_attr != 'self' else ele
-            if attr in consts:
-                row[col] = consts[attr]
-                continue
-            if attr in specials:
-                obj = getattr(ele, specials[attr])
-            value = getattr(obj, attr)
-            if isinstance(value, float) and value == UNSET_DOUBLE:
-                value = float('nan')
-            row[col] = value
-        rows.append(row)
-    return rows
-
-
 @reloading
 async def insert(session: Session, table_name: str, fields: List[str], rows: List) -> int:
     if table_name not in {'subscriptions', 'orders'}:
@@ -253,57 +437,56 @@ async def insert(session: Session, table_name: str, fields: List[str], rows: Lis
     if table_name == 'subscriptions':
         if 'symbol' not in fields:
             return 0
-        for row in rows:
-            row = {camel_case(k): v for k, v in zip(fields, row)}
-            contract = dataclasses.replace(_ib.Contract(exchange="SMART", currency="USD", secType="STK"), **row)
-            qualified = await ib.qualifyContractsAsync(contract)
-            if not qualified:
+        requested = [dataclasses.replace(_ib.Contract(exchange="SMART", currency="USD", secType="STK"),
+                                         **{camel_case(k): v for k, v in zip(fields, row)}) for row in rows]
+        sync_tickers()
+        for contract in await contracts.resolve(ib, requested):
+            if contract is None:
                 continue
-            contract = qualified[0]
             if ib.ticker(contract) is not None:
                 continue
-            ib.reqMktData(contract)
+            ticker = ib.reqMktData(contract)
+            tws_requests['reqMktData'] += 1
+            ticker_index.add(ticker)
+            quote_store.update([ticker])
             affected_rows += 1
+        if affected_rows:
+            table_changed['subscriptions']()
+            table_changed['quotes']()
     elif table_name == 'orders':
         if 'symbol' not in fields:
             return 0
+        rows = [{camel_case(k): v for k, v in zip(fields, row)} for row in rows]
+        sync_tickers()
+        subscribed = {symbol: ticker_index.contract(symbol) for symbol in dict.fromkeys(row['symbol'] for row in rows)}
+        unknown = [symbol for symbol, contract in subscribed.items() if contract is None]
+        resolved = await contracts.resolve(ib, [
+            _ib.Contract(symbol=symbol, exchange="SMART", currency="USD", secType="STK") for symbol in unknown])
+        subscribed.update(zip(unknown, resolved))
+        placements, transactions = [], []
         for idx, row in enumerate(rows):
-            row = {camel_case(k): v for k, v in zip(fields, row)}
-            for t in ib.tickers():
-                if t.contract.symbol != row['symbol']:
-                    continue
-                contract = t.contract
-                break
-            else:
-                contract = _ib.Contract(symbol=row['symbol'], exchange="SMART", currency="USD", secType="STK")
-                qualified = await ib.qualifyContractsAsync(contract)
-                if not qualified:
-                    continue
-                contract = qualified[0]
+            contract = subscribed[row['symbol']]
+            if contract is None:
+                continue
             params = inspect.signature(_ib.Order).parameters
             order = dataclasses.replace(_ib.Order(), **{k: v for k, v in row.items() if k in params})
-            commit, rollback = None, None
             if session.in_trx:
                 last_row = idx == len(rows) - 1
                 order.transmit = False
-                commit = functools.partial(ib.placeOrder, contract, dataclasses.replace(order, transmit=last_row))
-                rollback = functools.partial(ib.cancelOrder, dataclasses.replace(order))
-            try:
-                future = asyncio.Future()
-                if order.transmit:
-                    _FUTURES[order.orderId] = future
-                ib.placeOrder(contract, order)
-                if order.transmit:
-                    try:
-                        await asyncio.wait_for(future, 0.2)
-                    except asyncio.TimeoutError:
-                        pass
-                if session.in_trx:
-                    session.trx_commits.append(commit)
-                    session.trx_rollbacks.append(rollback)
-            except Exception as e:
-                raise MysqlError(str(e) or traceback.format_exc(), code=ErrorCode.UNKNOWN_ERROR)
-            affected_rows += 1
+                transactions.append((
+                    functools.partial(ib.placeOrder, contract, dataclasses.replace(order, transmit=last_row)),
+                    functools.partial(ib.cancelOrder, dataclasses.replace(order)),
+                ))
+            placements.append((contract, order, order.transmit))
+        try:
+            outcomes = await place_orders(placements, order_ack_timeout)
+        except Exception as e:
+            raise MysqlError(str(e) or traceback.format_exc(), code=ErrorCode.UNKNOWN_ERROR)
+        affected_rows = _report(session, outcomes)
+        for outcome, (commit, rollback) in zip(outcomes, transactions):
+            if outcome.error is None:
+                session.trx_commits.append(commit)
+                session.trx_rollbacks.append(rollback)
     return affected_rows
 
 
@@ -313,7 +496,8 @@ async def update(session: Session, table_name: str, rows: List, fields: Dict):
         raise UnsupportedOperation()
     if table_name == 'orders':
         order_rows = {row['order_id']: row for row in rows}
-        target_trades = list(filter(lambda x: x.order.orderId in order_rows and x.isActive(), ib.openTrades()))
+        target_trades = [t for t in trade_index.get(order_rows) if t.isActive()]
+        placements, transactions = [], []
         for trade in target_trades:
             order = dataclasses.replace(trade.order, parentId=0)
             for k, v in fields.items():
@@ -326,17 +510,19 @@ async def update(session: Session, table_name: str, rows: List, fields: Dict):
                 commit = functools.partial(ib.placeOrder, trade.contract, dataclasses.replace(order, transmit=True))
                 rollback = functools.partial(ib.placeOrder, trade.contract,
                                              dataclasses.replace(trade.order, parentId=0))
-            try:
-                future = asyncio.Future()
-                _FUTURES[order.orderId] = future
-                ib.placeOrder(trade.contract, order)
-                await asyncio.wait_for(future, 0.2)
-            except asyncio.TimeoutError:
-                if session.in_trx:
+            transactions.append((commit, rollback))
+            placements.append((trade.contract, order, True))
+        try:
+            outcomes = await place_orders(placements, order_ack_timeout)
+        except Exception as e:
+            raise MysqlError(str(e) or traceback.format_exc(), code=ErrorCode.UNKNOWN_ERROR)
+        affected_rows = _report(session, outcomes)
+        if session.in_trx:
+            for outcome, (commit, rollback) in zip(outcomes, transactions):
+                if outcome.error is None and not outcome.acknowledged:
                     session.trx_commits.append(commit)
                     session.trx_rollbacks.append(rollback)
-            except Exception as e:
-                raise MysqlError(str(e) or traceback.format_exc(), code=ErrorCode.UNKNOWN_ERROR)
+        return affected_rows
 
 
 @reloading
@@ -346,16 +532,20 @@ async def delete(session: Session, table_name: str, rows: List):
     if table_name == 'orders':
         await session.handle_query("commit", {})
         order_rows = {row['order_id']: row for row in rows}
-        target_trades = list(filter(lambda x: x.order.orderId in order_rows and x.isActive(), ib.openTrades()))
+        target_trades = [t for t in trade_index.get(order_rows) if t.isActive()]
         for trade in target_trades:
             ib.cancelOrder(trade.order)
+            tws_requests['cancelOrder'] += 1
     elif table_name == 'subscriptions':
+        sync_tickers()
         for row in rows:
-            for t in ib.tickers():
-                for k in ['symbol', 'sec_type', 'currency']:
-                    if row[k] != getattr(t.contract, camel_case(k)):
-                        break
-                else:
-                    ib.cancelMktData(t.contract)
-                    ib.wrapper.tickers.pop(id(t.contract))
-                    break
+            t = ticker_index.find(row['symbol'], row['sec_type'], row['currency'])
+            if t is None:
+                continue
+            ib.cancelMktData(t.contract)
+            tws_requests['cancelMktData'] += 1
+            ib.wrapper.tickers.pop(id(t.contract))
+            ticker_index.remove(t)
+            quote_store.remove(t)
+        table_changed['subscriptions']()
+        table_changed['quotes']()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ib_async import Contract, Position, Ticker, Trade
+
+
+class TickerIndex:
+    """Subscribed tickers by symbol, and by (symbol, sec_type, currency) for the subscriptions table.
+
+    Tickers only come and go through our own ``reqMktData``/``cancelMktData``, so callers ``add`` and
+    ``remove`` them, and ``sync`` against ``ib.tickers()`` when the counts drift apart. Option strikes
+    of one underlying or a stock on two exchanges share a key, hence a bucket per key.
+    """
+
+    def __init__(self):
+        self._tickers: Dict[int, Ticker] = {}
+        self._by_key: Dict[Tuple[str, str, str], Dict[int, Ticker]] = {}
+        self._by_symbol: Dict[str, Dict[int, Ticker]] = {}
+
+    def __len__(self):
+        return len(self._tickers)
+
+    @staticmethod
+    def key(contract: Contract) -> Tuple[str, str, str]:
+        return contract.symbol, contract.secType, contract.currency
+
+    def add(self, ticker: Ticker):
+        self._tickers[id(ticker)] = ticker
+        self._by_key.setdefault(self.key(ticker.contract), {})[id(ticker)] = ticker
+        self._by_symbol.setdefault(ticker.contract.symbol, {})[id(ticker)] = ticker
+
+    def remove(self, ticker: Ticker):
+        self._tickers.pop(id(ticker), None)
+        for index, key in ((self._by_key, self.key(ticker.contract)), (self._by_symbol, ticker.contract.symbol)):
+            bucket = index.get(key, {})
+            bucket.pop(id(ticker), None)
+            if not bucket:
+                index.pop(key, None)
+
+    def sync(self, tickers: Iterable[Ticker]):
+        self._tickers.clear()
+        self._by_key.clear()
+        self._by_symbol.clear()
+        for ticker in tickers:
+            self.add(ticker)
+
+    def tickers(self) -> List[Ticker]:
+        return list(self._tickers.values())
+
+    def find(self, symbol: str, sec_type: str, currency: str) -> Optional[Ticker]:
+        for ticker in self._by_key.get((symbol, sec_type, currency), {}).values():
+            return ticker
+        return None
+
+    def contract(self, symbol: str) -> Optional[Contract]:
+        for ticker in self._by_symbol.get(symbol, {}).values():
+            return ticker.contract
+        return None
+
+
+class TradeIndex:
+    """Trades that are not done yet, by orderId.
+
+    ``update`` is hooked to the order events, which also fire for the open orders TWS sends on
+    connect, so a statement finds its trades without scanning ``ib.openTrades()``. Manual TWS orders
+    can share an orderId, hence a bucket per id.
+    """
+
+    def __init__(self):
+        self._by_order_id: Dict[int, Dict[int, Trade]] = {}
+        self._keys: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, trade: Trade, *args):
+        self._discard(trade)
+        if not trade.isDone():
+            self._by_order_id.setdefault(trade.order.orderId, {})[id(trade)] = trade
+            self._keys[id(trade)] = trade.order.orderId
+
+    def _discard(self, trade: Trade):
+        order_id = self._keys.pop(id(trade), None)
+        if order_id is None:
+            return
+        bucket = self._by_order_id[order_id]
+        bucket.pop(id(trade), None)
+        if not bucket:
+            del self._by_order_id[order_id]
+
+    def reset(self):
+        self._by_order_id.clear()
+        self._keys.clear()
+
+    def sync(self, trades: Iterable[Trade]):
+        self.reset()
+        for trade in trades:
+            self.update(trade)
+
+    def get(self, order_ids: Iterable[int]) -> List[Trade]:
+        return [t for order_id in order_ids for t in self._by_order_id.get(order_id, {}).values()]
+
+    def trades(self) -> List[Trade]:
+        return [t for bucket in self._by_order_id.values() for t in bucket.values()]
+
+
+class PositionIndex:
+    """Positions by (account, conId) and by symbol, hooked to ``positionEvent``."""
+
+    def __init__(self):
+        self._by_key: Dict[Tuple[str, int], Position] = {}
+        self._by_symbol: Dict[str, Dict[Tuple[str, int], Position]] = {}
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def update(self, position: Position):
+        key = (position.account, position.contract.conId)
+        previous = self._by_key.pop(key, None)
+        if previous is not None:
+            bucket = self._by_symbol[previous.contract.symbol]
+            del bucket[key]
+            if not bucket:
+                del self._by_symbol[previous.contract.symbol]
+        if position.position:
+            self._by_key[key] = position
+            self._by_symbol.setdefault(position.contract.symbol, {})[key] = position
+
+    def reset(self):
+        self._by_key.clear()
+        self._by_symbol.clear()
+
+    def sync(self, positions: Iterable[Position]):
+        self.reset()
+        for position in positions:
+            self.update(position)
+
+    def get(self, account: str, con_id: int) -> Optional[Position]:
+        return self._by_key.get((account, con_id))
+
+    def positions(self, accounts: Optional[Iterable[str]] = None,
+                  symbols: Optional[Iterable[str]] = None) -> List[Position]:
+        if symbols is not None:
+            found = [p for s in symbols for p in self._by_symbol.get(s, {}).values()]
+        else:
+            found = list(self._by_key.values())
+        if accounts is not None:
+            accounts = set(accounts)
+            found = [p for p in found if p.account in accounts]
+        return found
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import math
+import operator
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlglot.executor.table import Table
+
+from broker_ql.pushdown import Pushdown
+from .wrapper import UNSET_DOUBLE
+
+
+def camel_case(s: str):
+    parts = s.split('_')
+    if len(parts) == 1:
+        return parts[0]
+    return parts[0] + ''.join([p.capitalize() for p in parts[1:]])
+
+
+class RowMapper:
+    """Reads the rows of a table off ib_async objects into a Table of tuples.
+
+    The attribute path of every column is worked out once from the schema, and each projection gets
+    one ``operator.attrgetter`` over all its paths, so a row is a single C call. ``UNSET_DOUBLE``
+    only needs checking in the DOUBLE columns, and only for rows where one of them holds it.
+    """
+
+    def __init__(self, columns: Dict[str, str], obj_attr: str, specials: Dict[str, str] = None,
+                 consts: Iterable[str] = ()):
+        specials = specials or {}
+        self.columns = columns
+        self.consts = set(consts)
+        self.paths = {}
+        for col in columns:
+            attr = camel_case(col)
+            if col in self.consts:
+                continue
+            if attr in specials:
+                self.paths[col] = f"{specials[attr]}.{attr}"
+            else:
+                self.paths[col] = attr if obj_attr == 'self' else f"{obj_attr}.{attr}"
+        self._compiled: Dict[Tuple[str, ...], tuple] = {}
+
+    def _compile(self, cols: Tuple[str, ...]):
+        compiled = self._compiled.get(cols)
+        if compiled is None:
+            read = [c for c in cols if c not in self.consts]
+            if not read:
+                getter = lambda obj: ()
+            elif len(read) == 1:
+                single = operator.attrgetter(self.paths[read[0]])
+                getter = lambda obj: (single(obj),)
+            else:
+                getter = operator.attrgetter(*(self.paths[c] for c in read))
+            doubles = [i for i, c in enumerate(read) if self.columns[c] == 'DOUBLE']
+            compiled = self._compiled[cols] = (read, getter, doubles)
+        return compiled
+
+    def rows(self, objects: Iterable, pushdown: Optional[Pushdown] = None,
+             consts: Optional[Dict[str, object]] = None) -> List[tuple]:
+        cols = tuple(c for c in self.columns if pushdown is None or pushdown.wants(c))
+        read, getter, doubles = self._compile(cols)
+        values = [getter(obj) for obj in objects]
+        if doubles:
+            unset = [i for i, v in enumerate(values) if any(v[j] == UNSET_DOUBLE for j in doubles)]
+            for i in unset:
+                values[i] = tuple(math.nan if j in doubles and v == UNSET_DOUBLE else v
+                                  for j, v in enumerate(values[i]))
+        if read != list(cols):
+            position = {c: i for i, c in enumerate(read)}
+            consts = consts or {}
+            values = [tuple(consts.get(c) if c in self.consts else v[position[c]] for c in cols) for v in values]
+        if pushdown is not None and (pushdown.predicates or pushdown.limit is not None):
+            index = {c: i for i, c in enumerate(cols)}
+            matched = []
+            for v in values:
+                if pushdown.limit is not None and len(matched) >= pushdown.limit:
+                    break
+                if pushdown.match(lambda c: v[index[c]]):
+                    matched.append(v)
+            values = matched
+        return values
+
+    def table(self, objects: Iterable, pushdown: Optional[Pushdown] = None,
+              consts: Optional[Dict[str, object]] = None) -> Table:
+        return Table(self.names(pushdown), self.rows(objects, pushdown, consts))
+
+    def names(self, pushdown: Optional[Pushdown] = None) -> List[str]:
+        return [c for c in self.columns if pushdown is None or pushdown.wants(c)]
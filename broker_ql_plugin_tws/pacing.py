@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, Hashable, Optional
+
+from ib_async import Contract
+
+
+class TokenBucket:
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.period / self.capacity)
+
+
+class HistoricalScheduler:
+    """Paces reqHistoricalDataAsync calls by IBKR's historical data limits.
+
+    At most ``max_inflight`` requests are outstanding at once, at most ``requests`` are started
+    per ``period`` seconds, and an identical request is not repeated within ``identical_interval``
+    seconds. It exposes the same coroutine as ``IB`` so it can stand in for it.
+    """
+
+    def __init__(self, ib, max_inflight: int = 50, requests: int = 60, period: float = 600,
+                 identical_interval: float = 15):
+        self.ib = ib
+        self.identical_interval = identical_interval
+        self.bucket = TokenBucket(requests, period)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.sent = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._last: Dict[Hashable, float] = {}
+
+    def configure(self, max_inflight: int, requests: int, period: float, identical_interval: float):
+        self.max_inflight = max_inflight
+        self._semaphore = None
+        self.bucket = TokenBucket(requests, period)
+        self.identical_interval = identical_interval
+
+    async def _wait_identical(self, key: Hashable):
+        now = time.monotonic()
+        for k in [k for k, at in self._last.items() if now - at >= self.identical_interval]:
+            del self._last[k]
+        last = self._last.get(key)
+        # the slot is taken before sleeping, so identical requests arriving together queue up behind each other
+        slot = now if last is None else max(now, last + self.identical_interval)
+        self._last[key] = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def reqHistoricalDataAsync(self, contract: Contract, endDateTime, durationStr: str, barSizeSetting: str,
+                                     whatToShow: str, useRTH: bool, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+        key = (contract.conId or contract.symbol, str(endDateTime), durationStr, barSizeSetting, whatToShow, useRTH)
+        # paced before taking an in-flight slot, which a sleeping request would hold for nothing
+        await self._wait_identical(key)
+        await self.bucket.acquire()
+        async with self._semaphore:
+            self.inflight += 1
+            self.sent += 1
+            try:
+                return await self.ib.reqHistoricalDataAsync(
+                    contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH, *args, **kwargs)
+            finally:
+                self.inflight -= 1
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import operator
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from ib_async import Ticker
+from sqlglot.executor.table import Table
+
+from broker_ql.pushdown import Pushdown
+from .wrapper import UNSET_DOUBLE
+
+_OPERATORS = {
+    '=': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class QuoteStore:
+    """Latest ticker fields kept in preallocated columns, one slot per subscribed ticker.
+
+    ``update`` is hooked to ``pendingTickersEvent`` so each tick only touches its own slot, and a
+    query only has to slice the live slots out of the arrays.
+    """
+
+    def __init__(self, fields: List[str], capacity: int = 256):
+        self.fields = fields
+        self.columns: Dict[str, np.ndarray] = {f: np.full(capacity, np.nan) for f in fields}
+        self.symbols = np.empty(capacity, dtype=object)
+        self.live = np.zeros(capacity, dtype=bool)
+        self.slots: Dict[int, int] = {}
+        self._by_symbol: Dict[str, List[int]] = {}
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self):
+        capacity = len(self.live)
+        for field, values in self.columns.items():
+            self.columns[field] = np.concatenate([values, np.full(capacity, np.nan)])
+        self.symbols = np.concatenate([self.symbols, np.empty(capacity, dtype=object)])
+        self.live = np.concatenate([self.live, np.zeros(capacity, dtype=bool)])
+        self._free = list(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _slot(self, ticker: Ticker) -> int:
+        slot = self.slots.get(id(ticker))
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._free.pop()
+            self.slots[id(ticker)] = slot
+            symbol = ticker.contract.symbol
+            self.symbols[slot] = symbol
+            self._by_symbol.setdefault(symbol, []).append(slot)
+            self.live[slot] = True
+        return slot
+
+    def update(self, tickers: Iterable[Ticker]):
+        for ticker in tickers:
+            slot = self._slot(ticker)
+            for field in self.fields:
+                value = getattr(ticker, field)
+                if value is None or value == UNSET_DOUBLE:
+                    value = np.nan
+                self.columns[field][slot] = value
+
+    def remove(self, ticker: Ticker):
+        self._release(id(ticker))
+
+    def _release(self, key: int):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        symbol = self.symbols[slot]
+        self._by_symbol[symbol].remove(slot)
+        if not self._by_symbol[symbol]:
+            del self._by_symbol[symbol]
+        self.symbols[slot] = None
+        self.live[slot] = False
+        for values in self.columns.values():
+            values[slot] = np.nan
+        self._free.append(slot)
+
+    def sync(self, tickers: List[Ticker]):
+        current = {id(t) for t in tickers}
+        for key in [key for key in self.slots if key not in current]:
+            self._release(key)
+        self.update([t for t in tickers if id(t) not in self.slots])
+
+    def snapshot(self, columns: List[str], pushdown: Optional[Pushdown] = None) -> Table:
+        mask = self.live.copy()
+        if pushdown is not None:
+            for predicate in pushdown.predicates:
+                if predicate.column == 'symbol' and predicate.op in {'=', 'in'}:
+                    allowed = np.zeros_like(mask)
+                    for symbol in (predicate.value if predicate.op == 'in' else (predicate.value,)):
+                        allowed[self._by_symbol.get(symbol, [])] = True
+                    mask &= allowed
+                elif predicate.column in self.columns and predicate.op in _OPERATORS \
+                        and isinstance(predicate.value, (int, float)) and not isinstance(predicate.value, bool):
+                    with np.errstate(invalid='ignore'):
+                        mask &= _OPERATORS[predicate.op](self.columns[predicate.column], predicate.value)
+            columns = [c for c in columns if pushdown.wants(c)]
+        slots = np.flatnonzero(mask)
+        if pushdown is not None and pushdown.limit is not None:
+            slots = slots[:pushdown.limit]
+        data = [(self.symbols if c == 'symbol' else self.columns[c])[slots].tolist() for c in columns]
+        return Table(columns, list(zip(*data)) if data else [() for _ in slots])
+
@@ -0,0 +1,234 @@
+"""Recording of the TWS event stream, and its replay without a connection.
+
+``Recorder`` hooks the ``Wrapper`` callbacks the decoder calls for ticks, orders, positions, account
+values and historical bars, plus the ``startTicker``/``startReq`` bookkeeping a reply depends on,
+and appends each call to a log. ``tcpDataArrived``/``tcpDataProcessed`` are recorded too, so a replay
+hands the plugin the same batches of tickers that TWS did.
+
+``Replayer`` calls the logged callbacks again on another ``IB`` at the recorded pace times ``speed``,
+or as fast as the loop allows with ``speed = 0``, and answers historical data and contract
+qualification requests from the log. Nothing is connected, so orders and new market data requests
+fail with the client's ``Not connected``.
+
+The log is ``MAGIC`` followed by frames of a ``FRAME`` header, (microseconds since the previous
+frame, callback code, payload length), and the arguments, packed with the callback's struct when it
+has one and pickled otherwise, with ``PICKLED`` set in the code.
+"""
+from __future__ import annotations
+
+import asyncio
+import pickle
+import struct
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ib_async import BarData, Contract
+from ib_async.util import parseIBDatetime
+
+MAGIC = b'BQLTWS1\n'
+FRAME = struct.Struct('<IBI')
+PICKLED = 0x80
+MARK = 0x7f
+
+# numeric hot paths get a struct, None is pickled
+CALLBACKS: Dict[str, Optional[struct.Struct]] = {
+    'tcpDataArrived': struct.Struct('<'),
+    'tcpDataProcessed': struct.Struct('<'),
+    'priceSizeTick': struct.Struct('<iidd'),
+    'tickSize': struct.Struct('<iid'),
+    'tickGeneric': struct.Struct('<iid'),
+    'tickString': None,
+    'tickByTickAllLast': None,
+    'tickByTickBidAsk': None,
+    'tickByTickMidPoint': None,
+    'openOrder': None,
+    'openOrderEnd': struct.Struct('<'),
+    'orderStatus': None,
+    'completedOrder': None,
+    'execDetails': None,
+    'commissionReport': None,
+    'position': None,
+    'positionEnd': struct.Struct('<'),
+    'updatePortfolio': None,
+    'updateAccountValue': None,
+    'accountSummary': None,
+    'accountSummaryEnd': None,
+    'managedAccounts': None,
+    'historicalData': None,
+    'historicalDataEnd': None,
+    'error': None,
+    'startTicker': None,
+    'startReq': None,
+}
+_NAMES = list(CALLBACKS)
+_CODES = {name: code for code, name in enumerate(_NAMES)}
+# the client keeps its own references to these two
+_CLIENT_HOOKS = {'tcpDataArrived': '_tcpDataArrived', 'tcpDataProcessed': '_tcpDataProcessed'}
+
+
+def _encode(code: int, args: tuple) -> Tuple[int, bytes]:
+    codec = CALLBACKS[_NAMES[code]]
+    if codec is not None:
+        try:
+            return code, codec.pack(*args)
+        except struct.error:
+            pass
+    return code | PICKLED, pickle.dumps(args, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(code: int, payload: bytes) -> tuple:
+    if code & PICKLED:
+        return pickle.loads(payload)
+    return CALLBACKS[_NAMES[code]].unpack(payload)
+
+
+def frames(path: str) -> Iterator[Tuple[float, str, tuple]]:
+    """``(seconds since the first frame, callback or mark name, arguments)`` of every frame in a log."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a TWS recording")
+        elapsed = 0.0
+        while True:
+            header = f.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            delta, code, length = FRAME.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                # cut short by a crash while recording
+                return
+            elapsed += delta / 1e6
+            if code == MARK:
+                yield elapsed, payload.decode(), ()
+            else:
+                yield elapsed, _NAMES[code & ~PICKLED], _decode(code, payload)
+
+
+class Recorder:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.frames = 0
+        self._file = None
+        self._last = None
+        self._ib = None
+
+    def install(self, ib) -> Recorder:
+        self._file = open(self.path, 'wb', buffering=1 << 16)
+        self._file.write(MAGIC)
+        self._last = time.monotonic()
+        self._ib = ib
+        for name, code in _CODES.items():
+            original = getattr(ib.wrapper, name)
+            setattr(ib.wrapper, name, self._hook(code, original))
+        for name, attribute in _CLIENT_HOOKS.items():
+            setattr(ib.client, attribute, getattr(ib.wrapper, name))
+        return self
+
+    def _hook(self, code: int, original: Callable) -> Callable:
+        name = _NAMES[code]
+
+        def hook(*args, **kwargs):
+            # a startReq container is the caller's, on replay the reply fills a plain list
+            self._write(*_encode(code, args[:2] if name == 'startReq' else args))
+            return original(*args, **kwargs)
+
+        return hook
+
+    def mark(self, name: str):
+        """Log a point of the session a replay can act on, like ``connected``."""
+        self._write(MARK, name.encode())
+
+    def _write(self, code: int, payload: bytes):
+        now = time.monotonic()
+        delta = min(int((now - self._last) * 1e6), 0xffffffff)
+        self._last = now
+        self._file.write(FRAME.pack(delta, code, len(payload)))
+        self._file.write(payload)
+        self.frames += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        for name in _CODES:
+            self._ib.wrapper.__dict__.pop(name, None)
+        for name, attribute in _CLIENT_HOOKS.items():
+            setattr(self._ib.client, attribute, getattr(self._ib.wrapper, name))
+        self._file.close()
+        self._file = None
+
+
+class Replayer:
+
+    def __init__(self, path: str, speed: float = 1.0, marks: Optional[Dict[str, Callable[[], None]]] = None):
+        self.path = path
+        self.speed = speed
+        self.marks = marks or {}
+        self.frames = 0
+        # seconds the last batch was replayed behind its schedule, how far the loop falls behind the stream
+        self.lag = 0.0
+        self.bars: Dict[object, List[BarData]] = {}
+        self.contracts: Dict[str, Contract] = {}
+        self._ib = None
+
+    def install(self, ib) -> Replayer:
+        """Answer ``ib``'s historical data and qualify requests from the log instead of TWS."""
+        self._ib = ib
+        self._scan()
+        ib.reqHistoricalDataAsync = self.req_historical_data
+        ib.qualifyContractsAsync = self.qualify_contracts
+        return self
+
+    def _scan(self):
+        requests, pending = {}, {}
+        for _, name, args in frames(self.path):
+            if name in ('startTicker', 'startReq') and len(args) > 1 and isinstance(args[1], Contract):
+                requests[args[0]] = args[1]
+                self._known(args[1])
+            elif name in ('openOrder', 'position', 'updatePortfolio'):
+                self._known(args[1] if name != 'updatePortfolio' else args[0])
+            elif name == 'historicalData' and args[0] in requests:
+                bar = args[1]
+                pending.setdefault(args[0], []).append(
+                    BarData(date=parseIBDatetime(bar.date), open=bar.open, high=bar.high, low=bar.low,
+                            close=bar.close, volume=bar.volume, average=bar.average, barCount=bar.barCount))
+            elif name == 'historicalDataEnd' and args[0] in requests:
+                self.bars[_contract_key(requests[args[0]])] = pending.pop(args[0], [])
+
+    def _known(self, contract):
+        if isinstance(contract, Contract) and contract.conId and contract.symbol:
+            self.contracts.setdefault(contract.symbol, contract)
+
+    async def req_historical_data(self, contract: Contract, *args, **kwargs) -> List[BarData]:
+        await asyncio.sleep(0)
+        return list(self.bars.get(_contract_key(contract), ()))
+
+    async def qualify_contracts(self, *contracts: Contract) -> List[Contract]:
+        await asyncio.sleep(0)
+        qualified = []
+        for contract in contracts:
+            known = self.contracts.get(contract.symbol)
+            if known is not None:
+                contract.conId = known.conId
+                qualified.append(contract)
+        return qualified
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        wrapper = self._ib.wrapper
+        started = loop.time()
+        for elapsed, name, args in frames(self.path):
+            if name == 'tcpDataArrived':
+                # one batch per loop iteration, like data arriving from the socket
+                delay = started + elapsed / self.speed - loop.time() if self.speed > 0 else 0.0
+                self.lag = max(0.0, -delay)
+                await asyncio.sleep(max(0.0, delay))
+            if name in _CODES:
+                getattr(wrapper, name)(*args)
+            elif name in self.marks:
+                self.marks[name]()
+            self.frames += 1
+
+
+def _contract_key(contract: Contract):
+    return contract.conId or (contract.symbol, contract.secType, contract.currency)
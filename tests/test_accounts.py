@@ -0,0 +1,46 @@
+import asyncio
+
+from ib_async import AccountValue
+
+from broker_ql.pushdown import Predicate, Pushdown
+from broker_ql_plugin_tws.accounts import AccountStore
+
+COLUMNS = {'account': 'VARCHAR', 'net_liquidation': 'DOUBLE', 'total_cash_value': 'DOUBLE'}
+
+
+class FakeWrapper:
+    acctSummary = {}
+
+
+class FakeIB:
+    def __init__(self, store):
+        self.store = store
+        self.wrapper = FakeWrapper()
+        self.requests = 0
+
+    async def reqAccountSummaryAsync(self):
+        self.requests += 1
+        await asyncio.sleep(0)
+        for account, value in (('U1', '100.5'), ('U2', '200')):
+            self.store.update(AccountValue(account, 'NetLiquidation', value, 'USD', ''))
+        self.store.update(AccountValue('U1', 'NetLiquidation', '1', 'EUR', ''))
+
+
+def test_account_store_loads_once_and_follows_events():
+    store = AccountStore(COLUMNS)
+    ib = FakeIB(store)
+
+    async def run():
+        await asyncio.gather(store.load(ib), store.load(ib))
+        await store.load(ib)
+
+    asyncio.run(run())
+    assert ib.requests == 1
+    store.update(AccountValue('U2', 'TotalCashValue', '50', 'USD', ''))
+    assert store.snapshot(['U1', 'U2', 'U3']) == [
+        {'account': 'U1', 'net_liquidation': 100.5, 'total_cash_value': None},
+        {'account': 'U2', 'net_liquidation': 200.0, 'total_cash_value': 50.0},
+        {'account': 'U3', 'net_liquidation': None, 'total_cash_value': None},
+    ]
+    pushdown = Pushdown(None, [Predicate('account', '=', 'U2')], None)
+    assert [r['account'] for r in store.snapshot(['U1', 'U2'], pushdown)] == ['U2']
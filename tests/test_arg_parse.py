@@ -1,3 +1,4 @@
+import subprocess
 import sys
 from unittest import mock
 
@@ -23,3 +24,15 @@ def test_arg_parse():
     assert config is not None
     assert config['plugin_tws'].getint('clientId') == 256
     assert config.defaults()['port'] != '3306'
+
+
+def test_arg_parse_skips_heavy_imports(tmp_path):
+    # plugin arguments are read without loading the plugin, its ib_async or the server
+    code = "\n".join([
+        "import sys",
+        "from broker_ql.entrypoints.main import parse_args_config",
+        f"parse_args_config(['--cnf', {str(tmp_path / 'broker_ql.conf')!r}, '--plugins=tws'])",
+        "print(sorted(m for m in ('ib_async', 'numpy', 'mysql_mimic', 'sqlglot') if m in sys.modules))",
+    ])
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
@@ -0,0 +1,59 @@
+import asyncio
+import datetime
+
+from ib_async import BarData, Contract
+
+from broker_ql_plugin_tws.bars import BarCache
+
+
+class FakeIB:
+    def __init__(self, bars):
+        self.bars = bars
+        self.requests = []
+
+    async def reqHistoricalDataAsync(self, contract, end, duration, bar_size, what_to_show, use_rth, **kwargs):
+        self.requests.append(duration)
+        return list(self.bars)
+
+
+def _bar(day, close):
+    return BarData(date=datetime.date.today() - datetime.timedelta(days=day), close=close)
+
+
+def test_bar_cache_ttl_and_incremental_merge():
+    ib = FakeIB([_bar(3, 1.0), _bar(2, 2.0), _bar(1, 3.0)])
+    cache = BarCache(ttl=60)
+    contract = Contract(conId=1, symbol='AAPL')
+
+    async def run():
+        first = await cache.get(ib, contract, '50 D', '1 day', 'TRADES')
+        assert await cache.get(ib, contract, '50 D', '1 day', 'TRADES') is first
+        assert ib.requests == ['50 D']
+
+        cache.ttl = 0
+        ib.bars = [_bar(1, 3.5), _bar(0, 4.0)]
+        bars = await cache.get(ib, contract, '50 D', '1 day', 'TRADES')
+        assert ib.requests == ['50 D', '2 D']
+        assert [b.close for b in bars] == [2.0, 3.5, 4.0]
+
+        # today's daily bar is still forming, it's asked for again with a duration IB accepts for days
+        ib.bars = [_bar(0, 4.5)]
+        bars = await cache.get(ib, contract, '50 D', '1 day', 'TRADES')
+        assert ib.requests == ['50 D', '2 D', '1 D']
+        assert [b.close for b in bars] == [2.0, 3.5, 4.5]
+
+    asyncio.run(run())
+
+
+def test_bar_cache_evicts_least_recently_used():
+    ib = FakeIB([_bar(1, 1.0)])
+    cache = BarCache(size=2)
+
+    async def run():
+        for con_id in (1, 2, 1, 3):
+            await cache.get(ib, Contract(conId=con_id), '50 D', '1 day', 'TRADES')
+        assert len(cache) == 2
+        await cache.get(ib, Contract(conId=1), '50 D', '1 day', 'TRADES')
+        assert len(ib.requests) == 3
+
+    asyncio.run(run())
@@ -0,0 +1,130 @@
+import asyncio
+import configparser
+import os
+from io import UnsupportedOperation
+
+import pytest
+from mysql_mimic.errors import MysqlError
+from sqlglot.executor.table import Table
+
+from broker_ql.cluster import Gateway, GatewayClient, RemoteDatabase, SharedTable, HEADER
+from broker_ql.session import Session
+from broker_ql.views import VIEWS
+
+
+def test_shared_table_round_trip():
+    writer = SharedTable(f"bqltest{os.getpid()}", 4096, create=True)
+    reader = SharedTable(writer.name)
+    try:
+        assert reader.read() == (0, None)
+        writer.publish(Table(['symbol', 'last'], [('AAPL', 100.0), ('MSFT', 200.0)]))
+        version, table = reader.read()
+        assert version == 2 and table.columns == ('symbol', 'last') and table.rows == [('AAPL', 100.0), ('MSFT', 200.0)]
+        # the same version is decoded once, each read gets its own Table over its rows
+        again = reader.read()[1]
+        assert again is not table and again.rows is table.rows
+
+        writer.publish(Table(['symbol'], [(f'S{i:04d}' * 20,) for i in range(100)]))
+        assert reader.read() == (4, None)
+        writer.publish(None)
+        assert reader.read() == (6, None)
+
+        # a reader meeting a write in progress retries
+        HEADER.pack_into(writer.memory.buf, 0, 7, 0, 0)
+        assert reader.read() == (None, None)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_gateway_serves_workers(monkeypatch):
+    quotes = [{'symbol': 'AAPL', 'last': 100.0}]
+    added = []
+    selects = []
+
+    def provider(table_name, where):
+        if where is not None:
+            selects.append(table_name)
+        if table_name == 'quotes':
+            return list(quotes)
+        if table_name == 'bars':
+            return [{'symbol': row['symbol'], 'close': 1.0} for row in where or [{'symbol': 'ALL'}]]
+        return None
+
+    async def creator(session, table_name, fields, rows):
+        if table_name != 'quotes':
+            raise UnsupportedOperation()
+        quotes.extend(dict(zip(fields, row)) for row in rows)
+        session.warnings.append(('Note', 1000, 'added'))
+        if session.in_trx:
+            session.trx_commits.append(lambda: added.append('commit'))
+            session.trx_rollbacks.append(lambda: added.append('rollback'))
+        changed()
+        return len(rows)
+
+    monkeypatch.setattr(VIEWS, 'tracked', set())
+    monkeypatch.setattr(VIEWS, 'listeners', list(VIEWS.listeners))
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {
+        'fake': {'quotes': {'symbol': 'VARCHAR', 'last': 'DOUBLE'}, 'bars': {'symbol': 'VARCHAR', 'close': 'DOUBLE'}},
+    }])
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'fake', provider)
+    monkeypatch.setitem(Session.DATA_CREATORS, 'fake', creator)
+    changed = VIEWS.track('fake', 'quotes')
+
+    config = configparser.ConfigParser(default_section='server')
+    config.read_dict({'server': {'port': '0', 'plugins': '', 'workers': '0', 'publish_interval': '0.01'}})
+
+    async def run():
+        gateway = Gateway(config)
+        await gateway.start()
+        client = GatewayClient(gateway.address)
+        try:
+            await client.connect()
+            description = await client.call('describe')
+            assert description['tables'] == {('fake', 'quotes'): gateway.tables[('fake', 'quotes')].name}
+            tables = {'quotes': SharedTable(description['tables'][('fake', 'quotes')])}
+            database = RemoteDatabase(client, 'fake', tables)
+            await asyncio.sleep(0.05)
+            assert tables['quotes'].read()[0] > 0
+            assert (await database.select('quotes')).rows == [('AAPL', 100.0)]
+            assert (await database.select('bars', [{'symbol': 'AAPL'}])).rows == [('AAPL', 1.0)]
+            assert await database.select('missing') is None
+
+            # a worker's session, the gateway in this process keeps the real provider
+            class WorkerSession(Session):
+                DATA_PROVIDERS = {'fake': database.select}
+                DATA_CREATORS = {'fake': database.insert}
+
+            session = WorkerSession()
+            result = await session.handle_query("insert into fake.quotes (symbol, last) values ('MSFT', 200)", {})
+            assert result.affected_rows == 1 and session.warnings == [('Note', 1000, 'added')]
+            # published before the insert was answered
+            assert (await session.handle_query("select symbol from fake.quotes order by symbol", {}))[0] == [
+                ('AAPL',), ('MSFT',)]
+            # a filtered select still reads the shared table, without calling the gateway
+            selects.clear()
+            assert (await session.handle_query("select last from fake.quotes where symbol = 'MSFT'", {}))[0] == [
+                (200.0,)]
+            assert selects == []
+
+            await session.handle_query("begin", {})
+            await session.handle_query("insert into fake.quotes (symbol, last) values ('IBM', 150)", {})
+            await session.handle_query("insert into fake.quotes (symbol, last) values ('TSLA', 250)", {})
+            assert len(session.trx_commits) == 1
+            await session.handle_query("commit", {})
+            await asyncio.sleep(0.05)
+            assert added == ['commit', 'commit'] and not gateway._sessions
+
+            with pytest.raises(MysqlError, match="Unsupported insert on fake.bars"):
+                await session.handle_query("insert into fake.bars (symbol, close) values ('MSFT', 1)", {})
+        finally:
+            client.close()
+            for table in tables.values():
+                table.close()
+            gateway.close()
+        await client.closed
+        with pytest.raises(MysqlError, match="Gateway is not available"):
+            await database.select('bars', [{'symbol': 'AAPL'}])
+
+    asyncio.run(run())
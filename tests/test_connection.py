@@ -0,0 +1,15 @@
+from datetime import date, datetime
+
+from mysql_mimic import packets
+from mysql_mimic.results import ResultColumn, infer_type
+
+from broker_ql.connection import _text_row_encoder
+
+
+def test_text_row_encoder_matches_mysql_mimic():
+    rows = [('AAPL', 1, 1.5, True, date(2024, 1, 2), datetime(2024, 1, 2, 3, 4, 5), b'\x00'),
+            (None, -2, None, False, None, None, None)]
+    columns = [ResultColumn(name=f'c{i}', type=infer_type(v)) for i, v in enumerate(rows[0])]
+    encode = _text_row_encoder(columns)
+    for row in rows:
+        assert encode(row) == packets.make_text_resultset_row(row, columns)
@@ -0,0 +1,42 @@
+import asyncio
+
+from ib_async import Contract
+
+from broker_ql_plugin_tws.contracts import ContractResolver
+
+
+class FakeIB:
+    def __init__(self):
+        self.batches = []
+
+    async def qualifyContractsAsync(self, *contracts):
+        self.batches.append([c.symbol for c in contracts])
+        qualified = []
+        for contract in contracts:
+            if contract.symbol != 'NOPE':
+                contract.conId = 1000 + len(contract.symbol)
+                qualified.append(contract)
+        return qualified
+
+
+def _stock(symbol):
+    return Contract(symbol=symbol, secType='STK', exchange='SMART', currency='USD')
+
+
+def test_resolver_batches_memoizes_and_persists(tmp_path):
+    ib = FakeIB()
+    path = str(tmp_path / 'contracts.db')
+    resolver = ContractResolver(path=path)
+    result = asyncio.run(resolver.resolve(ib, [_stock('AAPL'), _stock('NOPE'), _stock('MSFT'), _stock('AAPL')]))
+    assert [c and c.conId for c in result] == [1004, None, 1004, 1004]
+    assert ib.batches == [['AAPL', 'NOPE', 'MSFT']]
+
+    asyncio.run(resolver.resolve(ib, [_stock('AAPL'), _stock('NOPE')]))
+    assert ib.batches[1:] == [['NOPE']]
+    resolver.close()
+
+    restarted = ContractResolver(path=path)
+    result = asyncio.run(restarted.resolve(ib, [_stock('MSFT')]))
+    assert result[0].conId == 1004 and result[0].symbol == 'MSFT'
+    assert len(ib.batches) == 2
+    restarted.close()
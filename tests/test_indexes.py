@@ -0,0 +1,57 @@
+from ib_async import Contract, Order, OrderStatus, Position, Ticker, Trade
+
+from broker_ql_plugin_tws.indexes import PositionIndex, TickerIndex, TradeIndex
+
+
+def _trade(order_id, status='Submitted'):
+    return Trade(Contract(symbol='AAPL'), Order(orderId=order_id), OrderStatus(orderId=order_id, status=status))
+
+
+def test_trade_index_follows_order_events():
+    index = TradeIndex()
+    first, second, manual = _trade(1), _trade(2), _trade(0)
+    for trade in (first, second, manual, _trade(0)):
+        index.update(trade)
+    assert index.get([1, 3]) == [first]
+    assert len(index.get([0])) == 2
+
+    second.orderStatus.status = 'Filled'
+    index.update(second)
+    assert index.get([2]) == [] and len(index) == 3
+
+    manual.order.orderId = -5
+    index.update(manual)
+    assert index.get([-5]) == [manual] and len(index.get([0])) == 1
+
+    index.sync([first])
+    assert index.trades() == [first]
+
+
+def test_ticker_and_position_indexes():
+    tickers = TickerIndex()
+    aapl = Ticker(contract=Contract(symbol='AAPL', secType='STK', currency='USD'))
+    eur = Ticker(contract=Contract(symbol='EUR', secType='CASH', currency='USD'))
+    tickers.sync([aapl, eur])
+    assert tickers.find('AAPL', 'STK', 'USD') is aapl and tickers.find('AAPL', 'STK', 'EUR') is None
+    assert tickers.contract('EUR') is eur.contract
+    tickers.remove(aapl)
+    assert tickers.contract('AAPL') is None and len(tickers) == 1
+
+    # two strikes of one underlying share a key, both stay counted and found
+    calls = [Ticker(contract=Contract(symbol='SPY', secType='OPT', currency='USD', strike=k)) for k in (400, 410)]
+    for ticker in calls:
+        tickers.add(ticker)
+    assert len(tickers) == 3 and tickers.tickers() == [eur] + calls
+    tickers.remove(calls[0])
+    assert tickers.find('SPY', 'OPT', 'USD') is calls[1] and tickers.contract('SPY') is calls[1].contract
+    tickers.remove(calls[1])
+    assert tickers.find('SPY', 'OPT', 'USD') is None and len(tickers) == 1
+
+    positions = PositionIndex()
+    a = Position('U1', Contract(conId=1, symbol='AAPL'), 10, 150.0)
+    b = Position('U2', Contract(conId=1, symbol='AAPL'), 5, 151.0)
+    positions.sync([a, b, Position('U1', Contract(conId=2, symbol='MSFT'), 3, 300.0)])
+    assert positions.positions(symbols=['AAPL']) == [a, b]
+    assert positions.positions(accounts=['U2']) == [b]
+    positions.update(Position('U1', Contract(conId=1, symbol='AAPL'), 0, 0.0))
+    assert positions.get('U1', 1) is None and positions.positions(symbols=['AAPL']) == [b]
@@ -0,0 +1,36 @@
+import math
+
+from ib_async import BarData, Contract, Order, OrderStatus, Trade
+
+from broker_ql.pushdown import Predicate, Pushdown
+from broker_ql_plugin_tws.mappers import RowMapper
+from broker_ql_plugin_tws.wrapper import UNSET_DOUBLE
+
+COLUMNS = {'order_id': 'INT', 'symbol': 'VARCHAR', 'lmt_price': 'DOUBLE', 'status': 'VARCHAR', 'why_held': 'VARCHAR'}
+
+
+def _trade(order_id, symbol, price):
+    return Trade(Contract(symbol=symbol), Order(orderId=order_id, lmtPrice=price),
+                 OrderStatus(orderId=order_id, status='Submitted', whyHeld='locate'))
+
+
+def test_row_mapper_reads_paths_into_tuples():
+    mapper = RowMapper(COLUMNS, 'order', {'symbol': 'contract', 'status': 'orderStatus', 'whyHeld': 'orderStatus'})
+    trades = [_trade(1, 'AAPL', 10.5), _trade(2, 'MSFT', UNSET_DOUBLE), _trade(3, 'AAPL', 11.0)]
+    table = mapper.table(trades)
+    assert table.columns == tuple(COLUMNS)
+    assert table.rows[0] == (1, 'AAPL', 10.5, 'Submitted', 'locate')
+    assert math.isnan(table.rows[1][2]) and table.rows[1][:2] == (2, 'MSFT')
+
+    pushdown = Pushdown(columns={'order_id'}, predicates=[Predicate('symbol', '=', 'AAPL')], limit=1)
+    assert mapper.names(pushdown) == ['order_id', 'symbol']
+    assert mapper.rows(trades, pushdown) == [(1, 'AAPL')]
+    prices = mapper.rows(trades, Pushdown(columns={'lmt_price'}))
+    assert prices[0] == (10.5,) and math.isnan(prices[1][0]) and prices[2] == (11.0,)
+
+
+def test_row_mapper_fills_constant_columns():
+    mapper = RowMapper({'date': 'TIMESTAMP', 'symbol': 'VARCHAR', 'close': 'DOUBLE'}, 'self', consts=['symbol'])
+    bars = [BarData(date='2024-01-02', close=1.5), BarData(date='2024-01-03', close=2.5)]
+    assert mapper.rows(bars, consts={'symbol': 'AAPL'}) == [('2024-01-02', 'AAPL', 1.5), ('2024-01-03', 'AAPL', 2.5)]
+    assert mapper.rows(bars, Pushdown(columns={'symbol'}), {'symbol': 'AAPL'}) == [('AAPL',), ('AAPL',)]
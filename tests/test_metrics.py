@@ -0,0 +1,48 @@
+import asyncio
+
+from broker_ql import metrics
+from broker_ql.session import Session
+
+
+def test_histogram_and_render():
+    latency = metrics.Histogram('test_latency_seconds', 'Test latency', ('db',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, db='tws')
+    assert latency.quantile(0.5, db='tws') == 0.1 and latency.quantile(0.99, db='tws') == float('inf')
+    assert latency.quantile(0.5, db='other') is None
+    assert latency.samples() == [
+        ('test_latency_seconds_bucket', {'db': 'tws', 'le': '0.1'}, 2.0),
+        ('test_latency_seconds_bucket', {'db': 'tws', 'le': '1'}, 3.0),
+        ('test_latency_seconds_bucket', {'db': 'tws', 'le': '+Inf'}, 4.0),
+        ('test_latency_seconds_count', {'db': 'tws'}, 4.0),
+        ('test_latency_seconds_sum', {'db': 'tws'}, 3.65),
+    ]
+
+    requests = metrics.counter('test_requests_total', 'Test requests', ('kind',), function=lambda: {('a"b',): 2})
+    assert metrics.counter('test_requests_total', 'ignored') is requests
+    text = metrics.render()
+    assert '# TYPE test_requests_total counter\ntest_requests_total{kind="a\\"b"} 2\n' in text
+    del metrics.REGISTRY['test_requests_total']
+
+
+def test_show_stats_and_http_endpoint():
+    async def run():
+        session = Session()
+        rows, columns = await session.handle_query("select 1", {})
+        rows, columns = await session.handle_query("SHOW BROKERQL STATS", {})
+        assert columns == ['Name', 'Labels', 'Value']
+        names = {name for name, _, _ in rows}
+        assert {'broker_ql_parse_seconds_count', 'broker_ql_parse_seconds_p99', 'broker_ql_rows_total'} <= names
+
+        server = await metrics.serve('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response.decode()
+
+    response = asyncio.run(run())
+    assert response.startswith('HTTP/1.1 200 OK') and '# TYPE broker_ql_parse_seconds histogram' in response
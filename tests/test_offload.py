@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+import threading
+
+from sqlglot import parse_one
+from sqlglot.executor.env import ENV
+from sqlglot.executor.table import Table
+
+import broker_ql.connection  # noqa: F401 registers SLEEP
+from broker_ql.executor import OFFLOAD, Offload
+from broker_ql.session import Session
+
+
+def test_thread_offload_runs_off_the_loop():
+    offload = Offload('thread', 1)
+    try:
+        assert asyncio.run(offload.run(threading.get_ident)) != threading.get_ident()
+    finally:
+        offload.shutdown()
+
+
+def test_static_sleep_yields_to_the_loop():
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        rows, _ = await Session().handle_query("select sleep(0.2)", {})
+        ticker.cancel()
+        return rows, ticks
+
+    rows, ticks = asyncio.run(main())
+    assert rows == [(0.2,)]
+    assert ticks >= 10
+
+
+def test_concurrent_executions_over_one_table():
+    offload = Offload('thread', 4)
+    quotes = Table(['symbol', 'bid'], [(f"S{i:04d}", float(i)) for i in range(5000)])
+    expression = parse_one("select symbol, bid from tws.quotes where bid >= 0")
+    schema = {'tws': {'quotes': {'symbol': 'VARCHAR', 'bid': 'DOUBLE'}}}
+
+    async def main():
+        return await asyncio.gather(*(offload.execute(expression, schema, {'tws': {'quotes': quotes}}) for _ in range(8)))
+
+    # switch threads often enough for executions to interleave row by row
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for result in asyncio.run(main()):
+            assert all(symbol == f"S{int(bid):04d}" for symbol, bid in result.rows)
+    finally:
+        sys.setswitchinterval(interval)
+        offload.shutdown()
+
+
+def test_static_select_calls_plugin_functions_in_this_process(monkeypatch):
+    monkeypatch.setitem(ENV, 'TEST_PID', os.getpid)
+    OFFLOAD.shutdown()
+    monkeypatch.setattr(OFFLOAD, 'mode', 'process')
+
+    async def main():
+        return await Session().handle_query("select test_pid()", {})
+
+    try:
+        assert asyncio.run(main())[0] == [(os.getpid(),)]
+        assert OFFLOAD._pool is None
+    finally:
+        OFFLOAD.shutdown()
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from ib_async import Contract, Order
+from mysql_mimic.errors import ErrorCode
+
+from broker_ql.session import Session
+from broker_ql_plugin_tws import data
+
+
+def test_orders_are_pipelined_under_one_deadline(monkeypatch):
+    def place_order(contract, order):
+        loop = asyncio.get_running_loop()
+        trade = SimpleNamespace(order=order)
+        if contract.symbol == 'BAD':
+            loop.call_later(0.05, data._on_error, order.orderId, 201, 'rejected', contract)
+        elif contract.symbol != 'SLOW':
+            loop.call_later(0.05, data._on_order_open, trade)
+        return trade
+
+    monkeypatch.setattr(data.ib, 'placeOrder', place_order)
+    symbols = ['AAPL'] * 20 + ['BAD', 'SLOW']
+    placements = [(Contract(symbol=s), Order(orderId=i + 1), True) for i, s in enumerate(symbols)]
+
+    started = time.monotonic()
+    outcomes = asyncio.run(data.place_orders(placements, timeout=0.3))
+    assert time.monotonic() - started < 0.6
+    assert [o.acknowledged for o in outcomes] == [True] * 20 + [False, False]
+    assert outcomes[20].error == 'rejected' and outcomes[21].error is None
+
+    session = SimpleNamespace(warnings=[])
+    assert data._report(session, outcomes) == 21
+    assert session.warnings == [('Error', data.ErrorCode.UNKNOWN_ERROR, 'order 21: rejected')]
+    assert not data._FUTURES
+
+
+def test_warnings_last_one_statement(monkeypatch):
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {'demo': {'orders': {'symbol': 'VARCHAR'}}}])
+
+    def creator(session, table_name, fields, rows):
+        session.warnings.append(('Error', ErrorCode.UNKNOWN_ERROR, 'order 1: rejected'))
+        return 0
+
+    monkeypatch.setitem(Session.DATA_CREATORS, 'demo', creator)
+
+    async def run():
+        session = Session()
+        await session.handle_query("insert into demo.orders (symbol) values ('BAD')", {})
+        assert (await session.handle_query("show warnings", {}))[0] == [('Error', 1105, 'order 1: rejected')]
+        assert len(session.warnings) == 1
+        await session.handle_query("set @@broker_ql_result_cache = 0", {})
+        assert session.warnings == []
+        await session.handle_query("insert into demo.orders (symbol) values ('BAD')", {})
+        await session.handle_query("select 1", {})
+        assert (await session.handle_query("show warnings", {}))[0] == []
+
+    asyncio.run(run())
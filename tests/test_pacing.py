@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from ib_async import Contract
+
+from broker_ql_plugin_tws.pacing import HistoricalScheduler, TokenBucket
+
+
+class FakeIB:
+    def __init__(self):
+        self.inflight = 0
+        self.peak = 0
+
+    async def reqHistoricalDataAsync(self, contract, *args, **kwargs):
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        await asyncio.sleep(0.01)
+        self.inflight -= 1
+        return [contract.conId]
+
+
+def test_scheduler_caps_inflight_requests():
+    ib = FakeIB()
+    scheduler = HistoricalScheduler(ib, max_inflight=3)
+
+    async def run():
+        return await asyncio.gather(*[
+            scheduler.reqHistoricalDataAsync(Contract(conId=i), '', '50 D', '1 day', 'TRADES', True)
+            for i in range(10)
+        ])
+
+    assert asyncio.run(run()) == [[i] for i in range(10)]
+    assert ib.peak == 3
+    assert scheduler.inflight == 0
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(2, 0.1)
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.04
+
+
+def test_scheduler_spaces_identical_requests():
+    scheduler = HistoricalScheduler(FakeIB(), identical_interval=0.05)
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(2):
+            await scheduler.reqHistoricalDataAsync(Contract(conId=1), '', '50 D', '1 day', 'TRADES', True)
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.05
+
+
+def test_scheduler_spaces_identical_requests_arriving_together():
+    sent = []
+
+    class RecordingIB(FakeIB):
+        async def reqHistoricalDataAsync(self, contract, *args, **kwargs):
+            sent.append((contract.conId, time.monotonic()))
+            return await super().reqHistoricalDataAsync(contract, *args, **kwargs)
+
+    scheduler = HistoricalScheduler(RecordingIB(), max_inflight=1, identical_interval=0.1)
+
+    async def run():
+        await asyncio.gather(*[
+            scheduler.reqHistoricalDataAsync(Contract(conId=con_id), '', '50 D', '1 day', 'TRADES', True)
+            for con_id in (1, 1, 1, 2)
+        ])
+
+    asyncio.run(run())
+    identical = [at for con_id, at in sent if con_id == 1]
+    assert all(b - a >= 0.09 for a, b in zip(identical, identical[1:]))
+    # the other contract isn't stuck behind the identical ones waiting for their slot
+    assert [con_id for con_id, _ in sent][:2] == [1, 2]
@@ -0,0 +1,44 @@
+from sqlglot.dialects.mysql import MySQL
+
+import broker_ql.connection  # noqa: F401 installs the optimizer rules
+from broker_ql.plan_cache import PlanCache
+
+SCHEMA = {'tws': {'quotes': {'symbol': 'VARCHAR', 'bid': 'DOUBLE'}}}
+
+
+def test_statements_are_cached_and_copied():
+    cache = PlanCache()
+    parse = MySQL().parse
+    first = cache.statements("select bid from tws.quotes ", parse)
+    second = cache.statements("select bid from tws.quotes;", parse)
+    assert cache.stats['statement_hits'] == 1
+    assert first[0] == second[0] and first[0] is not second[0]
+
+
+def test_plans_are_invalidated_with_schema_version():
+    cache = PlanCache(size=1)
+    expression = MySQL().parse("select bid from tws.quotes where symbol = 'AAPL'")[0]
+    plan = cache.plan(expression, SCHEMA)
+    assert cache.plan(expression, SCHEMA) is plan
+    cache.invalidate()
+    assert cache.plan(expression, SCHEMA) is not plan
+    cache.plan(MySQL().parse("select symbol from tws.quotes")[0], SCHEMA)
+    assert len(cache._plans) == 1
+    assert cache.stats == {'statement_hits': 0, 'statement_misses': 0, 'plan_hits': 1, 'plan_misses': 3}
+
+
+def test_bound_parameters_share_one_plan():
+    from sqlglot.executor.python import PythonExecutor
+    from sqlglot.executor.table import Table, ensure_tables
+
+    from broker_ql.connection import _bind
+
+    cache = PlanCache()
+    template = MySQL().parse("select bid from tws.quotes where symbol = :0 limit :1")[0]
+    tables = ensure_tables({'tws': {'quotes': Table(['symbol', 'bid'], [('AAPL', 1.0), ('MSFT', 2.0), ('MSFT', 3.0)])}})
+    results = []
+    for symbol in ('AAPL', 'MSFT'):
+        plan = cache.plan(_bind(template, [symbol, 5]), SCHEMA)
+        results.append(PythonExecutor(tables=tables).execute(plan).rows)
+    assert results == [[(1.0,)], [(2.0,), (3.0,)]]
+    assert cache.stats['plan_misses'] == 1 and cache.stats['plan_hits'] == 1
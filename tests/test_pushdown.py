@@ -0,0 +1,72 @@
+import asyncio
+
+from sqlglot import expressions as exp
+from sqlglot.dialects.mysql import MySQL
+
+from broker_ql.pushdown import extract_pushdown, Predicate
+from broker_ql.session import Session
+
+
+def _pushdown(sql, index=0):
+    expression = MySQL().parse(sql)[0]
+    table = list(expression.find_all(exp.Table))[index]
+    return extract_pushdown(expression, table)
+
+
+def test_pushdown_point_lookup():
+    pushdown = _pushdown("select bid from tws.quotes where symbol = 'AAPL'")
+    assert pushdown.columns == {'bid', 'symbol'}
+    assert pushdown.predicates == [Predicate('symbol', '=', 'AAPL')]
+    assert pushdown.values('symbol') == {'AAPL'}
+    assert pushdown.limit is None
+
+
+def test_pushdown_ranges_and_limit():
+    pushdown = _pushdown("select * from tws.quotes where bid between 1 and 2 and 0 < ask limit 5 offset 2")
+    assert pushdown.columns is None
+    assert pushdown.predicates == [
+        Predicate('bid', '>=', 1), Predicate('bid', '<=', 2), Predicate('ask', '>', 0),
+    ]
+    assert pushdown.limit == 7
+    assert pushdown.match({'bid': 1.5, 'ask': 1}.get)
+    assert not pushdown.match({'bid': 2.5, 'ask': 1}.get)
+
+
+def test_pushdown_partial_where_disables_limit():
+    pushdown = _pushdown("select symbol from tws.quotes where symbol in ('A', 'B') or bid > 1 limit 1")
+    assert pushdown.predicates == []
+    assert pushdown.limit is None
+
+
+def test_pushdown_join_only_pushes_qualified_predicates():
+    sql = ("select q.bid, count(*) from tws.quotes q join tws.positions p on p.symbol = q.symbol "
+           "where q.symbol in ('AAPL', 'MSFT') and p.position > 0 limit 1")
+    quotes = _pushdown(sql, 0)
+    assert quotes.predicates == [Predicate('symbol', 'in', ('AAPL', 'MSFT'))]
+    assert quotes.limit is None
+    positions = _pushdown(sql, 1)
+    assert positions.predicates == [Predicate('position', '>', 0)]
+    assert positions.columns == {'symbol', 'position'}
+
+
+def test_session_counts_references_of_the_current_database(monkeypatch):
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {'demo': {'quotes': {'symbol': 'VARCHAR'}}}])
+    pushdowns = []
+
+    def provider(table_name, where, pushdown=None):
+        pushdowns.append(pushdown)
+        return [row for row in ({'symbol': 'AAPL'}, {'symbol': 'MSFT'}) if pushdown is None or pushdown.match(row.get)]
+
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'demo', provider)
+
+    async def run():
+        session = Session()
+        session.database = 'demo'
+        await session.handle_query("set @@broker_ql_result_cache = 0", {})
+        return await session.handle_query(
+            "select a.symbol, b.symbol from quotes a, demo.quotes b where a.symbol = 'AAPL' and b.symbol = 'MSFT'", {})
+
+    assert asyncio.run(run())[0] == [('AAPL', 'MSFT')]
+    # both aliases read the one snapshot of demo.quotes, so neither narrows it
+    assert pushdowns and not any(p.predicates for p in pushdowns)
@@ -0,0 +1,63 @@
+import math
+
+from ib_async import Contract, Ticker
+
+from broker_ql.pushdown import Predicate, Pushdown
+from broker_ql_plugin_tws.mappers import RowMapper
+from broker_ql_plugin_tws.quotes import QuoteStore
+from broker_ql_plugin_tws.wrapper import UNSET_DOUBLE
+
+COLUMNS = {'symbol': 'VARCHAR', 'bid': 'DOUBLE', 'ask': 'DOUBLE', 'last': 'DOUBLE', 'volume': 'DOUBLE'}
+# how tws.quotes read its rows off the tickers before the store
+MAPPER = RowMapper(COLUMNS, 'self', {'symbol': 'contract'})
+
+
+def _ticker(i):
+    last = 10.0 + i
+    return Ticker(contract=Contract(symbol=f"S{i % 7}"), bid=last - 0.01, ask=last + 0.01, last=last,
+                  volume=UNSET_DOUBLE if i % 5 == 0 else float(i * 100))
+
+
+def _normalized(rows):
+    return sorted(tuple(None if isinstance(v, float) and math.isnan(v) else v for v in row) for row in rows)
+
+
+def _check(store, tickers, pushdown=None):
+    table = store.snapshot(list(COLUMNS), pushdown)
+    assert list(table.columns) == MAPPER.names(pushdown)
+    assert _normalized(table.rows) == _normalized(MAPPER.rows(tickers, pushdown))
+
+
+def test_quote_store_matches_mapped_rows():
+    store = QuoteStore([c for c in COLUMNS if c != 'symbol'], capacity=4)
+    tickers = [_ticker(i) for i in range(10)]
+    # past the initial capacity, twice
+    store.update(tickers)
+    assert len(store) == 10 and len(store.live) == 16
+    _check(store, tickers)
+
+    tickers[3].last = 99.0
+    store.update([tickers[3]])
+    _check(store, tickers)
+
+    store.remove(tickers[2])
+    store.remove(tickers[2])
+    live = tickers[:2] + tickers[3:]
+    assert len(store) == 9
+    _check(store, live)
+
+    # sync drops the tickers gone from ib and adds new ones, reusing freed slots
+    live = live[1:] + [_ticker(10)]
+    store.sync(live)
+    assert len(store) == 9 and len(store.live) == 16
+    _check(store, live)
+
+    _check(store, live, Pushdown(predicates=[Predicate('symbol', '=', 'S3')]))
+    _check(store, live, Pushdown(columns={'symbol', 'last'}, predicates=[Predicate('symbol', 'in', ['S1', 'S4'])]))
+    _check(store, live, Pushdown(columns={'bid'}, predicates=[Predicate('last', '>', 14.0),
+                                                              Predicate('volume', '<=', 800.0)]))
+    _check(store, live, Pushdown(predicates=[Predicate('symbol', '=', 'missing')]))
+
+    limited = store.snapshot(list(COLUMNS), Pushdown(predicates=[Predicate('last', '>=', 12.0)], limit=3))
+    matching = _normalized(MAPPER.rows(live, Pushdown(predicates=[Predicate('last', '>=', 12.0)])))
+    assert len(limited.rows) == 3 and set(_normalized(limited.rows)) <= set(matching)
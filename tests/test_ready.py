@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from ib_async import Contract, Ticker
+from mysql_mimic.errors import MysqlError
+
+from broker_ql.session import Session
+from broker_ql_plugin_tws import data
+from broker_ql_plugin_tws.indexes import TickerIndex
+
+
+def test_statements_wait_for_their_database_only(monkeypatch):
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {
+        'slow': {'quotes': {'symbol': 'VARCHAR', 'last': 'DOUBLE'}},
+        'fast': {'quotes': {'symbol': 'VARCHAR', 'last': 'DOUBLE'}},
+    }])
+    rows = [{'symbol': 'AAPL', 'last': 100.0}]
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'slow', lambda table_name, where: rows)
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'fast', lambda table_name, where: rows)
+
+    async def run():
+        ready = asyncio.get_running_loop().create_future()
+        monkeypatch.setitem(Session.READY, 'slow', ready)
+        session = Session()
+        await session.handle_query("set broker_ql_ready_timeout = 0.05", {})
+
+        assert (await session.handle_query("select last from fast.quotes", {}))[0] == [(100.0,)]
+        with pytest.raises(MysqlError, match="not ready"):
+            await session.handle_query("select last from slow.quotes", {})
+
+        waiting = asyncio.ensure_future(session.handle_query("select symbol from slow.quotes", {}))
+        await asyncio.sleep(0.01)
+        ready.set_result(None)
+        assert (await waiting)[0] == [('AAPL',)]
+
+        failed = asyncio.get_running_loop().create_future()
+        failed.set_exception(ConnectionRefusedError("connection refused"))
+        Session.READY['slow'] = failed
+        with pytest.raises(MysqlError, match="failed to start: connection refused"):
+            await session.handle_query("select last from slow.quotes", {})
+
+    asyncio.run(run())
+
+
+def test_reconnect_resubscribes_every_ticker(monkeypatch):
+    # two strikes of one underlying share (symbol, sec_type, currency)
+    contracts = [Contract(symbol='SPY', secType='OPT', currency='USD', strike=k) for k in (400, 410)]
+    index = TickerIndex()
+    requested = []
+
+    async def connect(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(data, 'ticker_index', index)
+    monkeypatch.setattr(data.ib, 'connectAsync', connect)
+    monkeypatch.setattr(data.ib, 'reqMktData', requested.append)
+    monkeypatch.setitem(Session.READY, data.__database_name__, None)
+
+    async def run():
+        connected = asyncio.get_running_loop().create_future()
+        task = asyncio.ensure_future(data._keep_connected(connected))
+        try:
+            await connected
+            for contract in contracts:
+                index.add(Ticker(contract=contract))
+            # ib_async has reset its wrapper by the time disconnectedEvent fires
+            data.ib.disconnectedEvent.emit()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            assert requested == contracts
+        finally:
+            task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+import asyncio
+
+from ib_async import IB, BarData, Contract, Order, OrderState
+
+from broker_ql_plugin_tws.recording import Recorder, Replayer, frames
+
+
+def test_recording_replays_the_same_state(tmp_path):
+    path = str(tmp_path / 'session.log')
+
+    async def record():
+        ib = IB()
+        recorder = Recorder(path).install(ib)
+        aapl = Contract(symbol='AAPL', secType='STK', currency='USD', conId=265598)
+        wrapper = ib.wrapper
+        wrapper.startTicker(1, aapl, 'mktData')
+        ib.client._tcpDataArrived()
+        wrapper.priceSizeTick(1, 1, 189.5, 300.0)
+        wrapper.priceSizeTick(1, 2, 189.6, 200.0)
+        wrapper.position('U1', aapl, 10.0, 180.0)
+        wrapper.openOrder(7, aapl, Order(orderId=7, clientId=0, action='BUY', totalQuantity=5, orderType='LMT',
+                                         lmtPrice=185.0), OrderState(status='Submitted'))
+        ib.client._tcpDataProcessed()
+        recorder.mark('connected')
+        wrapper.startReq(2, aapl, container=[])
+        wrapper.historicalData(2, BarData(date='20240102', open=1.0, high=2.0, low=0.5, close=1.5, volume=10.0))
+        wrapper.historicalDataEnd(2, '', '')
+        recorder.close()
+        assert 'priceSizeTick' not in vars(wrapper)
+        return recorder.frames
+
+    recorded = asyncio.run(record())
+    assert [name for _, name, _ in frames(path)][:3] == ['startTicker', 'tcpDataArrived', 'priceSizeTick']
+    assert len(list(frames(path))) == recorded
+
+    async def replay():
+        ib, connected, batches = IB(), [], []
+        ib.pendingTickersEvent += lambda tickers: batches.append(len(tickers))
+        replayer = Replayer(path, speed=0, marks={'connected': lambda: connected.append(len(ib.openTrades()))})
+        await replayer.install(ib).run()
+        ticker, = ib.wrapper.tickers.values()
+        assert (ticker.bid, ticker.ask, ticker.askSize) == (189.5, 189.6, 200.0)
+        assert [p.position for p in ib.positions()] == [10.0]
+        assert connected == [1] and batches == [1] and replayer.frames == recorded
+
+        bars = await ib.reqHistoricalDataAsync(Contract(symbol='AAPL', conId=265598), '', '1 D', '1 day', 'TRADES', True)
+        assert [b.close for b in bars] == [1.5] and str(bars[0].date) == '2024-01-02'
+        qualified, = await ib.qualifyContractsAsync(Contract(symbol='AAPL'))
+        assert qualified.conId == 265598
+
+    asyncio.run(replay())
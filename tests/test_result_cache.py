@@ -0,0 +1,73 @@
+import asyncio
+
+from sqlglot.dialects.mysql import MySQL
+
+from broker_ql.result_cache import ResultCache
+from broker_ql.session import Session
+
+
+def test_result_cache_expiry_and_eviction(monkeypatch):
+    cache = ResultCache(size=2)
+    now = [100.0]
+    monkeypatch.setattr('broker_ql.result_cache.time.monotonic', lambda: now[0])
+    cache.put('a', [('db', 't')], 5, ([(1,)], ['x']))
+    cache.put('b', [('db', 't'), ('db', 'u')], 5, ([(2,)], ['x']))
+    cache.put('c', [('db', 'u')], 0, ([(3,)], ['x']))
+    assert cache.get('a') == ([(1,)], ['x']) and cache.get('c') is None
+    cache.put('d', [('db', 'v')], 5, ([(4,)], ['x']))
+    assert cache.get('b') is None and len(cache) == 2
+
+    cache.invalidate('db', 't')
+    assert cache.get('a') is None and cache.get('d') is not None
+    now[0] += 5
+    assert cache.get('d') is None and len(cache) == 0 and not cache._by_table
+
+
+def test_session_caches_selects_until_dml(monkeypatch):
+    cache = ResultCache()
+    monkeypatch.setattr(Session, 'RESULTS', cache)
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {'demo': {
+        'positions': {'symbol': 'VARCHAR', 'position': 'DOUBLE'},
+        'quotes': {'symbol': 'VARCHAR', 'last': 'DOUBLE'},
+    }}])
+    monkeypatch.setitem(Session.TABLE_FRESHNESS, 'demo', {'positions': 60})
+    positions = [{'symbol': 'AAPL', 'position': 10.0}]
+    fetches = []
+
+    def provider(table_name, where):
+        fetches.append(table_name)
+        return {'positions': positions, 'quotes': [{'symbol': 'AAPL', 'last': 1.0}]}[table_name]
+
+    def remover(session, table_name, rows):
+        positions.clear()
+
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'demo', provider)
+    monkeypatch.setitem(Session.DATA_REMOVERS, 'demo', remover)
+
+    async def run():
+        session = Session()
+        session.database = 'demo'
+        for _ in range(2):
+            assert (await session.handle_query("select symbol from positions", {}))[0] == [('AAPL',)]
+            await session.handle_query("select p.symbol from positions p join quotes q on p.symbol = q.symbol", {})
+        assert fetches == ['positions', 'positions', 'quotes', 'positions', 'quotes']
+
+        await session.handle_query("delete from positions where symbol = 'AAPL'", {})
+        assert (await session.handle_query("select symbol from positions", {}))[0] == []
+
+        await session.handle_query("set @@broker_ql_result_cache = 0", {})
+        await session.handle_query("select symbol from positions", {})
+        assert fetches.count('positions') == 6
+
+    asyncio.run(run())
+
+
+def test_session_skips_selects_that_may_not_repeat(monkeypatch):
+    monkeypatch.setitem(Session.TABLE_FRESHNESS, 'demo', {'positions': 60})
+    session = Session()
+    sources = {('demo', 'positions')}
+    assert session._freshness(MySQL().parse("select symbol from positions")[0], sources) == 60
+    for sql in ("select current_timestamp, symbol from positions", "select current_time, symbol from positions",
+                "select symbol from positions where d < current_date", "select rand(), symbol from positions"):
+        assert session._freshness(MySQL().parse(sql)[0], sources) == 0, sql
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from broker_ql.snapshot import SnapshotPool
+
+
+def test_snapshot_pool_shares_inflight_fetch():
+    pool = SnapshotPool()
+    calls = []
+
+    async def supplier():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [{'symbol': 'AAPL'}]
+
+    async def run():
+        first, second = await asyncio.gather(pool.fetch('quotes', supplier), pool.fetch('quotes', supplier))
+        assert first is second
+        assert len(pool) == 0
+        await pool.fetch('quotes', supplier)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_snapshot_pool_propagates_errors():
+    pool = SnapshotPool()
+
+    async def supplier():
+        await asyncio.sleep(0)
+        raise ValueError('boom')
+
+    async def run():
+        with pytest.raises(ValueError):
+            await pool.fetch('quotes', supplier)
+        assert await pool.fetch(None, lambda: [1]) == [1]
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+from collections import Counter
+
+from broker_ql import subscribe
+from broker_ql.session import Session
+from broker_ql.views import MaterializedViews
+
+
+def test_diff_keeps_duplicates():
+    previous, changes = subscribe.diff(Counter(), [('A', 1), ('A', 1)])
+    assert changes == [('+', 'A', 1), ('+', 'A', 1)]
+    _, changes = subscribe.diff(previous, [('A', 1), ('B', 2)])
+    assert changes == [('-', 'A', 1), ('+', 'B', 2)]
+
+
+def test_subscribe_pushes_changes_of_tracked_tables(monkeypatch):
+    views = MaterializedViews()
+    monkeypatch.setattr(subscribe, 'VIEWS', views)
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {'demo': {'quotes': {'symbol': 'VARCHAR', 'last': 'DOUBLE'}}}])
+    quotes = [{'symbol': 'AAPL', 'last': 100.0}, {'symbol': 'MSFT', 'last': 200.0}]
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'demo', lambda table_name, where: [dict(q) for q in quotes])
+    changed = views.track('demo', 'quotes')
+
+    async def run():
+        session = Session()
+        session.variables.set('broker_ql_subscribe_interval', 0.0)
+        batches = subscribe.subscribe(session, "SUBSCRIBE select symbol, last from demo.quotes where last > 150", {})
+        changes, columns = await batches.__anext__()
+        assert changes == [('+', 'MSFT', 200.0)] and list(columns) == ['symbol', 'last']
+
+        quotes[0]['last'] = 160.0
+        changed()
+        assert (await batches.__anext__())[0] == [('+', 'AAPL', 160.0)]
+        quotes[1]['last'] = 201.0
+        changed()
+        assert (await batches.__anext__())[0] == [('-', 'MSFT', 200.0), ('+', 'MSFT', 201.0)]
+        await batches.aclose()
+        assert not views._watchers
+
+    asyncio.run(run())
+
+
+def test_subscribe_on_quiet_tables_ends_when_the_client_goes(monkeypatch):
+    views = MaterializedViews()
+    monkeypatch.setattr(subscribe, 'VIEWS', views)
+    monkeypatch.setattr(subscribe, 'CLOSED_CHECK', 0.01)
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [lambda: {'demo': {'quotes': {'symbol': 'VARCHAR'}}}])
+    fetches = []
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'demo',
+                        lambda table_name, where: fetches.append(table_name) or [{'symbol': 'AAPL'}])
+    views.track('demo', 'quotes')
+    gone = []
+
+    async def run():
+        session = Session()
+        batches = subscribe.subscribe(session, "SUBSCRIBE select symbol from demo.quotes", {},
+                                      closed=lambda: bool(gone))
+        assert (await batches.__anext__())[0] == [('+', 'AAPL')]
+        waiting = asyncio.ensure_future(batches.__anext__())
+        await asyncio.sleep(0.05)
+        assert not waiting.done() and fetches == ['quotes']
+        gone.append(True)
+        try:
+            await asyncio.wait_for(waiting, 1)
+        except StopAsyncIteration:
+            pass
+        assert not views._watchers
+
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+import math
+
+from sqlglot.dialects.mysql import MySQL
+
+import broker_ql.connection  # noqa: F401 registers the TA aggregates
+from broker_ql.executor import execute
+from broker_ql.ta import TA_Stddev
+
+SCHEMA = {'tws': {'ohlcv': {'symbol': 'VARCHAR', 'high': 'DOUBLE', 'low': 'DOUBLE', 'close': 'DOUBLE'}}}
+CLOSES = {
+    'AAPL': [10.0, 11.0, 10.5, 12.0, float('nan'), 12.5, 13.0, 12.0, 14.0, 13.5],
+    'MSFT': [20.0, 19.0, 19.5, 18.0, 18.5, 17.0],
+}
+ROWS = [{'symbol': s, 'high': c + 1, 'low': c - 1, 'close': c} for s, closes in CLOSES.items() for c in closes]
+SQL = ("select symbol, ta_highest(close, 3, 1) as hh, ta_lowest(close, 3) as ll, ta_sma(close, 3) as sma, "
+       "ta_ema(close, 3) as ema, ta_rsi(close, 3) as rsi, ta_atr(high, low, close, 3) as atr, "
+       "ta_stddev(close, 3) as sd, ta_return(close, 2) as r from tws.ohlcv group by symbol order by symbol")
+
+
+def _ema(values, window, alpha):
+    value = sum(values[:window]) / window
+    for v in values[window:]:
+        value = alpha * v + (1 - alpha) * value
+    return value
+
+
+def _run(engine):
+    result = execute(MySQL().parse(SQL)[0], SCHEMA, {'tws': {'ohlcv': ROWS}}, engine=engine)
+    return [dict(zip(result.columns, row)) for row in result.rows]
+
+
+def test_ta_matches_reference_on_both_engines():
+    aapl = [c for c in CLOSES['AAPL'] if not math.isnan(c)]
+    changes = [b - a for a, b in zip(aapl, aapl[1:])]
+    gain = _ema([max(c, 0) for c in changes], 3, 1 / 3)
+    loss = _ema([max(-c, 0) for c in changes], 3, 1 / 3)
+    true_range = [2.0] + [max(2.0, 1 + abs(c)) for c in changes]
+    mean = (12.0 + 14.0 + 13.5) / 3
+    expected = {
+        'hh': 14.0, 'll': 12.0, 'sma': mean, 'ema': _ema(aapl, 3, 0.5), 'rsi': 100 - 100 / (1 + gain / loss),
+        'atr': _ema(true_range, 3, 1 / 3), 'sd': math.sqrt(sum((c - mean) ** 2 for c in (12.0, 14.0, 13.5)) / 3), 'r': 13.5 / 12.0 - 1,
+    }
+    for engine in ('python', 'vectorized'):
+        aapl_row, msft_row = _run(engine)
+        for name, value in expected.items():
+            assert math.isclose(aapl_row[name], value), (engine, name)
+        assert msft_row['hh'] == 19.5 and msft_row['rsi'] < 50
+
+
+def test_ta_stddev_of_prices_that_barely_move():
+    closes = [1e8 + 0.01, 1e8 + 0.02, float('nan'), 1e8 + 0.03]
+    # the last 3 rows, of which 2 have a close
+    assert math.isclose(TA_Stddev.apply(closes, [3]), 0.005, rel_tol=1e-5)
+    assert TA_Stddev.apply([1e8] * 5, [3]) == 0.0
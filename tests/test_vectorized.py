@@ -0,0 +1,54 @@
+import pytest
+from sqlglot.dialects.mysql import MySQL
+from sqlglot.executor import execute
+
+import broker_ql.connection  # noqa: F401 installs the optimizer rules and SQL functions
+from broker_ql.executor import execute as broker_execute
+from broker_ql.metrics import EXECUTE_SECONDS
+
+SCHEMA = {
+    'tws': {
+        'quotes': {'symbol': 'VARCHAR', 'bid': 'DOUBLE', 'ask': 'DOUBLE'},
+        'positions': {'account': 'VARCHAR', 'symbol': 'VARCHAR', 'position': 'DOUBLE'},
+    }
+}
+
+TABLES = {
+    'tws': {
+        'quotes': [
+            {'symbol': 'AAPL', 'bid': 170.5, 'ask': 170.7},
+            {'symbol': 'MSFT', 'bid': 310.1, 'ask': 310.4},
+            {'symbol': 'TSLA', 'bid': 240.0, 'ask': 240.3},
+        ],
+        'positions': [
+            {'account': 'U1', 'symbol': 'AAPL', 'position': 10.0},
+            {'account': 'U1', 'symbol': 'MSFT', 'position': -5.0},
+            {'account': 'U2', 'symbol': 'AAPL', 'position': 3.0},
+            {'account': 'U2', 'symbol': 'NVDA', 'position': 1.0},
+        ],
+    }
+}
+
+
+@pytest.mark.parametrize('sql', [
+    "select symbol, ask - bid as spread from tws.quotes where bid > 200 or symbol in ('AAPL') order by spread desc",
+    "select p.account, sum(p.position * q.bid) as exposure, count(*) as n from tws.positions p "
+    "join tws.quotes q on p.symbol = q.symbol group by p.account order by exposure",
+    "select p.symbol, q.bid from tws.positions p left join tws.quotes q on p.symbol = q.symbol",
+    "select count(*), max(bid), avg(ask) from tws.quotes",
+    "select symbol from tws.quotes where bid between 100 and 300 limit 2",
+])
+def test_vectorized_matches_python_executor(sql):
+    expected = execute(MySQL().parse(sql)[0], schema=SCHEMA, tables=TABLES)
+    result = broker_execute(MySQL().parse(sql)[0], SCHEMA, TABLES, engine='vectorized')
+    assert result.columns == expected.columns
+    assert result.rows == expected.rows
+
+
+def test_vectorized_falls_back_for_unsupported_functions(monkeypatch):
+    monkeypatch.setattr(EXECUTE_SECONDS, '_series', {})
+    sql = "select symbol, round(bid, 0) from tws.quotes"
+    expected = execute(MySQL().parse(sql)[0], schema=SCHEMA, tables=TABLES)
+    assert broker_execute(MySQL().parse(sql)[0], SCHEMA, TABLES, engine='vectorized').rows == expected.rows
+    # timed once, as the python run
+    assert list(EXECUTE_SECONDS._series) == [('python',)] and EXECUTE_SECONDS._series[('python',)][-2] == 1
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from mysql_mimic.errors import MysqlError
+
+from broker_ql.session import Session
+from broker_ql.views import MaterializedViews
+
+POSITIONS = [{'account': 'U1', 'symbol': 'AAPL', 'position': 10.0}, {'account': 'U1', 'symbol': 'MSFT', 'position': 5.0}]
+QUOTES = [{'symbol': 'AAPL', 'last': 100.0}, {'symbol': 'MSFT', 'last': 200.0}]
+
+
+def test_materialized_view_recomputes_only_after_changes(monkeypatch):
+    views = MaterializedViews()
+    monkeypatch.setattr('broker_ql.session.VIEWS', views)
+    monkeypatch.setattr(Session, 'SCHEMA', {})
+    monkeypatch.setattr(Session, 'SCHEMA_PROVIDERS', [views.schema, lambda: {'demo': {
+        'positions': {'account': 'VARCHAR', 'symbol': 'VARCHAR', 'position': 'DOUBLE'},
+        'quotes': {'symbol': 'VARCHAR', 'last': 'DOUBLE'},
+    }}])
+    fetches = []
+
+    def provider(table_name, where):
+        fetches.append(table_name)
+        return {'positions': POSITIONS, 'quotes': QUOTES}.get(table_name)
+
+    monkeypatch.setitem(Session.DATA_PROVIDERS, 'demo', provider)
+    changed = views.track('demo', 'quotes')
+    views.track('demo', 'positions')
+
+    async def run():
+        session = Session()
+        session.database = 'demo'
+        await session.handle_query("set broker_ql_view_refresh_interval = 0", {})
+
+        async def sql(query):
+            rows, columns = await session.handle_query(query, {})
+            return rows, list(columns)
+
+        await sql("create materialized view exposure as select p.account, sum(p.position * q.last) as value "
+                  "from positions p join quotes q on p.symbol = q.symbol group by p.account")
+        assert views.schema() == {'views': {'exposure': {'account': 'VARCHAR', 'value': 'DOUBLE'}}}
+        assert await sql("select * from views.exposure") == ([('U1', 2000.0)], ['account', 'value'])
+        assert await sql("select value from views.exposure") == ([(2000.0,)], ['value'])
+        assert fetches == ['positions', 'quotes']
+
+        QUOTES[0]['last'] = 110.0
+        changed()
+        changed()
+        assert (await sql("select value from views.exposure"))[0] == [(2100.0,)]
+        assert views.views['exposure'].refreshes == 2
+
+        # changes within the refresh interval of the last computation are served from the stored rows
+        await session.handle_query("set broker_ql_view_refresh_interval = 60", {})
+        QUOTES[0]['last'] = 120.0
+        changed()
+        assert (await sql("select value from views.exposure"))[0] == [(2100.0,)]
+        views.views['exposure'].computed_at -= 60
+        assert (await sql("select value from views.exposure"))[0] == [(2200.0,)]
+        assert views.views['exposure'].refreshes == 3
+        QUOTES[0]['last'] = 100.0
+
+        with pytest.raises(MysqlError):
+            await sql("create materialized view exposure as select 1 as x from quotes")
+        await sql("drop materialized view exposure")
+        await sql("drop materialized view if exists exposure")
+        assert views.schema() == {} and not views._dependents
+
+    asyncio.run(run())